@@ -0,0 +1,107 @@
+import time
+
+import click
+import httpx
+import orjson
+from click.exceptions import ClickException
+
+
+@click.command()
+@click.option(
+    "--url",
+    default="http://0.0.0.0:3000/api/importSourceLocations",
+    help="API URL to send source locations to",
+)
+@click.option(
+    "--token",
+    help="API token to use when sending data to the import API",
+    envvar="DESTINATION_TOKEN",
+    required=True,
+)
+@click.option(
+    "--records", default=5000, help="Total number of synthetic records to import"
+)
+@click.option("--batch-size", default=500, help="Records to send per request")
+@click.option(
+    "--source-name",
+    default="benchmark",
+    help="source_name to use - re-using it benchmarks updates rather than inserts",
+)
+def cli(url, token, records, batch_size, source_name):
+    "Measure /api/importSourceLocations throughput using synthetic records - for development environments only"
+    response = httpx.post(
+        url.replace("/api/importSourceLocations", "/api/startImportRun"),
+        headers={"Authorization": "Bearer {}".format(token)},
+    )
+    response.raise_for_status()
+    import_run_id = response.json()["import_run_id"]
+
+    created = updated = 0
+    start = time.perf_counter()
+    for batch_start in range(0, records, batch_size):
+        batch = [
+            synthetic_record(source_name, i)
+            for i in range(batch_start, min(batch_start + batch_size, records))
+        ]
+        batch_started = time.perf_counter()
+        response = httpx.post(
+            url + "?import_run_id={}".format(import_run_id),
+            data=b"\n".join(orjson.dumps(record) for record in batch),
+            headers={"Authorization": "Bearer {}".format(token)},
+            timeout=120,
+        )
+        try:
+            response.raise_for_status()
+        except Exception as e:
+            print(response.text)
+            raise ClickException(e)
+        data = response.json()
+        created += len(data["created"])
+        updated += len(data["updated"])
+        click.echo(
+            "{} records in {:.2f}s".format(
+                len(batch), time.perf_counter() - batch_started
+            )
+        )
+
+    elapsed = time.perf_counter() - start
+    click.echo(
+        "Imported {} records ({} created, {} updated) in {:.2f}s: {:.1f} records/second".format(
+            records, created, updated, elapsed, records / elapsed
+        )
+    )
+
+
+def synthetic_record(source_name, i):
+    latitude = 37 + (i % 1000) / 1000
+    longitude = -122 + (i // 1000) / 1000
+    return {
+        "source_uid": "{}:{}".format(source_name, i),
+        "source_name": source_name,
+        "name": "Benchmark location {}".format(i),
+        "latitude": latitude,
+        "longitude": longitude,
+        "import_json": {
+            "id": "{}:{}".format(source_name, i),
+            "name": "Benchmark location {}".format(i),
+            "address": {
+                "street1": "{} Benchmark Street".format(i),
+                "city": "San Francisco",
+                "state": "CA",
+                "zip": "94103",
+            },
+            "location": {"latitude": latitude, "longitude": longitude},
+            "links": [{"authority": "{}_store".format(source_name), "id": str(i)}],
+            "source": {
+                "source": source_name,
+                "id": str(i),
+                "fetched_from_uri": "https://example.com/benchmark",
+                "fetched_at": "2021-06-16T00:00:00+00:00",
+                "data": {},
+            },
+        },
+    }
+
+
+if __name__ == "__main__":
+    cli()
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.utils.safestring import mark_safe
 from reversion_compare.admin import CompareVersionAdmin
 
-from .models import ApiKey, ApiLog, Switch
+from .models import ApiKey, ApiLog, MapboxExport, Switch, WebhookEvent
 
 
 @admin.register(ApiLog)
@@ -20,6 +20,44 @@ class ApiLogAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(MapboxExport)
+class MapboxExportAdmin(admin.ModelAdmin):
+    list_display = (
+        "created_at",
+        "status",
+        "mode",
+        "num_features",
+        "upload_bytes",
+        "completed_at",
+    )
+    list_filter = ("status", "mode", "created_at")
+    raw_id_fields = ("api_key",)
+    # Hashes for every exported feature - too large to be useful here
+    exclude = ("feature_hashes",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer("feature_hashes")
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = (
+        "created_at",
+        "status",
+        "attempts",
+        "next_attempt_at",
+        "delivered_at",
+    )
+    list_filter = ("status", "created_at")
+    raw_id_fields = ("report",)
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 class YourKeysFilter(admin.SimpleListFilter):
     title = "Your keys"
     parameter_name = "yours"
@@ -1,12 +1,23 @@
-from typing import Callable
+from typing import Any, Callable, Dict
 
 import beeline  # type: ignore
 from api.models import ApiLog
 from api.utils import deny_if_api_is_disabled, jwt_auth, log_api_requests
 from core.models import CallRequest, Location
+from core.utils import timezone_for_point
+from django.conf import settings
 from django.http import HttpRequest, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from timezonefinder import TimezoneFinder
+
+# Everything location_to_call_json() reads, fetched along with the location
+LOCATION_SELECT_RELATED = (
+    "state",
+    "county",
+    "location_type",
+    "provider__provider_type",
+    "dn_latest_non_skip_report",
+)
+LOCATION_PREFETCH_RELATED = ("dn_latest_non_skip_report__availability_tags",)
 
 
 @csrf_exempt
@@ -22,13 +33,34 @@ def request_call(
             {"error": "Must be a POST"},
             status=400,
         )
+    # Claim up to this many call requests at once, returned as a list
+    # under "call_requests" - lets the app prefetch the next few calls
+    count = None
+    if request.GET.get("count"):
+        try:
+            count = int(request.GET["count"])
+        except ValueError:
+            count = 0
+        if not (1 <= count <= settings.MAX_CALL_REQUESTS_PER_CLAIM):
+            return JsonResponse(
+                {
+                    "error": "count must be between 1 and {}".format(
+                        settings.MAX_CALL_REQUESTS_PER_CLAIM
+                    )
+                },
+                status=400,
+            )
     # Override location selection: pass the public_id of a rocation to
     # skip the normal view selection code and return that ID specifically
     location_id = request.GET.get("location_id") or None
     # Skip updating the record to lock it from other callers - use for testing
     if location_id:
         try:
-            location = Location.objects.get(public_id=location_id)
+            locations = [
+                Location.objects.select_related(*LOCATION_SELECT_RELATED)
+                .prefetch_related(*LOCATION_PREFETCH_RELATED)
+                .get(public_id=location_id)
+            ]
         except Location.DoesNotExist:
             return JsonResponse(
                 {"error": "Location with that public_id does not exist"},
@@ -41,17 +73,32 @@ def request_call(
             state = "CA"
         if state == "all":
             state = None
-        call_request = CallRequest.get_call_request(
+        call_requests = CallRequest.get_call_requests(
             claim_for=None if no_claim else request.reporter,  # type: ignore[attr-defined]
             state=state,
+            count=count or 1,
+            qs=CallRequest.objects.select_related(
+                *("location__" + related for related in LOCATION_SELECT_RELATED)
+            ).prefetch_related(
+                *("location__" + related for related in LOCATION_PREFETCH_RELATED)
+            ),
         )
-        if call_request is None:
+        if not call_requests:
             return JsonResponse(
                 {"error": "Couldn't find somewhere to call"},
                 status=400,
             )
-        location = call_request.location
+        locations = [call_request.location for call_request in call_requests]
+
+    if count is None:
+        return JsonResponse(location_to_call_json(locations[0]), status=200)
+    return JsonResponse(
+        {"call_requests": [location_to_call_json(location) for location in locations]},
+        status=200,
+    )
 
+
+def location_to_call_json(location: Location) -> Dict[str, Any]:
     latest_report = location.dn_latest_non_skip_report
 
     county_record = {}
@@ -86,47 +133,41 @@ def request_call(
             "Last Updated": "YYYY-MM-DD",
         }
 
-    return JsonResponse(
-        {
-            "id": location.public_id,
-            "Name": location.name,
-            "Phone number": location.phone_number,
-            "Address": location.full_address,
-            "Internal notes": location.internal_notes,
-            "Hours": location.hours,
-            "State": location.state.abbreviation,
-            "County": location.county.name if location.county else None,
-            "Location Type": location.location_type.name,
-            "Affiliation": location.provider.name if location.provider else None,
-            "Latest report": str(latest_report.created_at) if latest_report else None,
-            "Latest report notes": [
-                latest_report.public_notes if latest_report else None
-            ],
-            "County vaccine info URL": [
-                location.county.vaccine_info_url if location.county else None
-            ],
-            "County Vaccine locations URL": [
-                location.county.vaccine_locations_url if location.county else None
-            ],
-            "Latest Internal Notes": [
-                latest_report.internal_notes if latest_report else None
-            ],
-            "Availability Info": list(
-                latest_report.availability_tags.values_list("name", flat=True)
-            )
-            if latest_report
-            else [],
-            "Number of Reports": location.reports.count(),
-            "county_record": county_record,
-            "provider_record": provider_record,
-            "county_age_floor_without_restrictions": county_age_floor_without_restrictions,
-            "timezone": TimezoneFinder().timezone_at(
-                lng=float(location.longitude), lat=float(location.latitude)
-            ),
-            # TODO: these should be True sometimes for locations that need updates:
-            "confirm_address": False,
-            "confirm_hours": False,
-            "confirm_website": False,
-        },
-        status=200,
-    )
+    return {
+        "id": location.public_id,
+        "Name": location.name,
+        "Phone number": location.phone_number,
+        "Address": location.full_address,
+        "Internal notes": location.internal_notes,
+        "Hours": location.hours,
+        "State": location.state.abbreviation,
+        "County": location.county.name if location.county else None,
+        "Location Type": location.location_type.name,
+        "Affiliation": location.provider.name if location.provider else None,
+        "Latest report": str(latest_report.created_at) if latest_report else None,
+        "Latest report notes": [latest_report.public_notes if latest_report else None],
+        "County vaccine info URL": [
+            location.county.vaccine_info_url if location.county else None
+        ],
+        "County Vaccine locations URL": [
+            location.county.vaccine_locations_url if location.county else None
+        ],
+        "Latest Internal Notes": [
+            latest_report.internal_notes if latest_report else None
+        ],
+        "Availability Info": [tag.name for tag in latest_report.availability_tags.all()]
+        if latest_report
+        else [],
+        "Number of Reports": location.dn_report_count,
+        "county_record": county_record,
+        "provider_record": provider_record,
+        "county_age_floor_without_restrictions": county_age_floor_without_restrictions,
+        # Calculated on save - locations not yet backfilled by the
+        # backfill_location_timezones command fall back to a lookup
+        "timezone": location.timezone
+        or timezone_for_point(location.latitude, location.longitude),
+        # TODO: these should be True sometimes for locations that need updates:
+        "confirm_address": False,
+        "confirm_hours": False,
+        "confirm_website": False,
+    }
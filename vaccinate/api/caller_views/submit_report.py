@@ -1,4 +1,3 @@
-import os
 import random
 from datetime import date, datetime
 from typing import Any, Callable, Dict, List, Optional, Tuple
@@ -6,13 +5,21 @@ from typing import Any, Callable, Dict, List, Optional, Tuple
 import beeline
 import orjson
 import pytz
-import requests
 from api.models import ApiLog
 from api.utils import deny_if_api_is_disabled, jwt_auth, log_api_requests
+from api.webhooks import queue_webhook
 from core.import_utils import derive_appointment_tag, resolve_availability_tags
-from core.models import AppointmentTag, CallRequest, Location, Report, Reporter
+from core.models import (
+    AppointmentTag,
+    CallRequest,
+    Location,
+    Report,
+    Reporter,
+    coalesce_location_denormalizations,
+)
 from dateutil import parser
 from django.conf import settings
+from django.db import transaction
 from django.http import HttpRequest, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from pydantic import BaseModel, Field, ValidationError, validator
@@ -122,8 +129,20 @@ def submit_report(
         kwargs["created_at"] = fake_timestamp
 
     beeline.add_context({"availability_tag_count": len(availability_tags)})
-    report = Report.objects.create(**kwargs)
-    report.availability_tags.add(*availability_tags)
+    # Update the location's denormalized columns once, after the tags
+    # have been added, rather than once for the report and again for the tags
+    with transaction.atomic(), coalesce_location_denormalizations():
+        report = Report.objects.create(**kwargs)
+        report.availability_tags.add(*availability_tags)
+        # Send it to Zapier too - queued in the outbox, so it is only
+        # sent if the report is saved, and delivered by /api/deliverWebhooks
+        # rather than holding up this response
+        if settings.ZAPIER_REPORT_URL:
+            queue_webhook(
+                settings.ZAPIER_REPORT_URL,
+                zapier_report_payload(request, report),
+                report=report,
+            )
 
     # Refresh Report from DB to get .public_id
     report.refresh_from_db()
@@ -144,32 +163,8 @@ def submit_report(
     )
 
     def log_created_report(log):
+        # Called before the log is saved, so it's saved with this
         log.created_report = report
-        log.save()
-
-        # Send it to Zapier too
-        if os.environ.get("ZAPIER_REPORT_URL"):
-            with beeline.tracer(name="zapier"):
-                requests.post(
-                    os.environ["ZAPIER_REPORT_URL"],
-                    json={
-                        "report_url": request.build_absolute_uri(
-                            "/admin/core/report/{}/change/".format(report.pk)
-                        ),
-                        "report_public_notes": report.public_notes,
-                        "report_internal_notes": report.internal_notes,
-                        "location_name": report.location.name,
-                        "location_full_address": report.location.full_address,
-                        "location_state": report.location.state.abbreviation,
-                        "reporter_name": report.reported_by.name,
-                        "reporter_id": report.reported_by.external_id,
-                        "reporter_role": report.reported_by.auth0_role_names,
-                        "availability_tags": list(
-                            report.availability_tags.values_list("name", flat=True)
-                        ),
-                    },
-                    timeout=5,
-                )
 
     on_request_logged(log_created_report)
 
@@ -185,6 +180,25 @@ def submit_report(
     )
 
 
+def zapier_report_payload(request: HttpRequest, report: Report) -> Dict[str, Any]:
+    return {
+        "report_url": request.build_absolute_uri(
+            "/admin/core/report/{}/change/".format(report.pk)
+        ),
+        "report_public_notes": report.public_notes,
+        "report_internal_notes": report.internal_notes,
+        "location_name": report.location.name,
+        "location_full_address": report.location.full_address,
+        "location_state": report.location.state.abbreviation,
+        "reporter_name": report.reported_by.name,
+        "reporter_id": report.reported_by.external_id,
+        "reporter_role": report.reported_by.auth0_role_names,
+        "availability_tags": list(
+            report.availability_tags.values_list("name", flat=True)
+        ),
+    }
+
+
 def user_should_have_reports_reviewed(
     user: Reporter, report: Dict[str, Any]
 ) -> Tuple[bool, str]:
@@ -1,12 +1,19 @@
 import pytest
 from core.models import (
+    AppointmentTag,
+    AvailabilityTag,
     CallRequest,
     CallRequestReason,
     County,
     Location,
     LocationType,
+    Provider,
+    ProviderType,
+    Reporter,
     State,
 )
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 
@@ -122,3 +129,134 @@ def test_request_call(client, jwt_id_token):
         "confirm_website": False,
         "timezone": "America/Los_Angeles",
     }
+
+
+@pytest.mark.django_db
+def test_request_call_count(client, jwt_id_token, ten_locations):
+    reason = CallRequestReason.objects.get(short_reason="New location")
+    for i, location in enumerate(ten_locations[:5]):
+        location.call_requests.create(
+            call_request_reason=reason, vesting_at=timezone.now(), priority=i
+        )
+    for count in ("0", "11", "x"):
+        response = client.post(
+            "/api/requestCall?state=OR&count={}".format(count),
+            {},
+            content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer {}".format(jwt_id_token),
+        )
+        assert response.status_code == 400
+        assert response.json() == {"error": "count must be between 1 and 10"}
+
+    response = client.post(
+        "/api/requestCall?state=OR&count=3",
+        {},
+        content_type="application/json",
+        HTTP_AUTHORIZATION="Bearer {}".format(jwt_id_token),
+    )
+    assert response.status_code == 200
+    call_requests = response.json()["call_requests"]
+    # The three highest priority, in queue order, each with the full payload
+    assert [c["id"] for c in call_requests] == [
+        location.public_id for location in reversed(ten_locations[2:5])
+    ]
+    assert call_requests[0]["Name"] == ten_locations[4].name
+    assert call_requests[0]["State"] == "OR"
+    claimed = CallRequest.objects.exclude(claimed_by=None)
+    assert {c.location_id for c in claimed} == {
+        location.id for location in ten_locations[2:5]
+    }
+    assert len({c.claimed_until for c in claimed}) == 1
+
+    # Only two are left to claim
+    response = client.post(
+        "/api/requestCall?state=OR&count=3",
+        {},
+        content_type="application/json",
+        HTTP_AUTHORIZATION="Bearer {}".format(jwt_id_token),
+    )
+    assert [c["id"] for c in response.json()["call_requests"]] == [
+        ten_locations[1].public_id,
+        ten_locations[0].public_id,
+    ]
+
+
+@pytest.mark.django_db
+def test_request_call_fixed_number_of_queries(client, jwt_id_token, ten_locations):
+    county = County.objects.create(
+        name="Multnomah",
+        fips_code="41051",
+        state=State.objects.get(abbreviation="OR"),
+    )
+    provider = Provider.objects.create(
+        name="Test Pharmacy",
+        provider_type=ProviderType.objects.get_or_create(name="Pharmacy")[0],
+    )
+    reporter = Reporter.objects.get_or_create(external_id="test:1")[0]
+    web = AppointmentTag.objects.get(slug="web")
+    yes_tags = AvailabilityTag.objects.filter(group="yes")[:2]
+    # Locations 0-5 have a county, a provider and reports with tags
+    for location in ten_locations[0:6]:
+        location.county = county
+        location.provider = provider
+        location.save()
+        for _ in range(2):
+            report = location.reports.create(
+                reported_by=reporter, report_source="ca", appointment_tag=web
+            )
+            report.availability_tags.add(*yes_tags)
+    reason = CallRequestReason.objects.get(short_reason="New location")
+    priorities = {9: 20, 0: 10, 1: 5, 2: 5, 3: 5, 4: 5, 5: 5}
+    for i, location in enumerate(ten_locations):
+        location.call_requests.create(
+            call_request_reason=reason,
+            vesting_at=timezone.now(),
+            priority=priorities.get(i, 0),
+        )
+
+    def count_queries(count=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(
+                "/api/requestCall?state=OR{}".format(
+                    "&count={}".format(count) if count else ""
+                ),
+                {},
+                content_type="application/json",
+                HTTP_AUTHORIZATION="Bearer {}".format(jwt_id_token),
+            )
+        assert response.status_code == 200
+        return response.json(), len(queries)
+
+    # The first request also sets up the reporter
+    count_queries()
+    # One location costs as many queries as five
+    data, num_queries = count_queries()
+    assert data["id"] == ten_locations[0].public_id
+    data, batch_num_queries = count_queries(5)
+    assert [c["id"] for c in data["call_requests"]] == [
+        location.public_id for location in reversed(ten_locations[1:6])
+    ]
+    assert data["call_requests"][0]["Number of Reports"] == 2
+    assert data["call_requests"][0]["Affiliation"] == "Test Pharmacy"
+    assert data["call_requests"][0]["Availability Info"] == sorted(
+        tag.name for tag in yes_tags
+    )
+    assert batch_num_queries == num_queries
+
+
+@pytest.mark.django_db
+def test_refill_call_queue(client, api_key, settings, ten_locations):
+    settings.MIN_CALL_REQUEST_QUEUE_ITEMS = 4
+    settings.MIN_CALL_REQUEST_QUEUE_ITEMS_BY_STATE = {"OR": 2}
+    response = client.get(
+        "/api/refillCallQueue", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    )
+    assert response.status_code == 400
+    response = client.post(
+        "/api/refillCallQueue", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["ok"] == 1
+    assert data["added"] == {"OR": 2, "all": 2}
+    assert CallRequest.available_requests().count() == 4
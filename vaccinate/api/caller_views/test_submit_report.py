@@ -5,9 +5,11 @@ from datetime import datetime
 
 import orjson
 import pytest
-from api.models import ApiLog
+from api.models import ApiLog, WebhookEvent
 from core.models import CallRequest, CallRequestReason, Location, Report, State
 from dateutil import parser
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 tests_dir = pathlib.Path(__file__).parent / "test-data" / "submitReport"
@@ -60,9 +62,9 @@ def test_submit_report_api_invalid_json(client, jwt_id_token):
 @pytest.mark.django_db
 @pytest.mark.parametrize("json_path", tests_dir.glob("*.json"))
 def test_submit_report_api_example(
-    client, json_path, jwt_id_token, monkeypatch, requests_mock
+    client, json_path, jwt_id_token, settings, requests_mock
 ):
-    monkeypatch.setenv("ZAPIER_REPORT_URL", "https://zapier.example.com/")
+    settings.ZAPIER_REPORT_URL = "https://zapier.example.com/"
     mocked_zapier = requests_mock.post(
         "https://zapier.example.com/",
         json={
@@ -143,6 +145,8 @@ def test_submit_report_api_example(
     assert response.json()["created"] == [report.public_id]
     assert report.pid == response.json()["created"][0]
     assert report.call_request == call_request
+    # The API log records the report it created
+    assert ApiLog.objects.order_by("-id")[0].created_report == report
     expected_field_values = Report.objects.filter(pk=report.pk).values(
         *list(fixture["expected_fields"].keys())
     )[0]
@@ -181,9 +185,13 @@ def test_submit_report_api_example(
         "today": 1,
     }
 
-    # Should have posted to Zapier
-    assert mocked_zapier.called_once
-    assert orjson.loads(mocked_zapier.last_request.body) == {
+    # Should have queued a post to Zapier, without sending it yet
+    assert not mocked_zapier.called
+    webhook_event = WebhookEvent.objects.get()
+    assert webhook_event.url == "https://zapier.example.com/"
+    assert webhook_event.report == report
+    assert webhook_event.status == "pending"
+    assert webhook_event.payload == {
         "report_url": "http://testserver/admin/core/report/{}/change/".format(
             report.pk
         ),
@@ -251,3 +259,46 @@ def test_submit_report_updates_location_fields(location, client, jwt_id_token):
     assert location2.accepts_walkins is False
     assert location2.vaccines_offered_provenance_report == report
     assert location2.appointments_walkins_provenance_report == report
+
+
+def test_submit_report_denormalizes_location_once(
+    location, client, jwt_id_token, monkeypatch
+):
+    denormalized = []
+    original = Location.update_denormalizations
+
+    def record_calls(self):
+        denormalized.append(self.pk)
+        return original(self)
+
+    monkeypatch.setattr(Location, "update_denormalizations", record_calls)
+    random.seed(1)
+    with CaptureQueriesContext(connection) as captured:
+        response = client.post(
+            "/api/submitReport",
+            {
+                "Location": location.public_id,
+                "Availability": [
+                    "Yes: appointment required",
+                    "Vaccinating essential workers",
+                ],
+            },
+            content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer {}".format(jwt_id_token),
+        )
+    random.seed(int(time.time()))
+    assert response.status_code == 200
+    assert denormalized == [location.pk]
+    # update_denormalizations() loads every report for the location - this
+    # used to happen once for the new report and again for its tags
+    report_list_queries = [
+        q["sql"]
+        for q in captured.captured_queries
+        if q["sql"].startswith('SELECT "report".')
+        and 'ORDER BY "report"."created_at" DESC' in q["sql"]
+        and "LIMIT" not in q["sql"]
+    ]
+    assert len(report_list_queries) == 1
+    location.refresh_from_db()
+    assert location.dn_latest_report.public_id == response.json()["created"][0]
+    assert location.dn_yes_report_count == 1
@@ -1,95 +1,75 @@
+import hashlib
+import io
+import os
+import secrets
+import tempfile
+
 import beeline
 import orjson
 import requests
 from api.utils import log_api_requests, require_api_key
 from core.expansions import VaccineFinderInventoryExpansion
-from core.models import Location
+from core.models import LocationExport
+from core.utils import keyset_pagination_iterator
 from django.conf import settings
+from django.db import connection, transaction
 from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
 from django.utils.html import escape
 from django.views.decorators.csrf import csrf_exempt
+from sentry_sdk import capture_exception
+
+from .models import MapboxExport
+
+MAPBOX_SOURCE_PATH = "/tilesets/v1/sources/calltheshots/vial"
+MAPBOX_PUBLISH_PATH = "/tilesets/v1/calltheshots.vaccinatethestates/publish"
 
-from .search import filter_for_export
+# Serialized features are kept in memory up to this size, then spill to disk
+SPOOL_MAX_SIZE = 10 * 1024 * 1024
+# Postgres advisory lock key held while an export runs, so that concurrent
+# exports don't both diff against the same previous upload
+MAPBOX_EXPORT_LOCK_KEY = 0x6D6170626F78
 
 
 def _mapbox_locations_queryset(skip_filter_for_exports=False):
-    qs = (
-        Location.objects.all()
-        .select_related(
-            "location_type",
-            "dn_latest_non_skip_report",
-            "dn_latest_non_skip_report__appointment_tag",
-            "county",
-            "state",
-            "provider",
-        )
-        .prefetch_related("dn_latest_non_skip_report__availability_tags")
-        .only(
-            "public_id",
-            "name",
-            "location_type__name",
-            "website",
-            "full_address",
-            "county__name",
-            "county__vaccine_reservations_url",
-            "state__abbreviation",
-            "phone_number",
-            "google_places_id",
-            "vaccinefinder_location_id",
-            "vaccinespotter_location_id",
-            "hours",
-            "dn_latest_non_skip_report__planned_closure",
-            "dn_latest_non_skip_report__public_notes",
-            "dn_latest_non_skip_report__appointment_tag__slug",
-            "dn_latest_non_skip_report__appointment_tag__name",
-            "dn_latest_non_skip_report__appointment_details",
-            "dn_latest_non_skip_report__location_id",
-            "dn_latest_non_skip_report__created_at",
-            "dn_latest_non_skip_report__vaccines_offered",
-            "dn_latest_non_skip_report__restriction_notes",
-            "website",
-            "provider__appointments_url",
-            "longitude",
-            "latitude",
-        )
-        .exclude(soft_deleted=True)
-    )
+    # Rows in the location_export materialized view are already joined
+    # with everything the GeoJSON needs
+    qs = LocationExport.objects.all()
     if not skip_filter_for_exports:
-        qs = filter_for_export(qs)
+        qs = qs.exportable()
     return qs
 
 
 def _mapbox_geojson(location, expansion):
+    "location is a LocationExport row"
     properties = {
         "id": location.public_id,
         "name": location.name,
-        "location_type": location.location_type.name,
+        "location_type": location.location_type_name,
         "website": location.website,
         "address": location.full_address,
-        "county": location.county.name if location.county else None,
-        "state_abbreviation": location.state.abbreviation,
+        "county": location.county_name,
+        "state_abbreviation": location.state_abbreviation,
         "phone_number": location.phone_number,
         "google_places_id": location.google_places_id,
         "vaccinefinder_location_id": location.vaccinefinder_location_id,
         "vaccinespotter_location_id": location.vaccinespotter_location_id,
         "hours": location.hours,
     }
-    report = None
-    if location.dn_latest_non_skip_report:
-        report = location.dn_latest_non_skip_report
+    if location.report_id:
         properties.update(
             {
-                "public_notes": report.public_notes,
-                "appointment_method": report.appointment_tag.name,
-                "appointment_details": report.full_appointment_details(location),
-                "latest_contact": report.created_at.isoformat(),
-                "planned_closure": report.planned_closure.isoformat()
-                if report.planned_closure
+                "public_notes": location.report_public_notes,
+                "appointment_method": location.appointment_tag_name,
+                "appointment_details": location.full_appointment_details(),
+                "latest_contact": location.report_created_at.isoformat(),
+                "planned_closure": location.report_planned_closure.isoformat()
+                if location.report_planned_closure
                 else None,
-                "restriction_notes": report.restriction_notes,
+                "restriction_notes": location.report_restriction_notes,
             }
         )
-        tag_slugs = {tag.slug for tag in report.availability_tags.all()}
+        tag_slugs = set(location.availability_tag_slugs)
         if "appointments_available" in tag_slugs:
             properties["available_appointments"] = True
             properties["accepts_appointments"] = True
@@ -107,8 +87,8 @@ def _mapbox_geojson(location, expansion):
     vaccines_offered = None
     if vaccinefinder_inventory:
         vaccines_offered = vaccinefinder_inventory
-    elif report:
-        vaccines_offered = report.vaccines_offered
+    elif location.report_id:
+        vaccines_offered = location.report_vaccines_offered
 
     fidelity = 0
     for property, vaccine_name in (
@@ -124,6 +104,8 @@ def _mapbox_geojson(location, expansion):
 
     return {
         "type": "Feature",
+        # Appended features replace the existing feature with the same id
+        "id": location.public_id,
         "properties": properties,
         "geometry": {
             "type": "Point",
@@ -142,7 +124,7 @@ def export_mapbox_preview(request):
     if ids:
         locations = locations.filter(public_id__in=ids)
     # Maximum of 20 for the debugging preview
-    locations = locations.order_by("-id")[:20]
+    locations = locations.order_by("-pk")[:20]
 
     expansion = VaccineFinderInventoryExpansion(load_all=not ids)
 
@@ -173,53 +155,256 @@ def export_mapbox_preview(request):
     )
 
 
-@require_api_key
-@log_api_requests
-@csrf_exempt
-def export_mapbox(request, on_request_logged):
-    if request.method != "POST":
-        return JsonResponse(
-            {"error": "Must be a POST"},
-            status=400,
-        )
+class MultipartFileBody:
+    """A multipart/form-data body that streams a single file from disk.
+
+    requests sends any object with a read() method and a known length as
+    a fixed-length streaming body, so the file is never read into memory
+    in full the way it would be by ``requests.put(files=...)``.
+    """
 
+    def __init__(self, fp, field_name: str, filename: str, content_type: str):
+        self.boundary = secrets.token_hex(16)
+        head = (
+            "--{}\r\n"
+            'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'
+            "Content-Type: {}\r\n\r\n".format(
+                self.boundary, field_name, filename, content_type
+            )
+        ).encode("utf-8")
+        tail = "\r\n--{}--\r\n".format(self.boundary).encode("utf-8")
+        fp.seek(0, os.SEEK_END)
+        file_size = fp.tell()
+        fp.seek(0)
+        self._parts = [io.BytesIO(head), fp, io.BytesIO(tail)]
+        self._length = len(head) + file_size + len(tail)
+
+    @property
+    def content_type(self) -> str:
+        return "multipart/form-data; boundary={}".format(self.boundary)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+        while self._parts and (size < 0 or size > 0):
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(chunks)
+
+
+def _mapbox_url(path: str) -> str:
+    return (
+        f"{settings.MAPBOX_API_URL}{path}?access_token={settings.MAPBOX_ACCESS_TOKEN}"
+    )
+
+
+def write_mapbox_features(fp, append_fp=None, previous_hashes=None) -> dict:
+    """
+    Writes newline-delimited GeoJSON features to fp and returns a dictionary
+    of public_id => content hash for every feature written.
+
+    If append_fp is provided, features that are new or different from
+    previous_hashes are also written to that file.
+    """
+    previous_hashes = previous_hashes or {}
     locations = _mapbox_locations_queryset()
     expansion = VaccineFinderInventoryExpansion(load_all=True)
+    feature_hashes = {}
+    # Keyset pagination keeps a single batch of locations in memory at a time
+    for location in keyset_pagination_iterator(locations, batch_size=1000):
+        line = orjson.dumps(
+            _mapbox_geojson(location, expansion), option=orjson.OPT_APPEND_NEWLINE
+        )
+        fp.write(line)
+        feature_hashes[location.public_id] = hashlib.sha256(line).hexdigest()
+        if (
+            append_fp is not None
+            and previous_hashes.get(location.public_id)
+            != feature_hashes[location.public_id]
+        ):
+            append_fp.write(line)
+    return feature_hashes
+
 
-    post_data = []
-    for location in locations.all():
-        post_data.append(
+def write_removed_features(fp, public_ids) -> None:
+    "Writes a feature with no geometry for each id, deleting it from the source"
+    for public_id in public_ids:
+        fp.write(
             orjson.dumps(
-                _mapbox_geojson(location, expansion), option=orjson.OPT_APPEND_NEWLINE
+                {
+                    "type": "Feature",
+                    "id": public_id,
+                    "properties": {},
+                    "geometry": None,
+                },
+                option=orjson.OPT_APPEND_NEWLINE,
             )
         )
 
-    access_token = settings.MAPBOX_ACCESS_TOKEN
-    if not access_token:
-        return JsonResponse(
-            {
-                "upload": f"Would upload {sum([len(x) for x in post_data])} bytes",
-            }
-        )
 
-    with beeline.tracer(name="geojson-upload"):
-        upload_resp = requests.put(
-            f"https://api.mapbox.com/tilesets/v1/sources/calltheshots/vial?access_token={access_token}",
-            files={"file": b"".join(post_data)},
-            timeout=30,
-        )
-        upload_resp.raise_for_status()
+def _previous_feature_hashes():
+    "Feature hashes of what is currently in the published Mapbox tileset"
+    return (
+        MapboxExport.objects.filter(feature_hashes__isnull=False)
+        .order_by("-id")
+        .values_list("feature_hashes", flat=True)
+        .first()
+    )
+
 
-    with beeline.tracer(name="geojson-publish"):
-        publish_resp = requests.post(
-            f"https://api.mapbox.com/tilesets/v1/calltheshots.vaccinatethestates/publish?access_token={access_token}",
-            timeout=30,
+def _save_feature_hashes(export, feature_hashes):
+    """Record what the published tileset contains - only once the publish
+    succeeds, so a failed publish is retried by the next export. Only the
+    latest export keeps its (large) hashes."""
+    export.feature_hashes = feature_hashes
+    with transaction.atomic():
+        MapboxExport.objects.filter(feature_hashes__isnull=False).exclude(
+            pk=export.pk
+        ).update(feature_hashes=None)
+        export.save()
+
+
+def _choose_export_mode(export, previous_hashes, feature_hashes):
+    if previous_hashes is None:
+        return MapboxExport.Mode.FULL
+    previous_ids = set(previous_hashes)
+    current_ids = set(feature_hashes)
+    export.num_added = len(current_ids - previous_ids)
+    export.num_removed = len(previous_ids - current_ids)
+    export.num_changed = sum(
+        1
+        for public_id in current_ids & previous_ids
+        if previous_hashes[public_id] != feature_hashes[public_id]
+    )
+    if export.force_full:
+        return MapboxExport.Mode.FULL
+    if not (export.num_added or export.num_removed or export.num_changed):
+        return MapboxExport.Mode.UNCHANGED
+    # Added and changed features are appended, replacing any feature with
+    # the same id, and removed features are appended without a geometry -
+    # but past a point a full replace is smaller and leaves a tidier source
+    if (
+        export.num_added + export.num_changed + export.num_removed
+        > settings.MAPBOX_EXPORT_MAX_APPEND_FEATURES
+    ):
+        return MapboxExport.Mode.FULL
+    return MapboxExport.Mode.APPEND
+
+
+def _upload_to_mapbox(method, fp):
+    body = MultipartFileBody(fp, "file", "vial.ndjson", "application/x-ndjson")
+    response = requests.request(
+        method,
+        _mapbox_url(MAPBOX_SOURCE_PATH),
+        data=body,
+        headers={"Content-Type": body.content_type},
+        timeout=30,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+@beeline.traced(name="run_mapbox_export")
+def run_mapbox_export(export_id: int) -> MapboxExport:
+    with connection.cursor() as cursor:
+        # Wait for any export that is already running to finish
+        cursor.execute("select pg_advisory_lock(%s)", [MAPBOX_EXPORT_LOCK_KEY])
+        try:
+            return _run_mapbox_export(export_id)
+        finally:
+            cursor.execute("select pg_advisory_unlock(%s)", [MAPBOX_EXPORT_LOCK_KEY])
+
+
+def _run_mapbox_export(export_id: int) -> MapboxExport:
+    export = MapboxExport.objects.get(pk=export_id)
+    export.status = MapboxExport.Status.RUNNING
+    export.started_at = timezone.now()
+    export.save()
+    try:
+        previous_hashes = _previous_feature_hashes()
+        # This reads location_export as of its last scheduled refresh - see
+        # /api/refreshLocationExport
+        with tempfile.SpooledTemporaryFile(
+            max_size=SPOOL_MAX_SIZE
+        ) as fp, tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as append_fp:
+            with beeline.tracer(name="geojson-serialize"):
+                feature_hashes = write_mapbox_features(fp, append_fp, previous_hashes)
+            export.num_features = len(feature_hashes)
+            export.mode = _choose_export_mode(export, previous_hashes, feature_hashes)
+            beeline.add_context_field("mapbox_export_mode", export.mode)
+            if export.mode == MapboxExport.Mode.APPEND:
+                write_removed_features(
+                    append_fp, sorted(set(previous_hashes) - set(feature_hashes))
+                )
+            upload_fp = append_fp if export.mode == MapboxExport.Mode.APPEND else fp
+            export.upload_bytes = (
+                0 if export.mode == MapboxExport.Mode.UNCHANGED else upload_fp.tell()
+            )
+
+            if not settings.MAPBOX_ACCESS_TOKEN:
+                export.upload_response = f"Would upload {export.upload_bytes} bytes"
+            elif export.mode != MapboxExport.Mode.UNCHANGED:
+                with beeline.tracer(name="geojson-upload"):
+                    export.upload_response = _upload_to_mapbox(
+                        # POST appends to the tileset source, PUT replaces it
+                        "POST" if export.mode == MapboxExport.Mode.APPEND else "PUT",
+                        upload_fp,
+                    )
+
+                with beeline.tracer(name="geojson-publish"):
+                    publish_resp = requests.post(
+                        _mapbox_url(MAPBOX_PUBLISH_PATH),
+                        timeout=30,
+                    )
+                    publish_resp.raise_for_status()
+                    export.publish_response = publish_resp.json()
+                _save_feature_hashes(export, feature_hashes)
+        export.status = MapboxExport.Status.COMPLETE
+    except Exception as e:
+        capture_exception(e)
+        export.status = MapboxExport.Status.FAILED
+        export.error = str(e)
+    export.completed_at = timezone.now()
+    export.save()
+    return export
+
+
+@require_api_key
+@log_api_requests
+@csrf_exempt
+def export_mapbox(request, on_request_logged):
+    if request.method != "POST":
+        return JsonResponse(
+            {"error": "Must be a POST"},
+            status=400,
         )
-        publish_resp.raise_for_status()
 
-    return JsonResponse(
-        {
-            "upload": upload_resp.json(),
-            "publish": publish_resp.json(),
-        }
+    MapboxExport.fail_stale_exports()
+    export = MapboxExport.objects.create(
+        api_key=request.api_key, force_full=bool(request.GET.get("full"))
     )
+    # Run by the scheduler, in this request - work left to a background
+    # thread gets hardly any CPU once the response is sent, and is lost if
+    # the instance is stopped
+    export = run_mapbox_export(export.pk)
+
+    data = export.as_json()
+    data["status_url"] = request.build_absolute_uri(f"/api/exportMapbox/{export.pk}")
+    return JsonResponse(data)
+
+
+@require_api_key
+def export_mapbox_status(request, export_id):
+    MapboxExport.fail_stale_exports()
+    try:
+        export = MapboxExport.objects.get(pk=export_id)
+    except MapboxExport.DoesNotExist:
+        return JsonResponse({"error": "Export does not exist"}, status=404)
+    return JsonResponse(export.as_json())
@@ -0,0 +1,461 @@
+"""
+Set-based implementation of /api/importSourceLocations
+
+A batch of records is written using a handful of queries - one
+INSERT ... ON CONFLICT for the source locations themselves, then bulk
+inserts for concordance identifiers and the rows that link them - rather
+than several queries for every record.
+
+Clients can avoid sending records we already have by comparing content
+hashes first, using diff_source_locations() and source_locations_digest()
+"""
+import hashlib
+import time
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import beeline
+import orjson
+from bigmap.transform import source_to_location
+from core.models import (
+    ConcordanceIdentifier,
+    ImportRun,
+    Location,
+    LocationType,
+    SourceLocation,
+    State,
+)
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from psycopg2.extras import execute_values
+from vaccine_feed_ingest_schema.schema import ImportSourceLocation, Link
+
+UPSERT_SQL = """
+insert into source_location (
+    source_uid, source_name, name, content_hash, latitude, longitude, point,
+    import_json, import_run_id, last_imported_at, created_at, matched_location_id
+)
+values %s
+on conflict (source_uid) do update set
+    source_name = excluded.source_name,
+    name = excluded.name,
+    content_hash = excluded.content_hash,
+    latitude = excluded.latitude,
+    longitude = excluded.longitude,
+    point = excluded.point,
+    import_json = excluded.import_json,
+    import_run_id = excluded.import_run_id,
+    last_imported_at = excluded.last_imported_at,
+    -- Never replace an existing match
+    matched_location_id = coalesce(
+        source_location.matched_location_id, excluded.matched_location_id
+    )
+returning id, source_uid, matched_location_id
+"""
+
+UPSERT_TEMPLATE = """(
+    %s, %s, %s, %s, %s, %s,
+    ST_SetSRID(ST_MakePoint(%s::float8, %s::float8), 4326)::geography,
+    %s::jsonb, %s, %s, %s, %s
+)"""
+
+
+class ImportSourceLocationWithContentHash(ImportSourceLocation):
+    content_hash: Optional[str]
+
+
+class ImportResult(NamedTuple):
+    created: List[int]
+    updated: List[int]
+    unchanged: List[int]
+    derived_locations: int
+    derive_seconds: float
+
+
+class ExistingSourceLocation(NamedTuple):
+    pk: int
+    matched_location_id: Optional[int]
+    content_hash: Optional[str]
+
+
+class UnknownMatchedLocations(Exception):
+    def __init__(self, public_ids):
+        self.public_ids = public_ids
+        super().__init__(
+            "Location does not exist: {}".format(", ".join(sorted(public_ids)))
+        )
+
+
+def build_location_from_source_location(
+    source_location: SourceLocation, user: Optional[User]
+):
+    location_kwargs = source_to_location(source_location.import_json)
+    location_kwargs["created_by"] = user
+    if location_kwargs["state"] is not None:
+        location_kwargs["state"] = State.objects.get(
+            abbreviation=location_kwargs["state"].upper()
+        )
+    unknown_location_type = LocationType.objects.get(name="Unknown")
+
+    location = Location.objects.create(
+        location_type=unknown_location_type,
+        import_run=source_location.import_run,
+        **location_kwargs,
+    )
+    location.concordances.set(source_location.concordances.all())
+    location.save()
+    source_location.matched_location = location
+    source_location.save()
+
+    return location
+
+
+@beeline.traced(name="derive_details_for_locations")
+def derive_details_for_locations(location_ids: Set[int]) -> Tuple[int, float]:
+    "Derive details once for each location, returns (count, seconds taken)"
+    start = time.perf_counter()
+    Location.derive_details_bulk(location_ids)
+    return len(location_ids), time.perf_counter() - start
+
+
+def _links_for_record(record: ImportSourceLocation) -> List[Link]:
+    import_json = record.import_json
+    links = list(import_json.links) if import_json.links is not None else []
+    # Always use the (source, id) as a concordance
+    links.append(Link(authority=import_json.source.source, id=import_json.source.id))
+    return links
+
+
+def _is_unchanged(
+    record: ImportSourceLocationWithContentHash,
+    existing: Optional[ExistingSourceLocation],
+) -> bool:
+    if existing is None or not record.content_hash:
+        return False
+    if record.content_hash != existing.content_hash:
+        return False
+    wants_match = record.match is not None and record.match.action in (
+        "existing",
+        "new",
+    )
+    return not (wants_match and existing.matched_location_id is None)
+
+
+@beeline.traced(name="bulk_import_source_locations")
+def bulk_import_source_locations(
+    records: List[ImportSourceLocationWithContentHash],
+    json_records: List[Dict],
+    import_run: ImportRun,
+) -> ImportResult:
+    # A source_uid can only be upserted once per statement - if a batch
+    # repeats one, the last record wins, as it would have done when they
+    # were saved one at a time
+    by_uid = {}
+    for record, json_record in zip(records, json_records):
+        by_uid.pop(record.source_uid, None)
+        by_uid[record.source_uid] = (record, json_record)
+
+    # Resolve matches against existing locations in one query
+    existing_public_ids = {
+        record.match.id
+        for record, _ in by_uid.values()
+        if record.match is not None and record.match.action == "existing"
+    }
+    location_ids_by_public_id = dict(
+        Location.objects.filter(public_id__in=existing_public_ids).values_list(
+            "public_id", "pk"
+        )
+    )
+    missing = existing_public_ids - set(location_ids_by_public_id)
+    if missing:
+        raise UnknownMatchedLocations(missing)
+
+    with transaction.atomic():
+        # Which of these already exist, and are they already matched?
+        existing = {
+            row[0]: ExistingSourceLocation(*row[1:])
+            for row in SourceLocation.objects.filter(
+                source_uid__in=by_uid.keys()
+            ).values_list("source_uid", "pk", "matched_location_id", "content_hash")
+        }
+        # Records with the same content_hash as we already have only need
+        # to be marked as seen by this import run - unless they are asking
+        # for a match that has not been made yet
+        unchanged = [
+            existing[source_uid].pk
+            for source_uid, (record, _) in by_uid.items()
+            if _is_unchanged(record, existing.get(source_uid))
+        ]
+        if unchanged:
+            SourceLocation.objects.filter(pk__in=unchanged).update(
+                last_imported_at=timezone.now(), import_run=import_run
+            )
+        by_uid = {
+            source_uid: pair
+            for source_uid, pair in by_uid.items()
+            if not _is_unchanged(pair[0], existing.get(source_uid))
+        }
+        if not by_uid:
+            return ImportResult(
+                created=[],
+                updated=[],
+                unchanged=unchanged,
+                derived_locations=0,
+                derive_seconds=0.0,
+            )
+
+        now = timezone.now()
+        rows = []
+        for source_uid, (record, json_record) in by_uid.items():
+            matched_location_id = None
+            if record.match is not None and record.match.action == "existing":
+                matched_location_id = location_ids_by_public_id[record.match.id]
+            has_point = bool(record.longitude and record.latitude)
+            rows.append(
+                (
+                    source_uid,
+                    record.source_name,
+                    record.name,
+                    record.content_hash,
+                    record.latitude,
+                    record.longitude,
+                    record.longitude if has_point else None,
+                    record.latitude if has_point else None,
+                    orjson.dumps(json_record["import_json"]).decode("utf-8"),
+                    import_run.pk,
+                    now,
+                    now,
+                    matched_location_id,
+                )
+            )
+
+        with beeline.tracer(name="upsert_source_locations"):
+            with connection.cursor() as cursor:
+                returned = execute_values(
+                    cursor,
+                    UPSERT_SQL,
+                    rows,
+                    template=UPSERT_TEMPLATE,
+                    page_size=len(rows) or 1,
+                    fetch=True,
+                )
+        source_location_ids = {source_uid: id for id, source_uid, _ in returned}
+        matched_location_ids = {
+            source_uid: matched_location_id
+            for _, source_uid, matched_location_id in returned
+        }
+
+        _link_concordances(by_uid, source_location_ids)
+
+        # Records that were created, or had no match before this import,
+        # are allowed to set or create a match
+        safe_to_match = {
+            source_uid
+            for source_uid in by_uid
+            if source_uid not in existing
+            or existing[source_uid].matched_location_id is None
+        }
+        to_build = [
+            source_uid
+            for source_uid in safe_to_match
+            if by_uid[source_uid][0].match is not None
+            and by_uid[source_uid][0].match.action == "new"
+        ]
+        if to_build:
+            for source_location in SourceLocation.objects.filter(
+                source_uid__in=to_build
+            ):
+                location = build_location_from_source_location(source_location, None)
+                matched_location_ids[source_location.source_uid] = location.pk
+
+        _copy_concordances_to_locations(
+            {
+                source_location_ids[source_uid]: matched_location_ids[source_uid]
+                for source_uid in safe_to_match
+                if matched_location_ids[source_uid] is not None
+            }
+        )
+
+    # A location matched by several records in this batch only needs
+    # its details deriving once, after all of them have been written
+    derived, derive_seconds = derive_details_for_locations(
+        {id for id in matched_location_ids.values() if id is not None}
+    )
+
+    created = []
+    updated = []
+    for source_uid in by_uid:
+        if source_uid in existing:
+            updated.append(source_location_ids[source_uid])
+        else:
+            created.append(source_location_ids[source_uid])
+    return ImportResult(
+        created=created,
+        updated=updated,
+        unchanged=unchanged,
+        derived_locations=derived,
+        derive_seconds=derive_seconds,
+    )
+
+
+def _link_concordances(by_uid, source_location_ids: Dict[str, int]) -> None:
+    "Create any missing concordance identifiers and link them to source locations"
+    links_by_uid: Dict[str, Set[Tuple[str, str]]] = {
+        source_uid: {(link.authority, link.id) for link in _links_for_record(record)}
+        for source_uid, (record, _) in by_uid.items()
+    }
+    all_pairs = set().union(*links_by_uid.values()) if links_by_uid else set()
+    ConcordanceIdentifier.objects.bulk_create(
+        [
+            ConcordanceIdentifier(authority=authority, identifier=identifier)
+            for authority, identifier in all_pairs
+        ],
+        ignore_conflicts=True,
+    )
+    concordance_ids = {
+        (authority, identifier): id
+        for id, authority, identifier in ConcordanceIdentifier.objects.filter(
+            identifier__in={identifier for _, identifier in all_pairs}
+        ).values_list("id", "authority", "identifier")
+    }
+    through = ConcordanceIdentifier.source_locations.through
+    through.objects.bulk_create(
+        [
+            through(
+                concordanceidentifier_id=concordance_ids[pair],
+                sourcelocation_id=source_location_ids[source_uid],
+            )
+            for source_uid, pairs in links_by_uid.items()
+            for pair in pairs
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _copy_concordances_to_locations(
+    location_id_by_source_location_id: Dict[int, int]
+) -> None:
+    "Copy every concordance on each source location to its matched location"
+    if not location_id_by_source_location_id:
+        return
+    source_through = ConcordanceIdentifier.source_locations.through
+    location_through = ConcordanceIdentifier.locations.through
+    pairs = source_through.objects.filter(
+        sourcelocation_id__in=location_id_by_source_location_id.keys()
+    ).values_list("concordanceidentifier_id", "sourcelocation_id")
+    location_through.objects.bulk_create(
+        [
+            location_through(
+                concordanceidentifier_id=concordanceidentifier_id,
+                location_id=location_id_by_source_location_id[sourcelocation_id],
+            )
+            for concordanceidentifier_id, sourcelocation_id in pairs
+        ],
+        ignore_conflicts=True,
+    )
+
+
+DIFF_SQL = """
+select
+    coalesce(client.source_uid, server.source_uid),
+    case
+        when server.source_uid is null then 'new'
+        when client.source_uid is null then 'missing'
+        else 'changed'
+    end
+from diff_source_locations client
+full outer join (
+    select source_uid, content_hash from source_location where source_name = %s
+) server on server.source_uid = client.source_uid
+where server.source_uid is null
+    or client.source_uid is null
+    or server.content_hash is distinct from client.content_hash
+"""
+
+DIGEST_SQL = """
+select
+    count(*),
+    encode(
+        sha256(
+            convert_to(
+                coalesce(
+                    string_agg(
+                        source_uid || E'\\t' || coalesce(content_hash, '') || E'\\n',
+                        '' order by source_uid collate "C"
+                    ),
+                    ''
+                ),
+                'UTF8'
+            )
+        ),
+        'hex'
+    )
+from source_location
+where source_name = %s
+"""
+
+
+class SourceLocationsDiff(NamedTuple):
+    new: List[str]
+    changed: List[str]
+    missing: List[str]
+
+
+def source_locations_digest(source_name: str) -> Tuple[int, str]:
+    """
+    Returns (count, digest) for the source locations with this source_name.
+
+    The digest is the hex SHA-256 of one "source_uid<TAB>content_hash<NEWLINE>"
+    line per source location, sorted by source_uid - see source_locations_digest_for_pairs()
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(DIGEST_SQL, [source_name])
+        count, digest = cursor.fetchone()
+    return count, digest
+
+
+def source_locations_digest_for_pairs(pairs: List[Tuple[str, Optional[str]]]) -> str:
+    "Python equivalent of DIGEST_SQL, for clients and tests"
+    hasher = hashlib.sha256()
+    for source_uid, content_hash in sorted(pairs):
+        hasher.update("{}\t{}\n".format(source_uid, content_hash or "").encode("utf-8"))
+    return hasher.hexdigest()
+
+
+@beeline.traced(name="diff_source_locations")
+def diff_source_locations(
+    source_name: str, pairs: List[Tuple[str, Optional[str]]]
+) -> SourceLocationsDiff:
+    """
+    Compare (source_uid, content_hash) pairs from a client with the source
+    locations we have for source_name, using a single join against a
+    temporary table of the client's pairs.
+    """
+    diff = SourceLocationsDiff(new=[], changed=[], missing=[])
+    with transaction.atomic(), connection.cursor() as cursor:
+        # ON COMMIT DROP only fires for the outermost transaction, so clean
+        # up after an earlier call within the same one
+        cursor.execute("drop table if exists diff_source_locations")
+        cursor.execute(
+            """
+            create temporary table diff_source_locations (
+                source_uid text primary key, content_hash text
+            ) on commit drop
+            """
+        )
+        execute_values(
+            cursor,
+            """
+            insert into diff_source_locations (source_uid, content_hash)
+            values %s on conflict (source_uid) do nothing
+            """,
+            pairs,
+            page_size=5000,
+        )
+        cursor.execute("analyze diff_source_locations")
+        cursor.execute(DIFF_SQL, [source_name])
+        for source_uid, status in cursor.fetchall():
+            getattr(diff, status).append(source_uid)
+    for uids in diff:
+        uids.sort()
+    return diff
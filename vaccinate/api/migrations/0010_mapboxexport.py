@@ -0,0 +1,95 @@
+# Generated by Django 3.2.4 on 2021-06-14 18:02
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_apikey_user"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MapboxExport",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("complete", "Complete"),
+                            ("failed", "Failed"),
+                        ],
+                        default="queued",
+                        max_length=16,
+                    ),
+                ),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("completed_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "num_features",
+                    models.IntegerField(
+                        blank=True,
+                        help_text="Number of features written to the upload",
+                        null=True,
+                    ),
+                ),
+                (
+                    "upload_bytes",
+                    models.BigIntegerField(
+                        blank=True,
+                        help_text="Size of the newline-delimited GeoJSON upload",
+                        null=True,
+                    ),
+                ),
+                (
+                    "upload_response",
+                    models.JSONField(
+                        blank=True,
+                        help_text="Response from the tileset source upload",
+                        null=True,
+                    ),
+                ),
+                (
+                    "publish_response",
+                    models.JSONField(
+                        blank=True,
+                        help_text="Response from the tileset publish",
+                        null=True,
+                    ),
+                ),
+                ("error", models.TextField(blank=True, null=True)),
+                (
+                    "api_key",
+                    models.ForeignKey(
+                        blank=True,
+                        help_text="API key that requested this export",
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="mapbox_exports",
+                        to="api.apikey",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "mapbox_export",
+            },
+        ),
+    ]
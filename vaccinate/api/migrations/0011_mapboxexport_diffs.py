@@ -0,0 +1,66 @@
+# Generated by Django 3.2.4 on 2021-06-15 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_mapboxexport"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mapboxexport",
+            name="feature_hashes",
+            field=models.JSONField(
+                blank=True,
+                help_text="public_id => content hash of every feature published by this export",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="mapboxexport",
+            name="force_full",
+            field=models.BooleanField(
+                default=False,
+                help_text="Replace the whole tileset source, even if a diff would do",
+            ),
+        ),
+        migrations.AddField(
+            model_name="mapboxexport",
+            name="mode",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("full", "Full replace"),
+                    ("append", "Append new features"),
+                    ("unchanged", "Unchanged, nothing uploaded"),
+                ],
+                max_length=16,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="mapboxexport",
+            name="num_added",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mapboxexport",
+            name="num_changed",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mapboxexport",
+            name="num_removed",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="mapboxexport",
+            name="num_features",
+            field=models.IntegerField(
+                blank=True, help_text="Number of features in the export", null=True
+            ),
+        ),
+    ]
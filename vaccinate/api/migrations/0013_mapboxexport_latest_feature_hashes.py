@@ -0,0 +1,38 @@
+# Generated by Django 3.2.4 on 2021-07-20 18:05
+
+from django.db import migrations, models
+
+
+def keep_latest_feature_hashes(apps, schema_editor):
+    MapboxExport = apps.get_model("api", "MapboxExport")
+    latest = (
+        MapboxExport.objects.filter(feature_hashes__isnull=False)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    MapboxExport.objects.filter(feature_hashes__isnull=False).exclude(pk=latest).update(
+        feature_hashes=None
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_webhookevent"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="mapboxexport",
+            name="feature_hashes",
+            field=models.JSONField(
+                blank=True,
+                help_text="public_id => content hash of every feature uploaded by this export - only kept for the latest upload",
+                null=True,
+            ),
+        ),
+        migrations.RunPython(
+            keep_latest_feature_hashes, reverse_code=migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.4 on 2021-07-21 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_mapboxexport_latest_feature_hashes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="mapboxexport",
+            name="feature_hashes",
+            field=models.JSONField(
+                blank=True,
+                help_text="public_id => content hash of every feature published by this export - only kept for the latest publish",
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="mapboxexport",
+            name="mode",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("full", "Full replace"),
+                    ("append", "Append added, changed and removed features"),
+                    ("unchanged", "Unchanged, nothing uploaded"),
+                ],
+                max_length=16,
+                null=True,
+            ),
+        ),
+    ]
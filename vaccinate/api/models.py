@@ -1,6 +1,8 @@
 import secrets
+from datetime import timedelta
 
 from core.fields import CharTextField
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 
@@ -90,6 +92,157 @@ class ApiLog(models.Model):
         )
 
 
+class MapboxExport(models.Model):
+    class Status(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        RUNNING = "running", "Running"
+        COMPLETE = "complete", "Complete"
+        FAILED = "failed", "Failed"
+
+    class Mode(models.TextChoices):
+        FULL = "full", "Full replace"
+        APPEND = "append", "Append added, changed and removed features"
+        UNCHANGED = "unchanged", "Unchanged, nothing uploaded"
+
+    created_at = models.DateTimeField(default=timezone.now)
+    api_key = models.ForeignKey(
+        ApiKey,
+        related_name="mapbox_exports",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        help_text="API key that requested this export",
+    )
+    status = models.CharField(
+        max_length=16, choices=Status.choices, default=Status.QUEUED
+    )
+    force_full = models.BooleanField(
+        default=False,
+        help_text="Replace the whole tileset source, even if a diff would do",
+    )
+    mode = models.CharField(max_length=16, choices=Mode.choices, null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    num_features = models.IntegerField(
+        null=True, blank=True, help_text="Number of features in the export"
+    )
+    num_added = models.IntegerField(null=True, blank=True)
+    num_changed = models.IntegerField(null=True, blank=True)
+    num_removed = models.IntegerField(null=True, blank=True)
+    upload_bytes = models.BigIntegerField(
+        null=True, blank=True, help_text="Size of the newline-delimited GeoJSON upload"
+    )
+    upload_response = models.JSONField(
+        null=True, blank=True, help_text="Response from the tileset source upload"
+    )
+    publish_response = models.JSONField(
+        null=True, blank=True, help_text="Response from the tileset publish"
+    )
+    error = models.TextField(null=True, blank=True)
+    feature_hashes = models.JSONField(
+        null=True,
+        blank=True,
+        help_text="public_id => content hash of every feature published by this export - only kept for the latest publish",
+    )
+
+    class Meta:
+        db_table = "mapbox_export"
+
+    def __str__(self):
+        return "Mapbox export {} [{}] - {}".format(
+            self.pk, self.status, self.created_at
+        )
+
+    @classmethod
+    def fail_stale_exports(cls) -> int:
+        """Exports run in the request that started them - if that was killed,
+        mark them as failed rather than leave them running. Queued exports
+        are waiting for the lock, so the timeout counts from started_at"""
+        now = timezone.now()
+        return cls.objects.filter(
+            status=cls.Status.RUNNING,
+            started_at__lt=now
+            - timedelta(minutes=settings.MAPBOX_EXPORT_TIMEOUT_MINUTES),
+        ).update(
+            status=cls.Status.FAILED,
+            error="Did not finish within {} minutes".format(
+                settings.MAPBOX_EXPORT_TIMEOUT_MINUTES
+            ),
+            completed_at=now,
+        )
+
+    def as_json(self):
+        return {
+            "id": self.pk,
+            "status": self.status,
+            "mode": self.mode,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "completed_at": self.completed_at.isoformat()
+            if self.completed_at
+            else None,
+            "num_features": self.num_features,
+            "num_added": self.num_added,
+            "num_changed": self.num_changed,
+            "num_removed": self.num_removed,
+            "upload_bytes": self.upload_bytes,
+            "upload": self.upload_response,
+            "publish": self.publish_response,
+            "error": self.error,
+        }
+
+
+class WebhookEvent(models.Model):
+    """
+    An outbox of webhook POSTs, written in the same transaction as the
+    change they describe and delivered by /api/deliverWebhooks or
+    ./manage.py deliver_webhooks
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        DELIVERED = "delivered", "Delivered"
+        FAILED = "failed", "Failed"
+
+    created_at = models.DateTimeField(default=timezone.now)
+    url = CharTextField()
+    payload = models.JSONField()
+    report = models.ForeignKey(
+        "core.Report",
+        null=True,
+        blank=True,
+        related_name="webhook_events",
+        on_delete=models.SET_NULL,
+        help_text="Report this event is about, if any",
+    )
+    status = models.CharField(
+        max_length=16, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        help_text="Pending events are not tried again before this time",
+    )
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        db_table = "webhook_event"
+        indexes = [
+            # For finding the events that are due
+            models.Index(
+                fields=["next_attempt_at"],
+                name="webhook_event_pending_idx",
+                condition=models.Q(status="pending"),
+            )
+        ]
+
+    def __str__(self):
+        return "Webhook event {} [{}] - {}".format(
+            self.pk, self.status, self.created_at
+        )
+
+
 class Switch(models.Model):
     name = models.CharField(max_length=128, unique=True)
     on = models.BooleanField(default=False)
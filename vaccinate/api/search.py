@@ -363,16 +363,9 @@ def search_source_locations(
 
 def filter_for_export(qs):
     # Filter down to locations that we think should be exported
-    # to the public map on www.vaccinatethestates.com
-    return qs.exclude(
+    # to the public map on www.vaccinatethestates.com - see
+    # Location.dn_is_exportable, which only catches up with past planned
+    # closures when expire_planned_closures runs, so check the date here too
+    return qs.filter(dn_is_exportable=True).exclude(
         dn_latest_non_skip_report__planned_closure__lt=datetime.date.today()
-    ).exclude(
-        dn_latest_non_skip_report__availability_tags__slug__in=(
-            "incorrect_contact_information",
-            "location_permanently_closed",
-            "may_be_a_vaccination_site_in_the_future",
-            "not_open_to_the_public",
-            "will_never_be_a_vaccination_site",
-            "only_staff",
-        )
     )
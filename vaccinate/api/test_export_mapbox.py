@@ -2,17 +2,28 @@ import datetime
 
 import orjson
 import pytest
-from core.models import AppointmentTag, AvailabilityTag, Reporter, SourceLocation
+from api.models import MapboxExport
+from core.models import (
+    AppointmentTag,
+    AvailabilityTag,
+    Location,
+    LocationExport,
+    Reporter,
+    SourceLocation,
+)
+from django.utils import timezone
 
 
 def test_export_mapbox_location_with_no_report(client, ten_locations):
     location = ten_locations[0]
+    LocationExport.refresh()
     response = client.get(
         "/api/exportMapboxPreview?id={}&raw=1".format(location.public_id)
     )
     data = orjson.loads(response.content)["geojson"][0]
     assert data == {
         "type": "Feature",
+        "id": location.public_id,
         "properties": {
             "id": location.public_id,
             "name": "Location 1",
@@ -116,6 +127,7 @@ def test_export_mapbox_location_with_vaccinefinder_source_location(
         import_json={"source": {"data": {"inventory": inventory}}},
         matched_location=location,
     )
+    LocationExport.refresh()
     response = client.get(
         "/api/exportMapboxPreview?id={}&raw=1".format(location.public_id)
     )
@@ -163,6 +175,7 @@ def test_export_mapbox_location_with_report(
     for tag in availability_tags:
         report.availability_tags.add(AvailabilityTag.objects.get(slug=tag))
     report.refresh_from_db()
+    LocationExport.refresh()
     response = client.get(
         "/api/exportMapboxPreview?id={}&raw=1".format(location.public_id)
     )
@@ -195,6 +208,7 @@ def test_export_mapbox_location_with_report(
 
     assert data == {
         "type": "Feature",
+        "id": location.public_id,
         "properties": expected_properties,
         "geometry": {"type": "Point", "coordinates": [40.0, 30.0]},
     }
@@ -218,6 +232,7 @@ def test_planned_closure_location_not_returned(
         appointment_tag=web,
         planned_closure=planned_closure,
     )
+    LocationExport.refresh()
     response = client.get(
         "/api/exportMapboxPreview?id={}&raw=1&export=1".format(location.public_id)
     )
@@ -229,6 +244,24 @@ def test_planned_closure_location_not_returned(
         assert len(geojson) == 1
 
 
+def test_planned_closure_passing_removes_location(client, ten_locations, time_machine):
+    location = ten_locations[0]
+    reporter = Reporter.objects.get_or_create(external_id="auth0:reporter")[0]
+    location.reports.create(
+        reported_by=reporter,
+        report_source="ca",
+        appointment_tag=AppointmentTag.objects.get(slug="web"),
+        planned_closure=datetime.date.today() + datetime.timedelta(days=1),
+    )
+    LocationExport.refresh()
+    url = "/api/exportMapboxPreview?id={}&raw=1&export=1".format(location.public_id)
+    assert len(client.get(url).json()["geojson"]) == 1
+    # Excluded once the date has passed, before expire_planned_closures runs
+    time_machine.move_to(datetime.datetime.now() + datetime.timedelta(days=2))
+    assert LocationExport.objects.get(location=location).is_exportable
+    assert client.get(url).json()["geojson"] == []
+
+
 @pytest.mark.parametrize(
     "tag",
     (
@@ -252,9 +285,286 @@ def test_locations_with_specific_availability_tags_not_exported(
         appointment_tag=web,
     )
     report.availability_tags.add(AvailabilityTag.objects.get(slug=tag))
+    LocationExport.refresh()
     response = client.get(
         "/api/exportMapboxPreview?id={}&raw=1&export=1".format(location.public_id)
     )
     geojson = orjson.loads(response.content)["geojson"]
     assert isinstance(geojson, list)
     assert len(geojson) == 0
+
+
+def test_export_mapbox_no_access_token(client, api_key, ten_locations, settings):
+    LocationExport.refresh()
+    settings.MAPBOX_ACCESS_TOKEN = None
+    response = client.post(
+        "/api/exportMapbox", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "complete"
+    export = MapboxExport.objects.get(pk=data["id"])
+    assert export.status == "complete"
+    assert export.num_features == 10
+    assert export.upload_response == "Would upload {} bytes".format(export.upload_bytes)
+    # Status endpoint reflects the finished export
+    status_response = client.get(
+        data["status_url"], HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    )
+    assert status_response.json()["status"] == "complete"
+
+
+def test_export_mapbox_streams_upload(
+    client, api_key, ten_locations, settings, requests_mock
+):
+    LocationExport.refresh()
+    settings.MAPBOX_ACCESS_TOKEN = "token"
+    uploaded = {}
+
+    def upload_callback(request, context):
+        # The body is streamed from the spooled file, with a known length
+        uploaded["content_length"] = request.headers["Content-Length"]
+        uploaded["content_type"] = request.headers["Content-Type"]
+        uploaded["body"] = request.body.read()
+        return {"id": "source"}
+
+    requests_mock.put(
+        "https://api.mapbox.com/tilesets/v1/sources/calltheshots/vial",
+        json=upload_callback,
+    )
+    requests_mock.post(
+        "https://api.mapbox.com/tilesets/v1/calltheshots.vaccinatethestates/publish",
+        json={"jobId": "job"},
+    )
+    response = client.post(
+        "/api/exportMapbox", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    )
+    assert response.status_code == 200
+    export = MapboxExport.objects.get(pk=response.json()["id"])
+    assert export.status == "complete"
+    assert export.upload_response == {"id": "source"}
+    assert export.publish_response == {"jobId": "job"}
+    assert uploaded["content_type"].startswith("multipart/form-data; boundary=")
+    assert int(uploaded["content_length"]) == len(uploaded["body"])
+    features = [
+        orjson.loads(line)
+        for line in uploaded["body"].split(b"\r\n\r\n", 1)[1].splitlines()
+        if line.startswith(b"{")
+    ]
+    assert len(features) == 10
+    assert {f["properties"]["id"] for f in features} == {
+        location.public_id for location in ten_locations
+    }
+
+
+def test_export_mapbox_upload_failure(
+    client, api_key, ten_locations, settings, requests_mock
+):
+    LocationExport.refresh()
+    settings.MAPBOX_ACCESS_TOKEN = "token"
+    requests_mock.put(
+        "https://api.mapbox.com/tilesets/v1/sources/calltheshots/vial",
+        status_code=500,
+    )
+    response = client.post(
+        "/api/exportMapbox", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    )
+    assert response.status_code == 200
+    export = MapboxExport.objects.get(pk=response.json()["id"])
+    assert export.status == "failed"
+    assert "500" in export.error
+    assert export.completed_at is not None
+
+
+def test_export_mapbox_stale_exports_marked_failed(client, api_key, time_machine):
+    time_machine.move_to(datetime.datetime(2021, 7, 1, 10, 0, 0))
+    stale = MapboxExport.objects.create(
+        status=MapboxExport.Status.RUNNING, started_at=timezone.now()
+    )
+    # Queued behind the lock: the timeout only starts once it is running
+    queued = MapboxExport.objects.create()
+    time_machine.move_to(datetime.datetime(2021, 7, 1, 10, 20, 0))
+    recent = MapboxExport.objects.create(
+        status=MapboxExport.Status.RUNNING, started_at=timezone.now()
+    )
+    time_machine.move_to(datetime.datetime(2021, 7, 1, 10, 40, 0))
+    response = client.get(
+        "/api/exportMapbox/{}".format(stale.pk),
+        HTTP_AUTHORIZATION="Bearer {}".format(api_key),
+    )
+    assert response.json()["status"] == "failed"
+    assert response.json()["error"] == "Did not finish within 30 minutes"
+    recent.refresh_from_db()
+    assert recent.status == "running"
+    queued.refresh_from_db()
+    assert queued.status == "queued"
+
+
+def test_export_mapbox_diff_modes(
+    client, api_key, ten_locations, settings, requests_mock
+):
+    LocationExport.refresh()
+    settings.MAPBOX_ACCESS_TOKEN = "token"
+    source_url = "https://api.mapbox.com/tilesets/v1/sources/calltheshots/vial"
+    uploads = []
+
+    def upload_callback(request, context):
+        body = request.body.read()
+        uploads.append(
+            (
+                request.method,
+                [line for line in body.splitlines() if line.startswith(b"{")],
+            )
+        )
+        return {"id": "source"}
+
+    requests_mock.put(source_url, json=upload_callback)
+    requests_mock.post(source_url, json=upload_callback)
+    publish = requests_mock.post(
+        "https://api.mapbox.com/tilesets/v1/calltheshots.vaccinatethestates/publish",
+        json={"jobId": "job"},
+    )
+
+    def run_export(path="/api/exportMapbox"):
+        response = client.post(path, HTTP_AUTHORIZATION="Bearer {}".format(api_key))
+        return MapboxExport.objects.get(pk=response.json()["id"])
+
+    # No previous export, so this replaces the whole source
+    export = run_export()
+    assert export.mode == "full"
+    assert uploads[-1][0] == "PUT"
+    assert len(uploads[-1][1]) == 10
+    assert len(export.feature_hashes) == 10
+
+    # Nothing changed: no upload and no publish
+    export = run_export()
+    assert export.mode == "unchanged"
+    assert export.upload_bytes == 0
+    assert len(uploads) == 1
+    assert publish.call_count == 1
+
+    # A new location is appended on its own
+    Location.objects.create(
+        name="New location",
+        state=ten_locations[0].state,
+        location_type=ten_locations[0].location_type,
+        latitude=30,
+        longitude=40,
+    )
+    LocationExport.refresh()
+    export = run_export()
+    assert export.mode == "append"
+    assert (export.num_added, export.num_changed, export.num_removed) == (1, 0, 0)
+    assert uploads[-1][0] == "POST"
+    assert len(uploads[-1][1]) == 1
+    assert b"New location" in uploads[-1][1][0]
+    assert publish.call_count == 2
+
+    # A changed location is appended, replacing the feature with its id
+    changed = ten_locations[1]
+    changed.name = "Renamed"
+    changed.save()
+    LocationExport.refresh()
+    export = run_export()
+    assert export.mode == "append"
+    assert (export.num_added, export.num_changed, export.num_removed) == (0, 1, 0)
+    assert uploads[-1][0] == "POST"
+    assert len(uploads[-1][1]) == 1
+    feature = orjson.loads(uploads[-1][1][0])
+    assert feature["id"] == changed.public_id
+    assert feature["properties"]["name"] == "Renamed"
+
+    # A removed location is appended without a geometry
+    removed = ten_locations[2]
+    Location.objects.filter(pk=removed.pk).update(soft_deleted=True)
+    LocationExport.refresh()
+    export = run_export()
+    assert export.mode == "append"
+    assert (export.num_added, export.num_changed, export.num_removed) == (0, 0, 1)
+    assert uploads[-1][0] == "POST"
+    assert [orjson.loads(line) for line in uploads[-1][1]] == [
+        {
+            "type": "Feature",
+            "id": removed.public_id,
+            "properties": {},
+            "geometry": None,
+        }
+    ]
+
+    # Diffs bigger than MAPBOX_EXPORT_MAX_APPEND_FEATURES replace the source
+    settings.MAPBOX_EXPORT_MAX_APPEND_FEATURES = 1
+    Location.objects.filter(
+        pk__in=[location.pk for location in ten_locations[3:5]]
+    ).update(name="Renamed again")
+    LocationExport.refresh()
+    export = run_export()
+    assert export.mode == "full"
+    assert (export.num_added, export.num_changed, export.num_removed) == (0, 2, 0)
+    assert uploads[-1][0] == "PUT"
+    assert len(uploads[-1][1]) == 10
+
+    # ?full=1 forces a full replace even when nothing changed
+    export = run_export("/api/exportMapbox?full=1")
+    assert export.mode == "full"
+    assert len(uploads) == 6
+    # Only the latest upload keeps its feature hashes
+    assert list(
+        MapboxExport.objects.filter(feature_hashes__isnull=False).values_list(
+            "pk", flat=True
+        )
+    ) == [export.pk]
+
+
+def test_export_mapbox_publish_failure_is_retried(
+    client, api_key, ten_locations, settings, requests_mock
+):
+    LocationExport.refresh()
+    settings.MAPBOX_ACCESS_TOKEN = "token"
+    upload = requests_mock.put(
+        "https://api.mapbox.com/tilesets/v1/sources/calltheshots/vial",
+        json={"id": "source"},
+    )
+    publish = requests_mock.post(
+        "https://api.mapbox.com/tilesets/v1/calltheshots.vaccinatethestates/publish",
+        status_code=500,
+    )
+    response = client.post(
+        "/api/exportMapbox", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    )
+    export = MapboxExport.objects.get(pk=response.json()["id"])
+    assert export.status == "failed"
+    # Nothing was published, so no hashes are recorded
+    assert export.feature_hashes is None
+    # ... and the next export uploads and publishes again
+    publish = requests_mock.post(
+        "https://api.mapbox.com/tilesets/v1/calltheshots.vaccinatethestates/publish",
+        json={"jobId": "job"},
+    )
+    response = client.post(
+        "/api/exportMapbox", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    )
+    export = MapboxExport.objects.get(pk=response.json()["id"])
+    assert export.status == "complete"
+    assert export.mode == "full"
+    assert upload.call_count == 2
+    assert publish.call_count == 1
+    assert len(export.feature_hashes) == 10
+
+
+def test_refresh_location_export(client, api_key, ten_locations):
+    assert LocationExport.objects.count() == 0
+    response = client.post(
+        "/api/refreshLocationExport", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    )
+    assert response.status_code == 200
+    assert response.json()["ok"] == 1
+    assert LocationExport.objects.count() == 10
+    row = LocationExport.objects.get(location=ten_locations[0])
+    assert row.public_id == ten_locations[0].public_id
+    assert row.state_abbreviation == "OR"
+    assert row.report_id is None
+    assert row.availability_tag_slugs == []
+    # Soft-deleted locations drop out on the next refresh
+    Location.objects.filter(pk=ten_locations[0].pk).update(soft_deleted=True)
+    LocationExport.refresh()
+    assert LocationExport.objects.count() == 9
@@ -1,3 +1,4 @@
+import orjson
 import pytest
 from core.models import Location, LocationType, Provider, ProviderType
 
@@ -72,6 +73,9 @@ def test_import_location(client, api_key, use_list):
     # Check that ApiLog record was created
     log = ApiLog.objects.get()
     assert log.api_key.token == api_key
+    # The request body is logged without being parsed
+    assert orjson.loads(bytes(log.post_body)) == json_input
+    assert log.post_body_json is None
 
 
 @pytest.mark.django_db
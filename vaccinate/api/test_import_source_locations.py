@@ -3,6 +3,7 @@ import pathlib
 
 import orjson
 import pytest
+from api.import_source_locations import source_locations_digest_for_pairs
 from bigmap.transform import source_to_location
 from core.models import (
     ConcordanceIdentifier,
@@ -259,3 +260,213 @@ def test_import_source_location_updates_location_fields(client, api_key):
     assert not location.accepts_appointments
     assert location.vaccines_offered_provenance_source_location == source_location
     assert location.appointments_walkins_provenance_source_location == source_location
+
+
+def _numbered_records(fixture, n):
+    records = []
+    for i in range(n):
+        record = orjson.loads(orjson.dumps(fixture))
+        record["source_uid"] = "vaccinespotter:{}".format(i)
+        record["import_json"]["source"]["id"] = str(i)
+        record["import_json"]["links"] = [{"authority": "rite_aid", "id": str(i)}]
+        records.append(record)
+    return records
+
+
+def test_import_source_locations_batch(client, api_key, django_assert_max_num_queries):
+    with (tests_dir / "003-match-existing.json").open() as fixture_file:
+        fixture = orjson.loads(fixture_file.read())
+    location = Location.objects.create(
+        public_id=fixture["match"]["id"],
+        name=fixture["name"],
+        latitude=fixture["latitude"],
+        longitude=fixture["longitude"],
+        location_type=LocationType.objects.filter(name="Pharmacy").get(),
+        state=State.objects.filter(abbreviation="CA").get(),
+    )
+    import_run_id = client.post(
+        "/api/startImportRun", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    ).json()["import_run_id"]
+    records = _numbered_records(fixture, 50)
+    # Only some of them match the location
+    for record in records[10:]:
+        del record["match"]
+    body = b"\n".join(orjson.dumps(record) for record in records)
+
+    # The number of queries should not depend on the number of records -
+    # derive_details() runs once for the location they all matched
+    with django_assert_max_num_queries(40):
+        response = client.post(
+            "/api/importSourceLocations?import_run_id={}".format(import_run_id),
+            body,
+            content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer {}".format(api_key),
+        )
+    assert response.status_code == 200
+    assert len(response.json()["created"]) == 50
+    assert response.json()["updated"] == []
+    assert response.json()["derive_details"]["locations"] == 1
+    assert SourceLocation.objects.count() == 50
+    assert SourceLocation.objects.filter(matched_location=location).count() == 10
+    # Every source location has its source concordance and its link
+    assert ConcordanceIdentifier.objects.count() == 100
+    assert (
+        ConcordanceIdentifier.source_locations.through.objects.filter(
+            sourcelocation__source_name="vaccinespotter"
+        ).count()
+        == 100
+    )
+    # Concordances of the matched source locations were copied to the location
+    assert location.concordances.count() == 20
+    source_location = SourceLocation.objects.get(source_uid="vaccinespotter:3")
+    assert source_location.point is not None
+    assert source_location.import_json == records[3]["import_json"]
+
+    # Importing again updates them all, without creating more concordances
+    response = client.post(
+        "/api/importSourceLocations?import_run_id={}".format(import_run_id),
+        body,
+        content_type="application/json",
+        HTTP_AUTHORIZATION="Bearer {}".format(api_key),
+    )
+    assert response.json()["created"] == []
+    assert len(response.json()["updated"]) == 50
+    assert ConcordanceIdentifier.objects.count() == 100
+
+
+def test_import_source_locations_unknown_match(client, api_key):
+    with (tests_dir / "003-match-existing.json").open() as fixture_file:
+        fixture = orjson.loads(fixture_file.read())
+    import_run_id = client.post(
+        "/api/startImportRun", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    ).json()["import_run_id"]
+    response = client.post(
+        "/api/importSourceLocations?import_run_id={}".format(import_run_id),
+        fixture,
+        content_type="application/json",
+        HTTP_AUTHORIZATION="Bearer {}".format(api_key),
+    )
+    assert response.status_code == 400
+    assert response.json() == {
+        "error": "Location does not exist: {}".format(fixture["match"]["id"])
+    }
+    assert SourceLocation.objects.count() == 0
+
+
+def test_import_source_locations_unchanged_content_hash(
+    client, api_key, django_assert_max_num_queries
+):
+    with (tests_dir / "001-no-match.json").open() as fixture_file:
+        fixture = orjson.loads(fixture_file.read())
+    records = _numbered_records(fixture, 20)
+    for i, record in enumerate(records):
+        record["content_hash"] = "hash-{}".format(i)
+    import_run_id = client.post(
+        "/api/startImportRun", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    ).json()["import_run_id"]
+    client.post(
+        "/api/importSourceLocations?import_run_id={}".format(import_run_id),
+        b"\n".join(orjson.dumps(record) for record in records),
+        content_type="application/json",
+        HTTP_AUTHORIZATION="Bearer {}".format(api_key),
+    )
+    assert SourceLocation.objects.count() == 20
+    original_ids = {sl.source_uid: sl.pk for sl in SourceLocation.objects.all()}
+    # Backdate them so we can see last_imported_at get touched
+    SourceLocation.objects.update(
+        last_imported_at=datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+        name="Edited",
+    )
+
+    # Change one record - the rest should be left alone
+    records[0]["content_hash"] = "changed"
+    second_import_run_id = client.post(
+        "/api/startImportRun", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    ).json()["import_run_id"]
+    with django_assert_max_num_queries(20):
+        response = client.post(
+            "/api/importSourceLocations?import_run_id={}".format(second_import_run_id),
+            b"\n".join(orjson.dumps(record) for record in records),
+            content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer {}".format(api_key),
+        )
+    data = response.json()
+    assert data["created"] == []
+    assert data["updated"] == [original_ids["vaccinespotter:0"]]
+    assert sorted(data["unchanged"]) == sorted(
+        pk for uid, pk in original_ids.items() if uid != "vaccinespotter:0"
+    )
+    # Unchanged records were touched but not rewritten
+    assert SourceLocation.objects.filter(name="Edited").count() == 19
+    assert not SourceLocation.objects.filter(
+        last_imported_at__year=2021, last_imported_at__month=1
+    ).exists()
+    assert (
+        SourceLocation.objects.filter(import_run_id=second_import_run_id).count() == 20
+    )
+
+
+def test_diff_source_locations(client, api_key):
+    for i in range(5):
+        SourceLocation.objects.create(
+            source_name="vaccinespotter",
+            source_uid="vaccinespotter:{}".format(i),
+            content_hash="hash-{}".format(i),
+        )
+    # Different source_name should be ignored
+    SourceLocation.objects.create(
+        source_name="getmyvax", source_uid="getmyvax:1", content_hash="x"
+    )
+    pairs = [
+        ["vaccinespotter:0", "hash-0"],
+        ["vaccinespotter:1", "changed"],
+        ["vaccinespotter:2", "hash-2"],
+        ["vaccinespotter:3", "hash-3"],
+        ["vaccinespotter:new", "hash-new"],
+    ]
+    response = client.post(
+        "/api/diffSourceLocations",
+        {"source_name": "vaccinespotter", "source_locations": pairs},
+        content_type="application/json",
+        HTTP_AUTHORIZATION="Bearer {}".format(api_key),
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "source_name": "vaccinespotter",
+        "new": ["vaccinespotter:new"],
+        "changed": ["vaccinespotter:1"],
+        "missing": ["vaccinespotter:4"],
+    }
+
+
+@pytest.mark.parametrize("should_match", (True, False))
+def test_diff_source_locations_digest(client, api_key, should_match):
+    pairs = [("vaccinespotter:{}".format(i), "hash-{}".format(i)) for i in range(5)]
+    for source_uid, content_hash in pairs:
+        SourceLocation.objects.create(
+            source_name="vaccinespotter",
+            source_uid=source_uid,
+            content_hash=content_hash,
+        )
+    if not should_match:
+        pairs[0] = ("vaccinespotter:0", "changed")
+    digest = source_locations_digest_for_pairs(pairs)
+    response = client.post(
+        "/api/diffSourceLocations",
+        {"source_name": "vaccinespotter", "digest": digest},
+        content_type="application/json",
+        HTTP_AUTHORIZATION="Bearer {}".format(api_key),
+    )
+    data = response.json()
+    assert data["count"] == 5
+    assert data["matches"] is should_match
+
+
+def test_diff_source_locations_requires_pairs_or_digest(client, api_key):
+    response = client.post(
+        "/api/diffSourceLocations",
+        {"source_name": "vaccinespotter"},
+        content_type="application/json",
+        HTTP_AUTHORIZATION="Bearer {}".format(api_key),
+    )
+    assert response.status_code == 400
@@ -1,3 +1,4 @@
+import datetime
 import re
 
 import orjson
@@ -214,6 +215,26 @@ def test_search_locations_ignores_soft_deleted(client, api_key, ten_locations):
     assert search_locations(client, api_key, "q=Location+1")["total"] == 1
 
 
+def test_search_locations_exportable_planned_closure_passed(
+    client, api_key, ten_locations, time_machine
+):
+    location = ten_locations[0]
+    location.reports.create(
+        reported_by=Reporter.objects.get_or_create(external_id="auth0:reporter")[0],
+        report_source="ca",
+        appointment_tag=AppointmentTag.objects.get(slug="web"),
+        planned_closure=datetime.date.today() + datetime.timedelta(days=1),
+    )
+    assert search_locations(client, api_key, "exportable=1")["total"] == 10
+    # Excluded once the date has passed, before expire_planned_closures runs
+    time_machine.move_to(datetime.datetime.now() + datetime.timedelta(days=2))
+    location.refresh_from_db()
+    assert location.dn_is_exportable
+    data = search_locations(client, api_key, "exportable=1")
+    assert data["total"] == 9
+    assert location.name not in {r["name"] for r in data["results"]}
+
+
 def test_search_locations_format_json(client, api_key, ten_locations):
     result = search_locations(client, api_key, "q=Location+1")
     assert set(result.keys()) == {"results", "total"}
@@ -0,0 +1,113 @@
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import orjson
+import pytest
+from api.models import WebhookEvent
+from api.webhooks import deliver_webhooks, queue_webhook
+from django.core.management import call_command
+from django.utils import timezone
+
+
+@pytest.fixture
+def webhook_server():
+    # A local stand-in for Zapier, returning the queued status codes in order
+    # and then 200s
+    received = []
+    statuses = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            received.append(orjson.loads(body))
+            self.send_response(statuses.pop(0) if statuses else 200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = "http://127.0.0.1:{}/".format(server.server_port)
+    server.received = received
+    server.statuses = statuses
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.django_db
+def test_deliver_webhooks(webhook_server):
+    for i in range(5):
+        queue_webhook(webhook_server.url, {"i": i})
+    assert deliver_webhooks(max_workers=3) == (5, 0)
+    assert sorted(payload["i"] for payload in webhook_server.received) == list(range(5))
+    for event in WebhookEvent.objects.all():
+        assert event.status == "delivered"
+        assert event.attempts == 1
+        assert event.delivered_at is not None
+    # Nothing left to deliver
+    assert deliver_webhooks() == (0, 0)
+
+
+@pytest.mark.django_db
+def test_deliver_webhooks_retries_with_backoff(webhook_server):
+    event = queue_webhook(webhook_server.url, {"hello": "world"})
+    webhook_server.statuses.extend([500, 503])
+
+    assert deliver_webhooks() == (0, 1)
+    event.refresh_from_db()
+    assert event.status == "pending"
+    assert event.attempts == 1
+    assert "500" in event.last_error
+    # Not retried until the backoff has passed
+    assert event.next_attempt_at > timezone.now() + timedelta(seconds=25)
+    assert deliver_webhooks() == (0, 0)
+
+    WebhookEvent.objects.update(next_attempt_at=timezone.now())
+    assert deliver_webhooks() == (0, 1)
+    event.refresh_from_db()
+    assert event.attempts == 2
+    # The backoff doubles
+    assert event.next_attempt_at > timezone.now() + timedelta(seconds=55)
+
+    WebhookEvent.objects.update(next_attempt_at=timezone.now())
+    call_command("deliver_webhooks")
+    event.refresh_from_db()
+    assert event.status == "delivered"
+    assert event.attempts == 3
+    assert webhook_server.received == [{"hello": "world"}] * 3
+
+
+@pytest.mark.django_db
+def test_deliver_webhooks_gives_up(webhook_server):
+    event = queue_webhook(webhook_server.url, {})
+    webhook_server.statuses.extend([500, 500])
+    assert deliver_webhooks(max_attempts=2) == (0, 1)
+    WebhookEvent.objects.update(next_attempt_at=timezone.now())
+    assert deliver_webhooks(max_attempts=2) == (0, 1)
+    event.refresh_from_db()
+    assert event.status == "failed"
+    assert event.attempts == 2
+    assert deliver_webhooks(max_attempts=2) == (0, 0)
+
+
+@pytest.mark.django_db
+def test_deliver_webhooks_endpoint(client, api_key, webhook_server):
+    for i in range(3):
+        queue_webhook(webhook_server.url, {"i": i})
+    webhook_server.statuses.append(500)
+    response = client.get(
+        "/api/deliverWebhooks", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    )
+    assert response.status_code == 400
+    response = client.post(
+        "/api/deliverWebhooks", HTTP_AUTHORIZATION="Bearer {}".format(api_key)
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["ok"] == 1
+    assert (data["delivered"], data["failed"]) == (2, 1)
+    assert WebhookEvent.objects.filter(status="delivered").count() == 2
@@ -1,12 +1,18 @@
+import datetime
+import hashlib
 import random
 import time
 from typing import Any, Dict
 
 import pytest
 from core.models import AvailabilityTag, Reporter
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
+from . import utils
 from .caller_views.submit_report import user_should_have_reports_reviewed
-from .models import ApiKey, Switch
+from .models import ApiKey, ApiLog, Switch
 
 GOODTOKEN = "1953b7a735274809f4ff230048b60a4a"
 
@@ -59,6 +65,72 @@ def test_verify_token_last_seen_at(client):
     assert last_seen_at == last_seen_at2
 
 
+@pytest.mark.django_db
+def test_api_key_cache(client, django_assert_num_queries):
+    api_key = ApiKey.objects.create(
+        id=2, key="8a2e60eb55011904fa495a27cd9c6393", description="Test"
+    )
+
+    def verify_token(token):
+        return client.get(
+            "/api/verifyToken", HTTP_AUTHORIZATION="Bearer {}".format(token)
+        )
+
+    assert verify_token(api_key.token).status_code == 200
+    # The second request is served from the cache
+    with django_assert_num_queries(0):
+        assert verify_token(api_key.token).status_code == 200
+    # The cache holds a hash of the secret, not the secret itself
+    digest, cached = utils.cached_api_key(api_key.id)
+    assert digest == hashlib.sha256(api_key.key.encode("utf-8")).hexdigest()
+    assert cached.key == ""
+    # Changing or deleting the key evicts it
+    old_token = api_key.token
+    api_key.key = "1d7ae2b6fc4e0a3f4c1c6ee2bb1c9d2a"
+    api_key.save()
+    assert verify_token(old_token).json()["error"] == "Invalid API key"
+    assert verify_token(api_key.token).status_code == 200
+    api_key.delete()
+    assert verify_token(old_token).json()["error"] == "API key does not exist"
+
+
+@pytest.mark.django_db
+def test_api_key_last_seen_at(
+    client, settings, time_machine, django_assert_num_queries
+):
+    settings.API_KEY_CACHE_SECONDS = 600
+    time_machine.move_to(
+        datetime.datetime(2021, 7, 1, 10, 0, 0, tzinfo=datetime.timezone.utc),
+        tick=False,
+    )
+    api_key = ApiKey.objects.create(description="Test")
+
+    def verify_token():
+        response = client.get(
+            "/api/verifyToken", HTTP_AUTHORIZATION="Bearer {}".format(api_key.token)
+        )
+        assert response.status_code == 200
+        api_key.refresh_from_db()
+        return api_key.last_seen_at
+
+    first_seen = timezone.now()
+    assert verify_token() == first_seen
+    # Not written again within a minute
+    time_machine.move_to(first_seen + datetime.timedelta(seconds=30), tick=False)
+    with django_assert_num_queries(0):
+        client.get(
+            "/api/verifyToken", HTTP_AUTHORIZATION="Bearer {}".format(api_key.token)
+        )
+    assert verify_token() == first_seen
+    # ... but is after that, with a single UPDATE
+    time_machine.move_to(first_seen + datetime.timedelta(minutes=2), tick=False)
+    with django_assert_num_queries(1):
+        client.get(
+            "/api/verifyToken", HTTP_AUTHORIZATION="Bearer {}".format(api_key.token)
+        )
+    assert verify_token() == first_seen + datetime.timedelta(minutes=2)
+
+
 @pytest.mark.django_db
 def test_availability_tags(client):
     response = client.get("/api/availabilityTags")
@@ -120,3 +192,99 @@ def test_switch_api_disabled(client, jwt_id_token):
         response.content
         == b'{"error": "This application is currently disabled - please try again later"}'
     )
+
+
+@pytest.mark.django_db
+def test_jwt_auth_caches_verified_tokens(
+    client, jwt_id_token, monkeypatch, time_machine
+):
+    verified = []
+
+    def decode_and_verify_jwt(jwt_token, audience):
+        verified.append(audience)
+        return original_decode_and_verify_jwt(jwt_token, audience)
+
+    original_decode_and_verify_jwt = utils.decode_and_verify_jwt
+    monkeypatch.setattr(utils, "decode_and_verify_jwt", decode_and_verify_jwt)
+
+    def request_call():
+        return client.post(
+            "/api/requestCall",
+            {},
+            content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer {}".format(jwt_id_token),
+        )
+
+    # First request verifies the token and creates the reporter
+    assert request_call().status_code == 400
+    assert len(verified) == 1
+    reporter = Reporter.objects.get(external_id="auth0:auth0|604b00092f4fe10068f49191")
+    assert reporter.auth0_role_names == "Volunteer Caller"
+
+    # Second request uses the cached payload, and doesn't write the reporter
+    with CaptureQueriesContext(connection) as queries:
+        assert request_call().status_code == 400
+    assert len(verified) == 1
+    assert not [
+        query for query in queries if query["sql"].startswith('UPDATE "reporter"')
+    ]
+
+    # Changed roles are written back
+    Reporter.objects.filter(pk=reporter.pk).update(auth0_role_names="Trainee")
+    assert request_call().status_code == 400
+    reporter.refresh_from_db()
+    assert reporter.auth0_role_names == "Volunteer Caller"
+    assert len(verified) == 1
+
+    # Tokens are not used from the cache after they have expired
+    time_machine.move_to(datetime.datetime(2021, 5, 6, 8, 0, 0))
+    response = request_call()
+    assert response.status_code == 403
+    assert response.json()["error"] == "Could not decode JWT"
+
+
+@pytest.mark.django_db
+def test_api_logs_are_written_during_the_request(client):
+    for i in range(3):
+        response = client.post("/api/submitReport")
+        assert response.status_code == 403
+        assert ApiLog.objects.count() == i + 1
+    assert (
+        list(ApiLog.objects.values_list("path", "response_status"))
+        == [("/api/submitReport", 403)] * 3
+    )
+
+
+# Foreign keys are only checked on commit - serialized_rollback restores
+# the rows seeded by data migrations after the flush at the end
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_write_api_log_integrity_error(monkeypatch):
+    captured = []
+    monkeypatch.setattr(
+        utils.sentry_sdk, "capture_exception", lambda: captured.append(1)
+    )
+    # Points at a report that doesn't exist
+    utils.write_api_log(
+        ApiLog(method="GET", path="/api/one", response_status=200, created_report_id=1)
+    )
+    assert not ApiLog.objects.exists()
+    assert captured == [1]
+    utils.write_api_log(ApiLog(method="GET", path="/api/two", response_status=200))
+    assert list(ApiLog.objects.values_list("path", flat=True)) == ["/api/two"]
+
+
+@pytest.mark.parametrize(
+    "storage,expected",
+    (
+        (utils.BODY_NONE, (None, None)),
+        (utils.BODY_RAW, (b'{"a": 1}', None)),
+        (utils.BODY_TRUNCATED, (b'{"a"', None)),
+        (utils.BODY_PARSED, (None, {"a": 1})),
+    ),
+)
+def test_body_for_log(storage, expected, monkeypatch):
+    monkeypatch.setattr(utils, "API_LOG_TRUNCATED_BODY_BYTES", 4)
+    assert utils._body_for_log(b'{"a": 1}', storage) == expected
+    # Bodies that are not JSON are stored as bytes
+    if storage == utils.BODY_PARSED:
+        assert utils._body_for_log(b"<html>", storage) == (b"<html>", None)
@@ -1,15 +1,24 @@
+import copy
 import datetime
+import hashlib
 import secrets
-from functools import wraps
-from typing import Any, Callable, List, Optional, Set
+import threading
+import time
+from collections import OrderedDict
+from functools import partial, wraps
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import beeline
 import orjson
 import requests
+import sentry_sdk
 from auth0login.auth0_utils import decode_and_verify_jwt
 from core.models import Reporter
 from django.conf import settings
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.http import HttpRequest
 from django.http.response import (
     HttpResponse,
@@ -41,6 +50,68 @@ def require_api_key_or_cookie_user(view_fn):
     return protected_view_fn
 
 
+# Recently used API keys by id: the sha256 of the secret, the ApiKey with
+# its secret blanked out, and the time each was loaded
+_api_keys: Dict[int, Tuple[str, ApiKey, float]] = {}
+_api_keys_lock = threading.Lock()
+
+
+def api_key_digest(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def cached_api_key(id: int) -> Optional[Tuple[str, ApiKey]]:
+    """
+    Returns (sha256 of the secret, ApiKey without its secret), from the
+    cache if it was loaded recently
+    """
+    with _api_keys_lock:
+        cached = _api_keys.get(id)
+    if cached is not None and time.monotonic() - cached[2] < (
+        settings.API_KEY_CACHE_SECONDS
+    ):
+        return cached[0], cached[1]
+    api_key = ApiKey.objects.filter(pk=id).first()
+    if api_key is None:
+        with _api_keys_lock:
+            _api_keys.pop(id, None)
+        return None
+    digest = api_key_digest(api_key.key)
+    # Don't keep the plaintext secret around for the life of the process
+    api_key.key = ""
+    with _api_keys_lock:
+        _api_keys[id] = (digest, api_key, time.monotonic())
+    return digest, api_key
+
+
+def clear_api_key_cache() -> None:
+    with _api_keys_lock:
+        _api_keys.clear()
+
+
+@receiver(post_save, sender=ApiKey)
+@receiver(post_delete, sender=ApiKey)
+def evict_cached_api_key(sender, instance, **kwargs):
+    # Changed or deleted keys take effect straight away in this process
+    with _api_keys_lock:
+        _api_keys.pop(instance.pk, None)
+
+
+def update_api_key_last_seen_at(api_key: ApiKey) -> None:
+    "Set last_seen_at if it is more than a minute old, without a full save()"
+    now = timezone.now()
+    one_minute_ago = now - datetime.timedelta(minutes=1)
+    if api_key.last_seen_at is not None and api_key.last_seen_at >= one_minute_ago:
+        return
+    # Only writes if no other process has updated it in the last minute
+    ApiKey.objects.filter(pk=api_key.pk).filter(
+        Q(last_seen_at__isnull=True) | Q(last_seen_at__lt=one_minute_ago)
+    ).update(last_seen_at=now)
+    # Also updates the cached key, so this process doesn't check again
+    # for another minute
+    api_key.last_seen_at = now
+
+
 def check_request_for_api_key(request):
     authorization = request.META.get("HTTP_AUTHORIZATION") or ""
     if not authorization.startswith("Bearer "):
@@ -51,18 +122,17 @@ def check_request_for_api_key(request):
     id, key = token.split(":")
     if not id.isnumeric():
         return auth_error("Bearer token is expected to be nnn:long-string")
-    try:
-        api_key = ApiKey.objects.get(pk=id)
-    except ApiKey.DoesNotExist:
+    cached = cached_api_key(int(id))
+    if cached is None:
         return auth_error("API key does not exist")
-    if not secrets.compare_digest(api_key.key, key):
+    digest, api_key = cached
+    if not secrets.compare_digest(digest, api_key_digest(key)):
         return auth_error("Invalid API key")
-    # update last_seen_at if not seen in last 5 minutes
-    if api_key.last_seen_at is None or api_key.last_seen_at < (
-        timezone.now() - datetime.timedelta(minutes=1)
-    ):
-        api_key.last_seen_at = timezone.now()
-        api_key.save()
+    update_api_key_last_seen_at(api_key)
+    # A copy, so the view can't change the cached key - it gets the
+    # secret back, which we now know matches
+    api_key = copy.copy(api_key)
+    api_key.key = key
     beeline.add_trace_field("user.api_key", api_key.id)
     request.api_key = api_key
     return None
@@ -79,42 +149,68 @@ def require_api_key(view_fn):
     return protected_view_fn
 
 
-def log_api_requests_no_response_body(view_fn):
-    return log_api_requests(view_fn, log_response=False)
+# How log_api_requests stores request and response bodies
+BODY_NONE = "none"
+# As bytes in post_body / response_body, without parsing them
+BODY_RAW = "raw"
+# The first API_LOG_TRUNCATED_BODY_BYTES bytes, in post_body / response_body
+BODY_TRUNCATED = "truncated"
+# Parsed into post_body_json / response_body_json if they are valid JSON
+BODY_PARSED = "parsed"
+API_LOG_TRUNCATED_BODY_BYTES = 4096
 
 
-def log_api_requests(view_fn, log_response=True):
+def log_api_requests_no_response_body(view_fn):
+    return log_api_requests(view_fn, response_body_storage=BODY_NONE)
+
+
+def log_api_requests(
+    view_fn=None,
+    post_body_storage: str = BODY_PARSED,
+    response_body_storage: str = BODY_PARSED,
+):
+    """Log each request to ApiLog. Use as @log_api_requests, or as
+    @log_api_requests(post_body_storage=BODY_RAW) to pick how the bodies
+    are stored.
+
+    Views are passed an on_request_logged function - callbacks registered
+    with it are called with the ApiLog, before it has been saved, if the
+    view returns without an exception.
+    """
+    if view_fn is None:
+        return partial(
+            log_api_requests,
+            post_body_storage=post_body_storage,
+            response_body_storage=response_body_storage,
+        )
+
     @wraps(view_fn)
     def replacement_view_function(request, *args, **kwargs):
         response: Optional[HttpResponse] = None
+        succeeded = False
         on_request_logged = []
         kwargs["on_request_logged"] = on_request_logged.append
         try:
             response = view_fn(request, *args, **kwargs)
+            succeeded = True
         finally:
             if response is None:
                 response = HttpResponseServerError()
             if getattr(request, "skip_api_logging", False):
                 return response
             # Create the log record
-            post_body = None
-            post_body_json = None
-            response_body = None
-            response_body_json = None
+            post_body = post_body_json = None
             if request.method == "POST":
-                try:
-                    post_body_json = orjson.loads(request.body)
-                except ValueError:
-                    post_body = request.body
-            if log_response:
-                try:
-                    response_body_json = orjson.loads(response.content)
-                except ValueError:
-                    response_body = response.content
-                except AttributeError:
-                    # Streaming responses have no .content
-                    pass
-            log = ApiLog.objects.create(
+                post_body, post_body_json = _body_for_log(
+                    request.body, post_body_storage
+                )
+            response_body = response_body_json = None
+            # Streaming responses have no .content
+            if hasattr(response, "content"):
+                response_body, response_body_json = _body_for_log(
+                    response.content, response_body_storage
+                )
+            log = ApiLog(
                 user=request.user if request.user.is_authenticated else None,
                 method=request.method,
                 path=request.path,
@@ -127,15 +223,43 @@ def log_api_requests(view_fn, log_response=True):
                 response_body_json=response_body_json,
                 api_key=getattr(request, "api_key", None) or None,
             )
+            # If the request was _successful_, we go on to call the callbacks.
+            if succeeded:
+                for callback in on_request_logged:
+                    callback(log)
+            write_api_log(log)
 
-        # If the request was _successful_, we go on to call the callbacks.
-        for callback in on_request_logged:
-            callback(log)
         return response
 
     return replacement_view_function
 
 
+def _body_for_log(body: bytes, storage: str) -> Tuple[Optional[bytes], Any]:
+    "Returns the (body, body_json) to store for this kind of body storage"
+    if storage == BODY_RAW:
+        return body, None
+    if storage == BODY_TRUNCATED:
+        return body[:API_LOG_TRUNCATED_BODY_BYTES], None
+    if storage == BODY_PARSED:
+        try:
+            return None, orjson.loads(body)
+        except ValueError:
+            return body, None
+    return None, None
+
+
+def write_api_log(log: ApiLog) -> None:
+    """Save the log before the response is returned - logs held in memory
+    would be lost if the instance is stopped or throttled afterwards"""
+    try:
+        with transaction.atomic():
+            log.save()
+    except IntegrityError:
+        # e.g. created_report pointing at a report whose transaction rolled
+        # back - that shouldn't turn the response into an error
+        sentry_sdk.capture_exception()
+
+
 def deny_if_api_is_disabled(view_fn):
     @wraps(view_fn)
     def inner(request, *args, **kwargs):
@@ -151,6 +275,61 @@ def deny_if_api_is_disabled(view_fn):
     return inner
 
 
+# Verified JWT payloads, keyed by the SHA-256 of the token - these are
+# reused until the token expires, so we only check each signature once
+VERIFIED_JWT_CACHE_SIZE = 1024
+_verified_jwts: "OrderedDict[str, Tuple[Dict[str, Any], bool]]" = OrderedDict()
+_verified_jwts_lock = threading.Lock()
+
+
+def clear_verified_jwt_cache() -> None:
+    with _verified_jwts_lock:
+        _verified_jwts.clear()
+
+
+@beeline.traced("verify_jwt")
+def verify_jwt(jwt_token: str) -> Tuple[Dict[str, Any], bool]:
+    """Verify a JWT against the help audience, falling back to the VIAL one.
+
+    Returns (payload, check_permissions) - tokens with the VIAL audience
+    are id tokens, which have no permissions in them. Raises if the token
+    is not valid for either audience.
+    """
+    key = hashlib.sha256(jwt_token.encode("utf-8")).hexdigest()
+    with _verified_jwts_lock:
+        cached = _verified_jwts.get(key)
+        if cached is not None:
+            if cached[0]["exp"] > time.time():
+                _verified_jwts.move_to_end(key)
+                beeline.add_context({"cached": True})
+                return cached
+            del _verified_jwts[key]
+
+    try:
+        verified = (
+            decode_and_verify_jwt(jwt_token, settings.HELP_JWT_AUDIENCE),
+            True,
+        )
+    except Exception as e:
+        try:
+            # We _also_ try to decode as the VIAL audience, since the
+            # /api/requestCall/debug endpoint passes in _our_ JWT, not
+            # help's.  Our JWT is an id token, not an access token,
+            # which means it won't have permissions in it (see below)
+            verified = (
+                decode_and_verify_jwt(jwt_token, settings.VIAL_JWT_AUDIENCE),
+                False,
+            )
+        except Exception:
+            raise e
+
+    with _verified_jwts_lock:
+        _verified_jwts[key] = verified
+        while len(_verified_jwts) > VERIFIED_JWT_CACHE_SIZE:
+            _verified_jwts.popitem(last=False)
+    return verified
+
+
 @beeline.traced("jwt_auth")
 def _jwt_auth(
     required_permissions: Set[str],
@@ -167,25 +346,12 @@ def _jwt_auth(
 
     # Check JWT token is valid
     jwt_access_token = authorization.split("Bearer ")[1]
-    check_permissions = True
     try:
-        jwt_payload = decode_and_verify_jwt(
-            jwt_access_token, settings.HELP_JWT_AUDIENCE
-        )
+        jwt_payload, check_permissions = verify_jwt(jwt_access_token)
     except Exception as e:
-        try:
-            # We _also_ try to decode as the VIAL audience, since the
-            # /api/requestCall/debug endpoint passes in _our_ JWT, not
-            # help's.  Our JWT is an id token, not an access token,
-            # which means it won't have permissions in it (see below)
-            jwt_payload = decode_and_verify_jwt(
-                jwt_access_token, settings.VIAL_JWT_AUDIENCE
-            )
-            check_permissions = False
-        except Exception:
-            return JsonResponse(
-                {"error": "Could not decode JWT", "details": str(e)}, status=403
-            )
+        return JsonResponse(
+            {"error": "Could not decode JWT", "details": str(e)}, status=403
+        )
 
     # We have an _access_ token, not an _id_ token.  This means that
     # it has authorization information, but no authentication
@@ -199,45 +365,51 @@ def _jwt_auth(
     email: Optional[str] = None
 
     external_id = "auth0:{}".format(jwt_payload["sub"])
-    with transaction.atomic():
-        # Get full metadata if the user doesn't exist; also take a lock on the user.
-        reporter = (
-            Reporter.objects.select_for_update().filter(external_id=external_id).first()
-        )
-        # We may want to update the email address and name; we do this
-        # sparingly, since it's a round-trip to the Auth0 endpoint, which
-        # is somewhat slow.  Again, we must do this because we're getting
-        # an access token, not an id token.
-        if not reporter or update_metadata:
-            with beeline.tracer(name="get user_info"):
-                user_info_response = requests.get(
-                    "https://vaccinateca.us.auth0.com/userinfo",
-                    headers={"Authorization": "Bearer {}".format(jwt_access_token)},
-                    timeout=5,
+    reporter = Reporter.objects.filter(external_id=external_id).first()
+    # We may want to update the email address and name; we do this
+    # sparingly, since it's a round-trip to the Auth0 endpoint, which
+    # is somewhat slow.  Again, we must do this because we're getting
+    # an access token, not an id token.
+    if not reporter or update_metadata:
+        with beeline.tracer(name="get user_info"):
+            user_info_response = requests.get(
+                "https://vaccinateca.us.auth0.com/userinfo",
+                headers={"Authorization": "Bearer {}".format(jwt_access_token)},
+                timeout=5,
+            )
+            beeline.add_context({"status": user_info_response.status_code})
+            # If this fails, we don't fail the request; they still
+            # had a valid access token, auth0 is just being slow
+            # telling us their bio.
+            if user_info_response.status_code == 200:
+                user_info = user_info_response.json()
+                name = user_info["name"]
+                if user_info["email_verified"]:
+                    email = user_info["email"]
+                jwt_auth0_role_names = ", ".join(
+                    sorted(user_info["https://help.vaccinateca.com/roles"])
                 )
-                beeline.add_context({"status": user_info_response.status_code})
-                # If this fails, we don't fail the request; they still
-                # had a valid access token, auth0 is just being slow
-                # telling us their bio.
-                if user_info_response.status_code == 200:
-                    user_info = user_info_response.json()
-                    name = user_info["name"]
-                    if user_info["email_verified"]:
-                        email = user_info["email"]
-                    jwt_auth0_role_names = ", ".join(
-                        sorted(user_info["https://help.vaccinateca.com/roles"])
-                    )
-
-        external_id = "auth0:{}".format(jwt_payload["sub"])
-        defaults = {"auth0_role_names": jwt_auth0_role_names}
-        if name is not None:
-            defaults["name"] = name
-        if email is not None:
-            defaults["email"] = email
+
+    defaults = {"auth0_role_names": jwt_auth0_role_names}
+    if name is not None:
+        defaults["name"] = name
+    if email is not None:
+        defaults["email"] = email
+    if not reporter:
         reporter = Reporter.objects.update_or_create(
             external_id=external_id,
             defaults=defaults,
         )[0]
+    else:
+        # Most requests come from a reporter we already know about, with
+        # the same roles as last time - those should not need a write
+        changed = [
+            key for key, value in defaults.items() if getattr(reporter, key) != value
+        ]
+        if changed:
+            for key in changed:
+                setattr(reporter, key, defaults[key])
+            reporter.save(update_fields=changed)
 
     # Finally, make sure they have the required permissions
     if check_permissions:
@@ -1,6 +1,7 @@
 import pathlib
 import re
-from typing import Any, Callable, Dict, List, Optional, Union
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import beeline
 import httpx
@@ -8,15 +9,16 @@ import markdown
 import orjson
 import reversion
 from api.location_metrics import LocationMetricsReport
-from bigmap.transform import source_to_location
 from core import exporter
 from core.import_utils import import_airtable_report
 from core.models import (
     AvailabilityTag,
+    CallRequest,
     ConcordanceIdentifier,
     County,
     ImportRun,
     Location,
+    LocationExport,
     LocationType,
     Provider,
     ProviderType,
@@ -26,7 +28,6 @@ from core.models import (
     TaskType,
 )
 from core.utils_merge_locations import merge_locations
-from django.contrib.auth.models import User
 from django.http import HttpRequest, JsonResponse
 from django.http.response import HttpResponse
 from django.shortcuts import render
@@ -34,10 +35,20 @@ from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from mdx_urlize import UrlizeExtension
 from pydantic import BaseModel, ValidationError, validator
-from vaccine_feed_ingest_schema.schema import ImportSourceLocation, Link
 
+from . import webhooks
+from .import_source_locations import (
+    ImportSourceLocationWithContentHash,
+    UnknownMatchedLocations,
+    build_location_from_source_location,
+    bulk_import_source_locations,
+    diff_source_locations,
+    source_locations_digest,
+)
 from .serialize import location_json
 from .utils import (
+    BODY_RAW,
+    BODY_TRUNCATED,
     PrettyJsonResponse,
     jwt_auth,
     log_api_requests,
@@ -128,7 +139,7 @@ class LocationValidator(_LocationSharedValidators):
 
 
 @csrf_exempt
-@log_api_requests
+@log_api_requests(post_body_storage=BODY_RAW, response_body_storage=BODY_TRUNCATED)
 @require_api_key
 @beeline.traced(name="import_locations")
 def import_locations(request, on_request_logged):
@@ -236,12 +247,8 @@ def start_import_run(request, on_request_logged):
         return JsonResponse({"error": "POST required"}, status=400)
 
 
-class ImportSourceLocationWithContentHash(ImportSourceLocation):
-    content_hash: Optional[str]
-
-
 @csrf_exempt
-@log_api_requests
+@log_api_requests(post_body_storage=BODY_RAW, response_body_storage=BODY_TRUNCATED)
 @require_api_key
 @beeline.traced(name="import_source_locations")
 def import_source_locations(request, on_request_logged):
@@ -274,97 +281,77 @@ def import_source_locations(request, on_request_logged):
     if errors:
         return JsonResponse({"errors": errors}, status=400)
     # All are valid, record them
-    created = []
-    updated = []
-    for json_record, record in zip(json_records, records):
-        matched_location = None
-        if record.match is not None and record.match.action == "existing":
-            matched_location = Location.objects.get(public_id=record.match.id)
-
-        defaults = {
-            "source_name": record.source_name,
-            "name": record.name,
-            "content_hash": record.content_hash,
-            "latitude": record.latitude,
-            "longitude": record.longitude,
-            "import_json": json_record["import_json"],
-            "import_run": import_run,
-            "last_imported_at": timezone.now(),
-        }
-
-        source_location, was_created = SourceLocation.objects.update_or_create(
-            source_uid=record.source_uid, defaults=defaults
-        )
-        safe_to_match = was_created or source_location.matched_location is None
-
-        if safe_to_match and matched_location is not None:
-            source_location.matched_location = matched_location
-            source_location.save(update_fields=["matched_location"])
-
-        import_json = record.import_json
-        links = list(import_json.links) if import_json.links is not None else []
-        # Always use the (source, id) as a concordance
-        links.append(
-            Link(authority=import_json.source.source, id=import_json.source.id)
-        )
-
-        for link in links:
-            identifier, _ = ConcordanceIdentifier.objects.get_or_create(
-                authority=link.authority, identifier=link.id
-            )
-            identifier.source_locations.add(source_location)
+    try:
+        result = bulk_import_source_locations(records, json_records, import_run)
+    except UnknownMatchedLocations as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
-        if safe_to_match:
-            if record.match is not None and record.match.action == "new":
-                matched_location = build_location_from_source_location(
-                    source_location, None
-                )
+    return JsonResponse(
+        {
+            "created": result.created,
+            "updated": result.updated,
+            "unchanged": result.unchanged,
+            "derive_details": {
+                "locations": result.derived_locations,
+                "seconds": round(result.derive_seconds, 3),
+            },
+        }
+    )
 
-            if matched_location is not None:
-                new_concordances = list(
-                    source_location.concordances.values_list(
-                        "pk", flat=True
-                    ).difference(matched_location.concordances.all())
-                )
-                matched_location.concordances.add(*new_concordances)
 
-        if was_created:
-            created.append(source_location.pk)
-        else:
-            updated.append(source_location.pk)
+class DiffSourceLocationsValidator(BaseModel):
+    source_name: str
+    source_locations: Optional[List[Tuple[str, Optional[str]]]]
+    digest: Optional[str]
 
-        if source_location.matched_location:
-            source_location.matched_location.derive_details(save=True)
+    @validator("digest", always=True)
+    def check_one_of(cls, v, values):
+        assert (v is None) != (
+            values.get("source_locations") is None
+        ), "Provide either source_locations or digest"
+        return v
 
-    return JsonResponse({"created": created, "updated": updated})
 
+@csrf_exempt
+@log_api_requests(post_body_storage=BODY_RAW, response_body_storage=BODY_TRUNCATED)
+@require_api_key
+@beeline.traced(name="diff_source_locations")
+def diff_source_locations_view(request, on_request_logged):
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=400)
+    try:
+        post_data = orjson.loads(request.body.decode("utf-8"))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    try:
+        data = DiffSourceLocationsValidator(**post_data)
+    except ValidationError as e:
+        return JsonResponse({"error": e.errors()}, status=400)
 
-def build_location_from_source_location(
-    source_location: SourceLocation, user: Optional[User]
-):
-    location_kwargs = source_to_location(source_location.import_json)
-    location_kwargs["created_by"] = user
-    if location_kwargs["state"] is not None:
-        location_kwargs["state"] = State.objects.get(
-            abbreviation=location_kwargs["state"].upper()
+    if data.digest is not None:
+        count, digest = source_locations_digest(data.source_name)
+        return JsonResponse(
+            {
+                "source_name": data.source_name,
+                "count": count,
+                "digest": digest,
+                "matches": digest == data.digest,
+            }
         )
-    unknown_location_type = LocationType.objects.get(name="Unknown")
 
-    location = Location.objects.create(
-        location_type=unknown_location_type,
-        import_run=source_location.import_run,
-        **location_kwargs,
+    diff = diff_source_locations(data.source_name, data.source_locations)
+    return JsonResponse(
+        {
+            "source_name": data.source_name,
+            "new": diff.new,
+            "changed": diff.changed,
+            "missing": diff.missing,
+        }
     )
-    location.concordances.set(source_location.concordances.all())
-    location.save()
-    source_location.matched_location = location
-    source_location.save()
-
-    return location
 
 
 @csrf_exempt
-@log_api_requests
+@log_api_requests(post_body_storage=BODY_RAW, response_body_storage=BODY_TRUNCATED)
 @require_api_key
 @beeline.traced(name="import_reports")
 def import_reports(request, on_request_logged):
@@ -547,6 +534,84 @@ def api_export_vaccinate_the_states(request, on_request_logged):
     return JsonResponse({"ok": 1})
 
 
+@csrf_exempt
+@require_api_key
+@log_api_requests
+@beeline.traced(name="refresh_location_export")
+def refresh_location_export(request, on_request_logged):
+    if request.method != "POST":
+        return JsonResponse(
+            {"error": "Must be a POST"},
+            status=400,
+        )
+    start = time.perf_counter()
+    # Run daily at least, as planned closures pass without any other write
+    expired = Location.expire_planned_closures()
+    LocationExport.refresh()
+    return JsonResponse(
+        {
+            "ok": 1,
+            "expired_planned_closures": expired,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+    )
+
+
+@csrf_exempt
+@require_api_key
+@log_api_requests
+@beeline.traced(name="refill_call_queue")
+def refill_call_queue(request, on_request_logged):
+    if request.method != "POST":
+        return JsonResponse(
+            {"error": "Must be a POST"},
+            status=400,
+        )
+    start = time.perf_counter()
+    added = CallRequest.refill_queue()
+    return JsonResponse(
+        {
+            "ok": 1,
+            "added": {state or "all": count for state, count in added.items()},
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+    )
+
+
+# deliverWebhooks stops starting new batches after this long
+DELIVER_WEBHOOKS_MAX_SECONDS = 30
+
+
+@csrf_exempt
+@require_api_key
+@log_api_requests
+@beeline.traced(name="deliver_webhooks")
+def deliver_webhooks(request, on_request_logged):
+    if request.method != "POST":
+        return JsonResponse(
+            {"error": "Must be a POST"},
+            status=400,
+        )
+    start = time.perf_counter()
+    batch_size = 100
+    delivered = failed = 0
+    while time.perf_counter() - start < DELIVER_WEBHOOKS_MAX_SECONDS:
+        num_delivered, num_failed = webhooks.deliver_webhooks(batch_size=batch_size)
+        delivered += num_delivered
+        failed += num_failed
+        if num_delivered + num_failed < batch_size:
+            # Caught up with the events that are due
+            break
+    return JsonResponse(
+        {
+            "ok": 1,
+            "delivered": delivered,
+            "failed": failed,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+    )
+
+
 def api_export_preview_locations(request):
     # Show a preview of the export API for a subset of locations
     location_ids = request.GET.getlist("id")
@@ -625,7 +690,7 @@ class UpdateLocationsValidator(BaseModel):
 
 
 @csrf_exempt
-@log_api_requests
+@log_api_requests(post_body_storage=BODY_RAW, response_body_storage=BODY_TRUNCATED)
 @require_api_key
 @beeline.traced(name="update_locations")
 def update_locations(request, on_request_logged):
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Dict, Optional, Tuple
+
+import beeline
+import requests
+from django.db import transaction
+from django.utils import timezone
+
+from .models import WebhookEvent
+
+TIMEOUT_SECONDS = 5
+# Failed deliveries are retried after 30s, 60s, 120s... up to an hour
+RETRY_BACKOFF_SECONDS = 30
+MAX_RETRY_BACKOFF_SECONDS = 60 * 60
+# Claimed events are not handed to another worker for this long
+CLAIM_SECONDS = 5 * 60
+
+
+def queue_webhook(url: str, payload: Dict[str, Any], **kwargs: Any) -> WebhookEvent:
+    """Add a POST to the outbox - call this inside the transaction that
+    makes the change, so the event is only sent if that commits"""
+    return WebhookEvent.objects.create(url=url, payload=payload, **kwargs)
+
+
+def _post(event: WebhookEvent) -> Optional[str]:
+    "POST the event, returning an error message if that failed"
+    try:
+        response = requests.post(event.url, json=event.payload, timeout=TIMEOUT_SECONDS)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        return "{}: {}".format(e.__class__.__name__, e)
+    return None
+
+
+@beeline.traced("deliver_webhooks")
+def deliver_webhooks(
+    max_workers: int = 8, batch_size: int = 100, max_attempts: int = 8
+) -> Tuple[int, int]:
+    """Deliver one batch of due events, up to max_workers at a time.
+
+    Returns (number delivered, number that failed and will be retried,
+    or have been given up on after max_attempts)
+    """
+    now = timezone.now()
+    # Claim the batch, so other workers skip it while we deliver
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.filter(
+                status=WebhookEvent.Status.PENDING, next_attempt_at__lte=now
+            )
+            .order_by("next_attempt_at")
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+            next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+        )
+    beeline.add_context({"count": len(events)})
+    if not events:
+        return 0, 0
+
+    # Only the HTTP requests run in the pool - the database is updated
+    # from this thread
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        errors = list(executor.map(_post, events))
+
+    num_delivered = num_failed = 0
+    for event, error in zip(events, errors):
+        event.attempts += 1
+        if error is None:
+            event.status = WebhookEvent.Status.DELIVERED
+            event.delivered_at = timezone.now()
+            num_delivered += 1
+        else:
+            event.last_error = error
+            if event.attempts >= max_attempts:
+                event.status = WebhookEvent.Status.FAILED
+            else:
+                event.next_attempt_at = timezone.now() + timedelta(
+                    seconds=min(
+                        RETRY_BACKOFF_SECONDS * 2 ** (event.attempts - 1),
+                        MAX_RETRY_BACKOFF_SECONDS,
+                    )
+                )
+            num_failed += 1
+    WebhookEvent.objects.bulk_update(
+        events,
+        ["attempts", "status", "delivered_at", "last_error", "next_attempt_at"],
+    )
+    return num_delivered, num_failed
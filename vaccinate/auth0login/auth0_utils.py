@@ -1,28 +1,96 @@
-import functools
+import threading
+import time
+from typing import Dict, Optional
 
 import beeline
 import requests
 from django.conf import settings
-from jose import jwt
+from jose import jwk, jwt
+from jose.backends.base import Key
+from jose.exceptions import JWTError
 
 DEFAULT_ISSUER = "https://" + settings.SOCIAL_AUTH_AUTH0_DOMAIN + "/"
 
+# Signing keys are re-fetched this often, so rotated keys get picked up
+JWKS_TTL_SECONDS = 60 * 60
+# A token signed with a key we don't know triggers a re-fetch, but no
+# more often than this - otherwise junk tokens could hammer Auth0
+JWKS_MIN_REFETCH_SECONDS = 30
+
+# Parsed signing keys, indexed by kid, and when we fetched them
+_jwks: Dict[str, Key] = {}
+_jwks_fetched_at: Optional[float] = None
+# Only one thread fetches at a time; the others wait and use its result
+_jwks_lock = threading.Lock()
+
 
-@functools.cache
 @beeline.traced(name="jwks")
-def jwks():
+def fetch_jwks() -> Dict[str, Key]:
+    "Fetch the Auth0 signing keys and parse them into key objects by kid"
     jwt_keys_url = (
         "https://" + settings.SOCIAL_AUTH_AUTH0_DOMAIN + "/.well-known/jwks.json"
     )
-    return requests.get(jwt_keys_url, timeout=5).content
+    response = requests.get(jwt_keys_url, timeout=5)
+    response.raise_for_status()
+    return {
+        key["kid"]: jwk.construct(key, algorithm=key.get("alg", "RS256"))
+        for key in response.json()["keys"]
+        if key.get("use", "sig") == "sig"
+    }
+
+
+def clear_jwks_cache() -> None:
+    global _jwks, _jwks_fetched_at
+    with _jwks_lock:
+        _jwks = {}
+        _jwks_fetched_at = None
+
+
+def signing_key(kid: Optional[str]) -> Key:
+    "Return the signing key for this kid, re-fetching the keys if necessary"
+    global _jwks, _jwks_fetched_at
+    fetched_at = _jwks_fetched_at
+    key = _jwks.get(kid) if kid else None
+    if (
+        key is not None
+        and fetched_at is not None
+        and time.monotonic() - fetched_at < JWKS_TTL_SECONDS
+    ):
+        return key
+
+    with _jwks_lock:
+        # Another thread may have re-fetched while we were waiting
+        if _jwks_fetched_at != fetched_at and kid in _jwks:
+            return _jwks[kid]
+        age = None if _jwks_fetched_at is None else time.monotonic() - _jwks_fetched_at
+        if (
+            age is None
+            or age >= JWKS_TTL_SECONDS
+            or (kid not in _jwks and age >= JWKS_MIN_REFETCH_SECONDS)
+        ):
+            try:
+                _jwks = fetch_jwks()
+                _jwks_fetched_at = time.monotonic()
+            except (requests.RequestException, ValueError, KeyError):
+                # Keep using the keys we have if Auth0 is unavailable,
+                # and try again after JWKS_MIN_REFETCH_SECONDS
+                if not _jwks:
+                    raise
+                _jwks_fetched_at = (
+                    time.monotonic() - JWKS_TTL_SECONDS + JWKS_MIN_REFETCH_SECONDS
+                )
+        if kid in _jwks:
+            return _jwks[kid]
+    raise JWTError("Unknown signing key: {}".format(kid))
 
 
 @beeline.traced(name="decode_and_verify_jwt")
 def decode_and_verify_jwt(jwt_token, audience, issuer=DEFAULT_ISSUER):
     "Verify the signature of a JWT and return the decoded payload"
+    kid = jwt.get_unverified_header(jwt_token).get("kid")
     return jwt.decode(
         jwt_token,
-        jwks(),
+        signing_key(kid),
         algorithms=["RS256"],
         audience=audience,
         issuer=issuer,
@@ -1,9 +1,13 @@
 import datetime
+import threading
 import urllib
 
 import pytest
 from django.contrib.auth.models import User
 from django.contrib.sessions.models import Session
+from jose.exceptions import JWTError
+
+from . import auth0_utils
 
 
 @pytest.mark.django_db
@@ -82,6 +86,58 @@ def test_login_with_auth0_complete(
     assert response.url == "/"
 
 
+JWKS_URL = "https://vaccinateca.us.auth0.com/.well-known/jwks.json"
+
+
+# The kids of the two keys in conftest.MOCK_JWKS
+KIDS = ["frtiPaxg_e2WoM1xToR0G", "xU8DLqrQ61ymbiAPwrhlz"]
+
+
+def test_signing_key_cache(requests_mock, mock_well_known_jwts, monkeypatch):
+    # Both keys are parsed from a single fetch
+    key = auth0_utils.signing_key(KIDS[0])
+    assert auth0_utils.signing_key(KIDS[0]) is key
+    assert auth0_utils.signing_key(KIDS[1]) is not key
+    assert requests_mock.call_count == 1
+
+    # An unknown kid doesn't re-fetch straight after a fetch
+    with pytest.raises(JWTError):
+        auth0_utils.signing_key("unknown")
+    assert requests_mock.call_count == 1
+    # ... but does once JWKS_MIN_REFETCH_SECONDS have passed
+    monkeypatch.setattr(auth0_utils, "JWKS_MIN_REFETCH_SECONDS", 0)
+    with pytest.raises(JWTError):
+        auth0_utils.signing_key("unknown")
+    assert requests_mock.call_count == 2
+
+    # Keys are re-fetched once they are older than JWKS_TTL_SECONDS
+    monkeypatch.setattr(auth0_utils, "JWKS_TTL_SECONDS", 0)
+    auth0_utils.signing_key(KIDS[0])
+    assert requests_mock.call_count == 3
+
+    # If that fails we carry on with the keys we have
+    requests_mock.get(JWKS_URL, status_code=503)
+    assert auth0_utils.signing_key(KIDS[0]) is not None
+
+
+def test_signing_key_single_flight(requests_mock, mock_well_known_jwts):
+    kid = KIDS[0]
+    barrier = threading.Barrier(10)
+    keys = []
+
+    def get_key():
+        barrier.wait()
+        keys.append(auth0_utils.signing_key(kid))
+
+    threads = [threading.Thread(target=get_key) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(keys) == 10
+    assert requests_mock.call_count == 1
+
+
 def _get_state(client):
     response = client.get("/login/auth0")
     qs_bits = dict(urllib.parse.parse_qsl(response.url.split("?")[1]))
@@ -20,13 +20,51 @@ DEBUG = bool(os.environ.get("DJANGO_DEBUG"))
 INTERNAL_IPS = ["127.0.0.1"]
 
 MAPBOX_ACCESS_TOKEN = os.environ.get("MAPBOX_ACCESS_TOKEN")
+# Can be pointed at a stand-in server for local development - the tests
+# mock api.mapbox.com with requests_mock instead
+MAPBOX_API_URL = os.environ.get("MAPBOX_API_URL", "https://api.mapbox.com")
+# Exports that add, change or remove up to this many features append them to
+# the tileset source rather than replacing it
+MAPBOX_EXPORT_MAX_APPEND_FEATURES = int(
+    os.environ.get("MAPBOX_EXPORT_MAX_APPEND_FEATURES") or 1000
+)
+# Exports still running this long after they started are marked as failed
+MAPBOX_EXPORT_TIMEOUT_MINUTES = 30
+
+# submitReport queues a webhook to this URL for every report, delivered by
+# /api/deliverWebhooks or ./manage.py deliver_webhooks
+ZAPIER_REPORT_URL = os.environ.get("ZAPIER_REPORT_URL")
 
 ALLOWED_HOSTS = ["*"]
 
-# Call request queue is backfilled if this minimum is reached
+# API keys are cached in-process for this many seconds - a revoked key
+# stops working in other processes within this time
+API_KEY_CACHE_SECONDS = 10
+
+# Set once the location_denormalization_triggers command has installed the
+# triggers - the database then maintains Location.dn_* and Python skips it
+LOCATION_DENORMALIZATION_TRIGGERS = bool(
+    os.environ.get("LOCATION_DENORMALIZATION_TRIGGERS")
+)
+
+# Call request queue is backfilled by the refill_call_queue job if the number
+# of available requests drops below this minimum
 MIN_CALL_REQUEST_QUEUE_ITEMS = 20
+# Per-state minimums, topped up first - e.g. "CA=20,OR=10"
+MIN_CALL_REQUEST_QUEUE_ITEMS_BY_STATE = {
+    state.strip(): int(minimum)
+    for state, minimum in (
+        pair.split("=")
+        for pair in os.environ.get(
+            "MIN_CALL_REQUEST_QUEUE_ITEMS_BY_STATE", "CA=20"
+        ).split(",")
+        if pair.strip()
+    )
+}
 # How long should a call request be locked as "claimed"?
 CLAIM_LOCK_MINUTES = 60
+# Most call requests a caller can claim at once with /api/requestCall?count=N
+MAX_CALL_REQUESTS_PER_CLAIM = 10
 
 # django-sql-dashboard
 DASHBOARD_ROW_LIMIT = 1000
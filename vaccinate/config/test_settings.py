@@ -1,6 +1,7 @@
 from .settings import *
 
 MIN_CALL_REQUEST_QUEUE_ITEMS = 0
+MIN_CALL_REQUEST_QUEUE_ITEMS_BY_STATE = {}
 
 # Tests fail if read-only connection is present:
 if "dashboard" in DATABASES:
@@ -43,6 +43,8 @@ urlpatterns = [
             docs="/api/docs#post-apirequestcall",
         ),
     ),
+    path("api/refillCallQueue", api_views.refill_call_queue),
+    path("api/deliverWebhooks", api_views.deliver_webhooks),
     path("api/callerStats", caller_api_views.caller_stats),
     path(
         "api/callerStats/debug",
@@ -134,6 +136,17 @@ urlpatterns = [
             docs="/api/docs#post-apiimportsourcelocationsimport_run_idx",
         ),
     ),
+    path("api/diffSourceLocations", api_views.diff_source_locations_view),
+    path(
+        "api/diffSourceLocations/debug",
+        api_views.api_debug_view(
+            "api/diffSourceLocations",
+            use_jwt=False,
+            body_textarea=True,
+            default_body='{"source_name": "", "source_locations": []}',
+            docs="/api/docs#post-apidiffsourcelocations",
+        ),
+    ),
     path("api/importReports", api_views.import_reports),
     path(
         "api/importReports/debug",
@@ -195,9 +208,11 @@ urlpatterns = [
     path("api/availabilityTags", api_views.availability_tags),
     path("api/export", api_views.api_export),
     path("api/exportVaccinateTheStates", api_views.api_export_vaccinate_the_states),
+    path("api/refreshLocationExport", api_views.refresh_location_export),
     path("api/exportPreview/Locations.json", api_views.api_export_preview_locations),
     path("api/exportPreview/Providers.json", api_views.api_export_preview_providers),
     path("api/exportMapbox", export_mapbox_views.export_mapbox),
+    path("api/exportMapbox/<int:export_id>", export_mapbox_views.export_mapbox_status),
     path("api/exportMapboxPreview", export_mapbox_views.export_mapbox_preview),
     path("api/location_metrics", api_views.location_metrics),
     path("api/counties/<state_abbreviation>", api_views.counties),
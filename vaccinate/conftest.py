@@ -33,6 +33,23 @@ MOCK_JWKS = {
 }
 
 
+@pytest.fixture(autouse=True)
+def clear_auth_caches():
+    from api.utils import clear_api_key_cache, clear_verified_jwt_cache
+    from auth0login.auth0_utils import clear_jwks_cache
+
+    # Tests move the clock around and mock the JWKS endpoint, and create API
+    # keys with the same ids, so don't let
+    # anything cached in one test leak into another
+    clear_verified_jwt_cache()
+    clear_jwks_cache()
+    clear_api_key_cache()
+    yield
+    clear_verified_jwt_cache()
+    clear_jwks_cache()
+    clear_api_key_cache()
+
+
 @pytest.fixture
 def jwt_unauth_id_token(time_machine, mock_well_known_jwts, mock_auth0_userinfo):
     time_machine.move_to(datetime.datetime(2021, 3, 17, 10, 0, 0))
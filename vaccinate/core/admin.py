@@ -329,13 +329,14 @@ def make_call_request_queue_action(reason: str):
         # -- it may have GROUP BY, which makes us unable to SELECT FOR
         # UPDATE it.
         queryset = Location.objects.filter(id__in=[loc.id for loc in queryset])
-        inserted = CallRequest.insert(queryset, reason)
+        num_inserted = CallRequest.insert(queryset, reason)
 
         message = "Added {} location{} to queue with reason: {}".format(
-            len(inserted), "s" if len(inserted) == 1 else "", reason
+            num_inserted, "s" if num_inserted == 1 else "", reason
         )
-        if len(inserted) < queryset.count():
-            skipped = queryset.count() - len(inserted)
+        num_selected = queryset.count()
+        if num_inserted < num_selected:
+            skipped = num_selected - num_inserted
             message += ". Skipped {} location{}".format(
                 skipped, "s" if skipped != 1 else ""
             )
@@ -606,6 +607,10 @@ class LocationAdmin(DynamicListDisplayMixin, CompareVersionAdmin):
                     "dn_latest_non_skip_report",
                     "dn_skip_report_count",
                     "dn_yes_report_count",
+                    "dn_report_count",
+                    "dn_is_exportable",
+                    "last_called_at",
+                    "timezone",
                     "appointments_walkins_last_updated_at",
                     "appointments_walkins_provenance_source_location",
                     "vaccines_offered_provenance_report",
@@ -758,6 +763,10 @@ class LocationAdmin(DynamicListDisplayMixin, CompareVersionAdmin):
         "dn_latest_non_skip_report",
         "dn_skip_report_count",
         "dn_yes_report_count",
+        "dn_report_count",
+        "dn_is_exportable",
+        "last_called_at",
+        "timezone",
         "matched_source_locations",
         "vaccines_offered",
         "accepts_appointments",
@@ -0,0 +1,398 @@
+"""
+Optional Postgres trigger implementation of Location.update_denormalizations()
+
+The SQL functions are defined here. Migration 0159 creates them, and each
+later migration that adds a denormalized column creates them again with that
+column included. The triggers that call them are installed or removed using:
+
+    ./manage.py location_denormalization_triggers install
+    ./manage.py location_denormalization_triggers uninstall
+
+Set LOCATION_DENORMALIZATION_TRIGGERS=1 once they are installed, to stop
+the Python code from doing the same work again.
+"""
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import connection
+
+DENORMALIZED_FIELDS = [
+    "dn_latest_report",
+    "dn_latest_report_including_pending",
+    "dn_latest_yes_report",
+    "dn_latest_skip_report",
+    "dn_latest_non_skip_report",
+    "dn_skip_report_count",
+    "dn_yes_report_count",
+    "dn_report_count",
+    "dn_is_exportable",
+    "last_called_at",
+]
+
+DENORMALIZED_COLUMNS = [
+    "dn_latest_report_id",
+    "dn_latest_report_including_pending_id",
+    "dn_latest_yes_report_id",
+    "dn_latest_skip_report_id",
+    "dn_latest_non_skip_report_id",
+    "dn_skip_report_count",
+    "dn_yes_report_count",
+    "dn_report_count",
+    "dn_is_exportable",
+    "last_called_at",
+]
+
+# Reports with any of these tags are not exported to the public map
+EXPORT_EXCLUDED_AVAILABILITY_TAGS = (
+    "incorrect_contact_information",
+    "location_permanently_closed",
+    "may_be_a_vaccination_site_in_the_future",
+    "not_open_to_the_public",
+    "will_never_be_a_vaccination_site",
+    "only_staff",
+)
+EXCLUDED_TAGS_SQL = ", ".join(
+    "'{}'".format(slug) for slug in EXPORT_EXCLUDED_AVAILABILITY_TAGS
+)
+
+# column => (type, expression) calculating it for a location from the
+# reports in location_expected_denormalizations()
+COLUMN_SQL = {
+    "dn_latest_report_id": (
+        "integer",
+        """(select id from reports r where r.location_id = location.id
+            and not r.is_pending_review
+            order by r.created_at desc, r.id desc limit 1)""",
+    ),
+    "dn_latest_report_including_pending_id": (
+        "integer",
+        """(select id from reports r where r.location_id = location.id
+            order by r.created_at desc, r.id desc limit 1)""",
+    ),
+    "dn_latest_yes_report_id": (
+        "integer",
+        """(select id from reports r where r.location_id = location.id
+            and not r.is_pending_review and r.is_yes
+            order by r.created_at desc, r.id desc limit 1)""",
+    ),
+    "dn_latest_skip_report_id": (
+        "integer",
+        """(select id from reports r where r.location_id = location.id
+            and not r.is_pending_review and r.is_skip
+            order by r.created_at desc, r.id desc limit 1)""",
+    ),
+    "dn_latest_non_skip_report_id": (
+        "integer",
+        """(select id from reports r where r.location_id = location.id
+            and not r.is_pending_review and not r.is_skip
+            order by r.created_at desc, r.id desc limit 1)""",
+    ),
+    "dn_skip_report_count": (
+        "integer",
+        """(select count(*) from reports r where r.location_id = location.id
+            and not r.is_pending_review and r.is_skip)::integer""",
+    ),
+    "dn_yes_report_count": (
+        "integer",
+        """(select count(*) from reports r where r.location_id = location.id
+            and not r.is_pending_review and r.is_yes)::integer""",
+    ),
+    "dn_report_count": (
+        "integer",
+        """(select count(*) from reports r where r.location_id = location.id)::integer""",
+    ),
+    "dn_is_exportable": (
+        "boolean",
+        """coalesce((select not r.is_export_excluded from reports r
+            where r.location_id = location.id
+            and not r.is_pending_review and not r.is_skip
+            order by r.created_at desc, r.id desc limit 1), true)""",
+    ),
+    "last_called_at": (
+        "timestamp with time zone",
+        """(select created_at from reports r where r.location_id = location.id
+            order by r.created_at desc, r.id desc limit 1)""",
+    ),
+}
+
+EXPECTED_DENORMALIZATIONS_SQL = """
+create or replace function location_expected_denormalizations(location_ids integer[])
+returns table (
+    location_id integer,
+    {returns}
+) as $$
+    with reports as (
+        select
+            report.id,
+            report.location_id,
+            report.created_at,
+            report.is_pending_review,
+            exists (
+                select 1 from call_report_availability_tag
+                join availability_tag
+                    on availability_tag.id = call_report_availability_tag.availabilitytag_id
+                where call_report_availability_tag.report_id = report.id
+                    and availability_tag."group" = 'yes'
+            ) as is_yes,
+            exists (
+                select 1 from call_report_availability_tag
+                join availability_tag
+                    on availability_tag.id = call_report_availability_tag.availabilitytag_id
+                where call_report_availability_tag.report_id = report.id
+                    and availability_tag."group" = 'skip'
+            ) as is_skip,
+            coalesce(report.planned_closure < current_date, false) or exists (
+                select 1 from call_report_availability_tag
+                join availability_tag
+                    on availability_tag.id = call_report_availability_tag.availabilitytag_id
+                where call_report_availability_tag.report_id = report.id
+                    and availability_tag.slug in ({excluded_tags})
+            ) as is_export_excluded
+        from report
+        where report.location_id = any(location_ids)
+            and report.soft_deleted is not true
+    )
+    select
+        location.id,
+        {expressions}
+    from location
+    where location.id = any(location_ids)
+$$ language sql stable;
+"""
+
+UPDATE_DENORMALIZATIONS_SQL = """
+create or replace function location_update_denormalizations(location_ids integer[])
+returns void as $$
+    update location set
+        {assignments}
+    from location_expected_denormalizations(location_ids) expected
+    where location.id = expected.location_id
+        and (
+            {stored}
+        ) is distinct from (
+            {expected}
+        )
+$$ language sql;
+"""
+
+# Statement-level triggers with transition tables, so a bulk write
+# recalculates each affected location once
+TRIGGER_FUNCTIONS_SQL = """
+create or replace function report_denormalize_locations_new() returns trigger as $$
+begin
+    perform location_update_denormalizations(
+        array(select distinct location_id from new_rows)
+    );
+    return null;
+end
+$$ language plpgsql;
+
+create or replace function report_denormalize_locations_old() returns trigger as $$
+begin
+    perform location_update_denormalizations(
+        array(select distinct location_id from old_rows)
+    );
+    return null;
+end
+$$ language plpgsql;
+
+create or replace function report_denormalize_locations_moved() returns trigger as $$
+begin
+    perform location_update_denormalizations(
+        array(
+            select location_id from new_rows
+            union
+            select location_id from old_rows
+        )
+    );
+    return null;
+end
+$$ language plpgsql;
+
+create or replace function report_tag_denormalize_locations_new() returns trigger as $$
+begin
+    perform location_update_denormalizations(
+        array(
+            select distinct report.location_id from new_rows
+            join report on report.id = new_rows.report_id
+        )
+    );
+    return null;
+end
+$$ language plpgsql;
+
+create or replace function report_tag_denormalize_locations_old() returns trigger as $$
+begin
+    perform location_update_denormalizations(
+        array(
+            select distinct report.location_id from old_rows
+            join report on report.id = old_rows.report_id
+        )
+    );
+    return null;
+end
+$$ language plpgsql;
+"""
+
+# The return type of location_expected_denormalizations() changes with the
+# columns, so it has to be dropped rather than replaced
+DROP_FUNCTIONS_SQL = """
+drop function if exists location_update_denormalizations(integer[]);
+drop function if exists location_expected_denormalizations(integer[]);
+"""
+
+DROP_TRIGGER_FUNCTIONS_SQL = """
+drop function if exists report_tag_denormalize_locations_old();
+drop function if exists report_tag_denormalize_locations_new();
+drop function if exists report_denormalize_locations_moved();
+drop function if exists report_denormalize_locations_old();
+drop function if exists report_denormalize_locations_new();
+"""
+
+
+def functions_sql(columns: List[str]) -> str:
+    """
+    SQL that drops and creates location_expected_denormalizations() and
+    location_update_denormalizations() for these columns - the ones that
+    exist as of the migration calling this
+    """
+    columns = [column for column in DENORMALIZED_COLUMNS if column in columns]
+    return (
+        DROP_FUNCTIONS_SQL
+        + EXPECTED_DENORMALIZATIONS_SQL.format(
+            returns=",\n    ".join(
+                "{} {}".format(column, COLUMN_SQL[column][0]) for column in columns
+            ),
+            expressions=",\n        ".join(COLUMN_SQL[column][1] for column in columns),
+            excluded_tags=EXCLUDED_TAGS_SQL,
+        )
+        + UPDATE_DENORMALIZATIONS_SQL.format(
+            assignments=",\n        ".join(
+                "{0} = expected.{0}".format(column) for column in columns
+            ),
+            stored=",\n            ".join(
+                "location.{}".format(column) for column in columns
+            ),
+            expected=",\n            ".join(
+                "expected.{}".format(column) for column in columns
+            ),
+        )
+    )
+
+
+# (trigger name, table, event, transition tables, function)
+TRIGGERS = [
+    (
+        "report_insert_denormalize_locations",
+        "report",
+        "insert",
+        "new table as new_rows",
+        "report_denormalize_locations_new",
+    ),
+    (
+        "report_update_denormalize_locations",
+        "report",
+        "update",
+        "new table as new_rows old table as old_rows",
+        "report_denormalize_locations_moved",
+    ),
+    (
+        "report_delete_denormalize_locations",
+        "report",
+        "delete",
+        "old table as old_rows",
+        "report_denormalize_locations_old",
+    ),
+    (
+        "report_tag_insert_denormalize_locations",
+        "call_report_availability_tag",
+        "insert",
+        "new table as new_rows",
+        "report_tag_denormalize_locations_new",
+    ),
+    (
+        "report_tag_delete_denormalize_locations",
+        "call_report_availability_tag",
+        "delete",
+        "old table as old_rows",
+        "report_tag_denormalize_locations_old",
+    ),
+]
+
+
+def install_triggers() -> None:
+    with connection.cursor() as cursor:
+        for name, table, event, referencing, function in TRIGGERS:
+            cursor.execute("drop trigger if exists {} on {}".format(name, table))
+            cursor.execute(
+                "create trigger {} after {} on {} referencing {} "
+                "for each statement execute function {}()".format(
+                    name, event, table, referencing, function
+                )
+            )
+
+
+def uninstall_triggers() -> None:
+    with connection.cursor() as cursor:
+        for name, table, _, _, _ in TRIGGERS:
+            cursor.execute("drop trigger if exists {} on {}".format(name, table))
+
+
+def installed_triggers() -> List[str]:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "select tgname from pg_trigger where tgname = any(%s) order by tgname",
+            [[name for name, _, _, _, _ in TRIGGERS]],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def find_inconsistent_locations(
+    location_ids: Iterable[int],
+) -> Dict[int, List[Tuple[str, object, object]]]:
+    """
+    Compare the stored denormalized columns with what they should be.
+
+    Returns {location_id: [(column, stored, expected), ...]} for locations
+    where at least one column differs.
+    """
+    location_ids = list(location_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            select location.id, {stored}, {expected}
+            from location_expected_denormalizations(%s) expected
+            join location on location.id = expected.location_id
+            """.format(
+                stored=", ".join(
+                    "location.{}".format(column) for column in DENORMALIZED_COLUMNS
+                ),
+                expected=", ".join(
+                    "expected.{}".format(column) for column in DENORMALIZED_COLUMNS
+                ),
+            ),
+            [location_ids],
+        )
+        rows = cursor.fetchall()
+    inconsistent = {}
+    num_columns = len(DENORMALIZED_COLUMNS)
+    for row in rows:
+        stored = row[1 : 1 + num_columns]
+        expected = row[1 + num_columns :]
+        differences = [
+            (column, stored_value, expected_value)
+            for column, stored_value, expected_value in zip(
+                DENORMALIZED_COLUMNS, stored, expected
+            )
+            if stored_value != expected_value
+        ]
+        if differences:
+            inconsistent[row[0]] = differences
+    return inconsistent
+
+
+def update_denormalizations(location_ids: Iterable[int]) -> None:
+    "Recalculate the denormalized columns for these locations in the database"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "select location_update_denormalizations(%s)", [list(location_ids)]
+        )
@@ -0,0 +1,55 @@
+import time
+
+from core.models import Location
+from core.utils import keyset_pagination_iterator, timezone_for_point
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    "Calculate Location.timezone for locations that don't have one yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recalculate every location, not just those with no timezone",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of locations to update per query",
+        )
+
+    def handle(self, *args, **options):
+        locations = Location.objects.exclude(latitude=None).exclude(longitude=None)
+        if not options["all"]:
+            locations = locations.filter(timezone=None)
+        start = time.perf_counter()
+        num_checked = 0
+        batch = []
+
+        def flush():
+            # bulk_update skips Location.save() and its side effects
+            Location.objects.bulk_update(batch, ["timezone"])
+            self.stdout.write("{} locations updated".format(len(batch)))
+            batch.clear()
+
+        for location in keyset_pagination_iterator(
+            locations.only("latitude", "longitude", "timezone"),
+            batch_size=options["batch_size"],
+        ):
+            num_checked += 1
+            timezone = timezone_for_point(location.latitude, location.longitude)
+            if timezone != location.timezone:
+                location.timezone = timezone
+                batch.append(location)
+                if len(batch) >= options["batch_size"]:
+                    flush()
+        if batch:
+            flush()
+        self.stdout.write(
+            "Checked {} locations in {:.2f}s".format(
+                num_checked, time.perf_counter() - start
+            )
+        )
@@ -0,0 +1,61 @@
+import time
+
+from api.utils import _jwt_auth, clear_verified_jwt_cache
+from core.models import Reporter
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+
+class Command(BaseCommand):
+    """
+    Measure the per-request overhead of JWT authentication
+
+    Compares the old behaviour - verifying the token and writing the
+    reporter on every request - against reusing the cached verification
+    with no write. Pass a current access token from help.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--token", required=True, help="JWT access token")
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Number of requests to time"
+        )
+
+    def handle(self, *args, **options):
+        request_factory = RequestFactory()
+
+        def authenticate():
+            request = request_factory.post(
+                "/api/requestCall",
+                HTTP_AUTHORIZATION="Bearer {}".format(options["token"]),
+            )
+            error = _jwt_auth(set(), request, update_metadata=False)
+            if error:
+                raise CommandError(error.content.decode("utf-8"))
+            return request.reporter
+
+        # The first request creates the reporter if necessary
+        reporter = authenticate()
+        results = {}
+        for name, before in (("before", True), ("after", False)):
+            elapsed = 0.0
+            for _ in range(options["requests"]):
+                if before:
+                    # Force both the verification and the reporter write
+                    clear_verified_jwt_cache()
+                    Reporter.objects.filter(pk=reporter.pk).update(
+                        auth0_role_names=None
+                    )
+                start = time.perf_counter()
+                authenticate()
+                elapsed += time.perf_counter() - start
+            results[name] = elapsed
+        for name, elapsed in results.items():
+            self.stdout.write(
+                "{}: {} requests in {:.2f}s - {:.2f}ms/request".format(
+                    name,
+                    options["requests"],
+                    elapsed,
+                    elapsed * 1000 / options["requests"],
+                )
+            )
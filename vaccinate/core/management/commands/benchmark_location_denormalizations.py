@@ -0,0 +1,90 @@
+import time
+from functools import partial
+
+from core import denormalization_triggers
+from core.models import (
+    AppointmentTag,
+    AvailabilityTag,
+    Location,
+    Reporter,
+    coalesce_location_denormalizations,
+)
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Compare the Python and trigger implementations of Location.dn_* updates
+
+    Writes synthetic reports against existing locations inside a transaction
+    that is rolled back - for development environments only.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--locations", type=int, default=50, help="Number of locations to use"
+        )
+        parser.add_argument(
+            "--reports", type=int, default=5, help="Reports to write per location"
+        )
+
+    def handle(self, *args, **options):
+        locations = list(Location.objects.order_by("pk")[: options["locations"]])
+        if not locations:
+            raise CommandError("No locations to benchmark against")
+        results = {}
+        try:
+            with transaction.atomic():
+                reporter = Reporter.objects.get_or_create(
+                    external_id="benchmark:location_denormalizations"
+                )[0]
+                web = AppointmentTag.objects.get(slug="web")
+                tags = list(AvailabilityTag.objects.filter(group__in=("yes", "skip")))
+                write = partial(
+                    self.write_reports,
+                    locations,
+                    options["reports"],
+                    reporter,
+                    web,
+                    tags,
+                )
+                denormalization_triggers.uninstall_triggers()
+                with override_settings(LOCATION_DENORMALIZATION_TRIGGERS=False):
+                    results["python"] = write()
+                denormalization_triggers.install_triggers()
+                with override_settings(LOCATION_DENORMALIZATION_TRIGGERS=True):
+                    results["triggers"] = write()
+                    inconsistent = denormalization_triggers.find_inconsistent_locations(
+                        [location.pk for location in locations]
+                    )
+                raise Rollback
+        except Rollback:
+            pass
+        num_reports = len(locations) * options["reports"]
+        for name, elapsed in results.items():
+            self.stdout.write(
+                "{}: {} reports in {:.2f}s - {:.1f} reports/second".format(
+                    name, num_reports, elapsed, num_reports / elapsed
+                )
+            )
+        self.stdout.write(
+            "{} inconsistent locations after the trigger run".format(len(inconsistent))
+        )
+
+    def write_reports(self, locations, reports_per_location, reporter, web, tags):
+        start = time.perf_counter()
+        for i in range(reports_per_location):
+            for location in locations:
+                # Mirrors submit_report: create the report, then add its tags
+                with transaction.atomic(), coalesce_location_denormalizations():
+                    report = location.reports.create(
+                        reported_by=reporter, report_source="ca", appointment_tag=web
+                    )
+                    report.availability_tags.add(tags[i % len(tags)])
+        return time.perf_counter() - start
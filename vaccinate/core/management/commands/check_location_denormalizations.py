@@ -0,0 +1,52 @@
+from core import denormalization_triggers
+from core.models import Location
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    "Check Location.dn_* columns against values recalculated from reports"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Update any inconsistent locations",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of locations to check per query",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        location_ids = list(
+            Location.objects.order_by("pk").values_list("pk", flat=True)
+        )
+        num_inconsistent = 0
+        for i in range(0, len(location_ids), batch_size):
+            batch = location_ids[i : i + batch_size]
+            inconsistent = denormalization_triggers.find_inconsistent_locations(batch)
+            for location_id, differences in inconsistent.items():
+                self.stdout.write(
+                    "Location {}: {}".format(
+                        location_id,
+                        ", ".join(
+                            "{} is {}, expected {}".format(column, stored, expected)
+                            for column, stored, expected in differences
+                        ),
+                    )
+                )
+            if inconsistent and options["fix"]:
+                with transaction.atomic():
+                    denormalization_triggers.update_denormalizations(inconsistent)
+            num_inconsistent += len(inconsistent)
+        self.stdout.write(
+            "Checked {} locations, {} inconsistent{}".format(
+                len(location_ids),
+                num_inconsistent,
+                " (fixed)" if num_inconsistent and options["fix"] else "",
+            )
+        )
@@ -0,0 +1,59 @@
+import time
+
+from api.webhooks import deliver_webhooks
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class Command(BaseCommand):
+    "Deliver the webhook events queued in the outbox, retrying failures with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Number of webhooks to POST concurrently",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of due events to claim at a time",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=8,
+            help="Give up on an event after this many failed attempts",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep delivering, checking for new events every --interval seconds",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2,
+            help="Seconds to wait when there is nothing to deliver, with --loop",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            num_delivered, num_failed = deliver_webhooks(
+                max_workers=options["workers"],
+                batch_size=options["batch_size"],
+                max_attempts=options["max_attempts"],
+            )
+            if num_delivered or num_failed:
+                self.stdout.write(
+                    "Delivered {}, failed {}".format(num_delivered, num_failed)
+                )
+            if num_delivered + num_failed < options["batch_size"]:
+                # Caught up with the events that are due
+                if not options["loop"]:
+                    break
+                time.sleep(options["interval"])
+            # Don't hold on to a connection the database has since dropped
+            close_old_connections()
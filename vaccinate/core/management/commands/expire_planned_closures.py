@@ -0,0 +1,14 @@
+from core.models import Location
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    "Clear dn_is_exportable for locations whose planned closure date has passed - run daily"
+
+    def handle(self, *args, **options):
+        count = Location.expire_planned_closures()
+        self.stdout.write(
+            "{} location{} no longer exportable".format(
+                count, "" if count == 1 else "s"
+            )
+        )
@@ -0,0 +1,35 @@
+from core import denormalization_triggers
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    "Install or remove the Postgres triggers that maintain Location.dn_* columns"
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["install", "uninstall", "status"])
+
+    def handle(self, *args, **options):
+        action = options["action"]
+        if action == "install":
+            with transaction.atomic():
+                denormalization_triggers.install_triggers()
+            self.stdout.write(
+                "Triggers installed - set LOCATION_DENORMALIZATION_TRIGGERS=1 "
+                "to stop Python from also updating the columns"
+            )
+        elif action == "uninstall":
+            with transaction.atomic():
+                denormalization_triggers.uninstall_triggers()
+            self.stdout.write(
+                "Triggers removed - unset LOCATION_DENORMALIZATION_TRIGGERS "
+                "before more reports are written"
+            )
+        installed = denormalization_triggers.installed_triggers()
+        self.stdout.write(
+            "{} of {} triggers installed{}".format(
+                len(installed),
+                len(denormalization_triggers.TRIGGERS),
+                ": {}".format(", ".join(installed)) if installed else "",
+            )
+        )
@@ -0,0 +1,149 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from core import denormalization_triggers
+from core.models import DERIVE_DETAILS_FIELDS, Location
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Max, Min
+
+
+def rebuild_pk_range(start, end, dry_run):
+    """
+    Recalculate the dn_* columns and derive_details() fields for locations
+    with start <= pk < end, writing only the locations that differ.
+
+    Returns (number of locations, {location_id: [(column, stored, expected)]})
+    """
+    location_ids = list(
+        Location.objects.filter(pk__gte=start, pk__lt=end)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    if not location_ids:
+        return 0, {}
+    with transaction.atomic():
+        differences = denormalization_triggers.find_inconsistent_locations(location_ids)
+        if differences and not dry_run:
+            denormalization_triggers.update_denormalizations(differences)
+
+        derived = Location.derive_details_bulk(location_ids, save=False)
+        attnames = [
+            Location._meta.get_field(field).attname for field in DERIVE_DETAILS_FIELDS
+        ]
+        changed = []
+        for location in Location.objects.filter(pk__in=location_ids).only(
+            *DERIVE_DETAILS_FIELDS
+        ):
+            before = [getattr(location, attname) for attname in attnames]
+            if location._set_derived_details(derived[location.pk]):
+                changed.append(location)
+                differences.setdefault(location.pk, []).extend(
+                    (attname, stored, getattr(location, attname))
+                    for attname, stored in zip(attnames, before)
+                    if stored != getattr(location, attname)
+                )
+        if changed and not dry_run:
+            Location.objects.bulk_update(changed, DERIVE_DETAILS_FIELDS)
+    return len(location_ids), differences
+
+
+class Command(BaseCommand):
+    """
+    Rebuild update_denormalizations() and derive_details() for every location
+
+    Expected values are calculated set-based for each range of location
+    primary keys, in parallel across a pool of worker processes. Only the
+    locations with differences are written.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Show the differences without writing them",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=multiprocessing.cpu_count(),
+            help="Number of worker processes - 1 runs in this process",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Size of the location primary key range handled by each task",
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        bounds = Location.objects.aggregate(min_pk=Min("pk"), max_pk=Max("pk"))
+        if bounds["min_pk"] is None:
+            self.stdout.write("No locations")
+            return
+        ranges = [
+            (start, start + options["chunk_size"])
+            for start in range(
+                bounds["min_pk"], bounds["max_pk"] + 1, options["chunk_size"]
+            )
+        ]
+        total = Location.objects.count()
+        num_checked = num_changed = 0
+        start_time = time.perf_counter()
+
+        def report_progress(num_locations, differences):
+            nonlocal num_checked, num_changed
+            num_checked += num_locations
+            num_changed += len(differences)
+            if dry_run:
+                for location_id, location_differences in sorted(differences.items()):
+                    self.stdout.write(
+                        "Location {}: {}".format(
+                            location_id,
+                            ", ".join(
+                                "{} is {!r}, expected {!r}".format(
+                                    column, stored, expected
+                                )
+                                for column, stored, expected in location_differences
+                            ),
+                        )
+                    )
+            self.stdout.write(
+                "{}/{} locations checked ({:.0f}%), {} {}".format(
+                    num_checked,
+                    total,
+                    100 * num_checked / total if total else 100,
+                    num_changed,
+                    "differ" if dry_run else "updated",
+                )
+            )
+
+        if options["workers"] <= 1:
+            for start, end in ranges:
+                report_progress(*rebuild_pk_range(start, end, dry_run))
+        else:
+            # Forked workers must not share the parent's database connections
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=options["workers"],
+                mp_context=multiprocessing.get_context("fork"),
+            ) as executor:
+                futures = [
+                    executor.submit(rebuild_pk_range, start, end, dry_run)
+                    for start, end in ranges
+                ]
+                for future in as_completed(futures):
+                    report_progress(*future.result())
+
+        elapsed = time.perf_counter() - start_time
+        self.stdout.write(
+            "{} {} of {} locations in {:.2f}s - {:.1f} locations/second".format(
+                "Found differences in" if dry_run else "Updated",
+                num_changed,
+                num_checked,
+                elapsed,
+                num_checked / elapsed if elapsed else 0,
+            )
+        )
@@ -0,0 +1,41 @@
+import time
+
+from core.models import CallRequest
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class Command(BaseCommand):
+    "Top up the call request queue to its per-state and overall minimums"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep refilling every --interval seconds until interrupted",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=30,
+            help="Seconds to wait between refills when using --loop",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            added = CallRequest.refill_queue()
+            self.stdout.write(
+                "Added {} in {:.2f}s".format(
+                    ", ".join(
+                        "{}: {}".format(state or "all", count)
+                        for state, count in added.items()
+                    ),
+                    time.perf_counter() - start,
+                )
+            )
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+            # Don't hold on to a connection the database has since dropped
+            close_old_connections()
@@ -0,0 +1,25 @@
+import time
+
+from core.models import Location, LocationExport
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    "Refresh the location_export materialized view used by the export APIs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--not-concurrently",
+            action="store_true",
+            help="Lock the view while refreshing - faster, but blocks exports",
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        expired = Location.expire_planned_closures()
+        LocationExport.refresh(concurrently=not options["not_concurrently"])
+        self.stdout.write(
+            "Expired {} planned closures, refreshed location_export in {:.2f}s".format(
+                expired, time.perf_counter() - start
+            )
+        )
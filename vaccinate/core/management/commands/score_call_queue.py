@@ -0,0 +1,17 @@
+import time
+
+from core.models import CallRequest
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    "Recalculate the priority of queued call requests that weren't prioritized by hand"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        num_updated = CallRequest.score_queue()
+        self.stdout.write(
+            "Updated the priority of {} call requests in {:.2f}s".format(
+                num_updated, time.perf_counter() - start
+            )
+        )
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.4 on 2021-07-12 17:05
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Building these concurrently avoids locking writes to report and
+    # source_location for the duration of the index build
+    atomic = False
+
+    dependencies = [
+        ("core", "0157_backfill_hours_json_issue_721"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="report",
+            index=models.Index(
+                fields=["location", "created_at"], name="report_location_created_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="sourcelocation",
+            index=models.Index(
+                fields=["matched_location", "source_name", "last_imported_at"],
+                name="source_location_recent_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.4 on 2021-07-13 10:12
+
+from core.denormalization_triggers import (
+    DROP_FUNCTIONS_SQL,
+    DROP_TRIGGER_FUNCTIONS_SQL,
+    TRIGGER_FUNCTIONS_SQL,
+    functions_sql,
+)
+from django.db import migrations
+
+# Columns calculated by the functions used by the optional location
+# denormalization triggers - see core/denormalization_triggers.py. Later
+# migrations add to these. The triggers themselves are installed separately
+# by the location_denormalization_triggers command.
+COLUMNS = [
+    "dn_latest_report_id",
+    "dn_latest_report_including_pending_id",
+    "dn_latest_yes_report_id",
+    "dn_latest_skip_report_id",
+    "dn_latest_non_skip_report_id",
+    "dn_skip_report_count",
+    "dn_yes_report_count",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0158_derive_details_indexes"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=functions_sql(COLUMNS) + TRIGGER_FUNCTIONS_SQL,
+            reverse_sql=DROP_TRIGGER_FUNCTIONS_SQL + DROP_FUNCTIONS_SQL,
+        ),
+    ]
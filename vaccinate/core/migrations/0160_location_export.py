@@ -0,0 +1,138 @@
+# Generated by Django 3.2.4 on 2021-07-14 09:40
+
+import core.fields
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+CREATE_VIEW_SQL = """
+create materialized view location_export as
+select
+    location.id as location_id,
+    location.public_id,
+    location.name,
+    location.website,
+    location.full_address,
+    location.phone_number,
+    location.google_places_id,
+    location.vaccinefinder_location_id,
+    location.vaccinespotter_location_id,
+    location.hours,
+    location.latitude,
+    location.longitude,
+    state.abbreviation as state_abbreviation,
+    location_type.name as location_type_name,
+    county.name as county_name,
+    county.vaccine_reservations_url as county_vaccine_reservations_url,
+    provider.name as provider_name,
+    provider.appointments_url as provider_appointments_url,
+    report.id as report_id,
+    report.created_at as report_created_at,
+    report.public_notes as report_public_notes,
+    report.appointment_details as report_appointment_details,
+    report.planned_closure as report_planned_closure,
+    report.restriction_notes as report_restriction_notes,
+    report.vaccines_offered as report_vaccines_offered,
+    appointment_tag.slug as appointment_tag_slug,
+    appointment_tag.name as appointment_tag_name,
+    array(
+        select availability_tag.slug
+        from call_report_availability_tag
+        join availability_tag
+            on availability_tag.id = call_report_availability_tag.availabilitytag_id
+        where call_report_availability_tag.report_id = report.id
+        order by availability_tag.slug
+    ) as availability_tag_slugs
+from location
+join state on state.id = location.state_id
+join location_type on location_type.id = location.location_type_id
+left join county on county.id = location.county_id
+left join provider on provider.id = location.provider_id
+left join report on report.id = location.dn_latest_non_skip_report_id
+left join appointment_tag on appointment_tag.id = report.appointment_tag_id
+where location.soft_deleted is not true;
+
+-- refresh materialized view concurrently requires a unique index
+create unique index location_export_location_id on location_export (location_id);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0159_location_denormalization_functions"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=CREATE_VIEW_SQL,
+            reverse_sql="drop materialized view if exists location_export",
+        ),
+        migrations.CreateModel(
+            name="LocationExport",
+            fields=[
+                (
+                    "location",
+                    models.OneToOneField(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="export",
+                        serialize=False,
+                        to="core.location",
+                    ),
+                ),
+                ("public_id", models.SlugField()),
+                ("name", core.fields.CharTextField(max_length=65000)),
+                ("website", core.fields.CharTextField(max_length=65000, null=True)),
+                ("full_address", models.TextField(null=True)),
+                (
+                    "phone_number",
+                    core.fields.CharTextField(max_length=65000, null=True),
+                ),
+                (
+                    "google_places_id",
+                    core.fields.CharTextField(max_length=65000, null=True),
+                ),
+                (
+                    "vaccinefinder_location_id",
+                    core.fields.CharTextField(max_length=65000, null=True),
+                ),
+                (
+                    "vaccinespotter_location_id",
+                    core.fields.CharTextField(max_length=65000, null=True),
+                ),
+                ("hours", models.TextField(null=True)),
+                ("latitude", models.DecimalField(decimal_places=5, max_digits=9)),
+                ("longitude", models.DecimalField(decimal_places=5, max_digits=9)),
+                ("state_abbreviation", models.CharField(max_length=2)),
+                ("location_type_name", core.fields.CharTextField(max_length=65000)),
+                ("county_name", core.fields.CharTextField(max_length=65000, null=True)),
+                ("county_vaccine_reservations_url", models.TextField(null=True)),
+                (
+                    "provider_name",
+                    core.fields.CharTextField(max_length=65000, null=True),
+                ),
+                ("provider_appointments_url", models.TextField(null=True)),
+                ("report_id", models.IntegerField(null=True)),
+                ("report_created_at", models.DateTimeField(null=True)),
+                ("report_public_notes", models.TextField(null=True)),
+                ("report_appointment_details", models.TextField(null=True)),
+                ("report_planned_closure", models.DateField(null=True)),
+                ("report_restriction_notes", models.TextField(null=True)),
+                ("report_vaccines_offered", models.JSONField(null=True)),
+                ("appointment_tag_slug", models.SlugField(null=True)),
+                ("appointment_tag_name", models.CharField(max_length=30, null=True)),
+                (
+                    "availability_tag_slugs",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.SlugField(), size=None
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "location_export",
+                "managed": False,
+            },
+        ),
+    ]
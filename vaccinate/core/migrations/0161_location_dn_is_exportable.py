@@ -0,0 +1,130 @@
+# Generated by Django 3.2.4 on 2021-07-15 11:26
+
+from importlib import import_module
+
+from core.denormalization_triggers import EXCLUDED_TAGS_SQL, functions_sql
+from django.db import migrations, models
+
+BACKFILL_SQL = """
+update location set dn_is_exportable = false
+from report
+where report.id = location.dn_latest_non_skip_report_id
+    and (
+        report.planned_closure < current_date
+        or exists (
+            select 1 from call_report_availability_tag
+            join availability_tag
+                on availability_tag.id = call_report_availability_tag.availabilitytag_id
+            where call_report_availability_tag.report_id = report.id
+                and availability_tag.slug in ({excluded_tags})
+        )
+    );
+""".format(
+    excluded_tags=EXCLUDED_TAGS_SQL
+)
+
+CREATE_VIEW_SQL = """
+drop materialized view if exists location_export;
+
+create materialized view location_export as
+select
+    location.id as location_id,
+    location.public_id,
+    location.name,
+    location.website,
+    location.full_address,
+    location.phone_number,
+    location.google_places_id,
+    location.vaccinefinder_location_id,
+    location.vaccinespotter_location_id,
+    location.hours,
+    location.latitude,
+    location.longitude,
+    state.abbreviation as state_abbreviation,
+    location_type.name as location_type_name,
+    county.name as county_name,
+    county.vaccine_reservations_url as county_vaccine_reservations_url,
+    provider.name as provider_name,
+    provider.appointments_url as provider_appointments_url,
+    report.id as report_id,
+    report.created_at as report_created_at,
+    report.public_notes as report_public_notes,
+    report.appointment_details as report_appointment_details,
+    report.planned_closure as report_planned_closure,
+    report.restriction_notes as report_restriction_notes,
+    report.vaccines_offered as report_vaccines_offered,
+    appointment_tag.slug as appointment_tag_slug,
+    appointment_tag.name as appointment_tag_name,
+    array(
+        select availability_tag.slug
+        from call_report_availability_tag
+        join availability_tag
+            on availability_tag.id = call_report_availability_tag.availabilitytag_id
+        where call_report_availability_tag.report_id = report.id
+        order by availability_tag.slug
+    ) as availability_tag_slugs,
+    location.dn_is_exportable as is_exportable
+from location
+join state on state.id = location.state_id
+join location_type on location_type.id = location.location_type_id
+left join county on county.id = location.county_id
+left join provider on provider.id = location.provider_id
+left join report on report.id = location.dn_latest_non_skip_report_id
+left join appointment_tag on appointment_tag.id = report.appointment_tag_id
+where location.soft_deleted is not true;
+
+-- refresh materialized view concurrently requires a unique index
+create unique index location_export_location_id on location_export (location_id);
+"""
+
+previous_functions = import_module(
+    "core.migrations.0159_location_denormalization_functions"
+)
+previous_view = import_module("core.migrations.0160_location_export")
+
+COLUMNS = previous_functions.COLUMNS + ["dn_is_exportable"]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0160_location_export"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            # With a database default Postgres doesn't rewrite the table to
+            # add this - location_dn_is_exportable_idx is built concurrently
+            # by 0166
+            database_operations=[
+                migrations.RunSQL(
+                    sql="alter table location add column dn_is_exportable boolean not null default true;",
+                    reverse_sql="alter table location drop column dn_is_exportable;",
+                )
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name="location",
+                    name="dn_is_exportable",
+                    field=models.BooleanField(default=True),
+                )
+            ],
+        ),
+        migrations.RunSQL(sql=BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(
+            sql=functions_sql(COLUMNS),
+            # Back to the definitions without dn_is_exportable
+            reverse_sql=functions_sql(previous_functions.COLUMNS),
+        ),
+        migrations.RunSQL(
+            sql=CREATE_VIEW_SQL,
+            reverse_sql="drop materialized view if exists location_export;"
+            + previous_view.CREATE_VIEW_SQL,
+        ),
+        migrations.AddField(
+            model_name="locationexport",
+            name="is_exportable",
+            field=models.BooleanField(default=True),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.4 on 2021-07-16 10:05
+
+from importlib import import_module
+
+from core.denormalization_triggers import functions_sql
+from django.db import migrations, models
+
+previous_functions = import_module("core.migrations.0161_location_dn_is_exportable")
+
+COLUMNS = previous_functions.COLUMNS + ["last_called_at"]
+
+BACKFILL_SQL = """
+update location set last_called_at = report.created_at
+from report
+where report.id = location.dn_latest_report_including_pending_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0161_location_dn_is_exportable"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="location",
+            name="last_called_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="created_at of dn_latest_report_including_pending - orders the call queue backfill",
+                null=True,
+            ),
+        ),
+        migrations.RunSQL(sql=BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(
+            sql=functions_sql(COLUMNS),
+            # Back to the definitions without last_called_at
+            reverse_sql=functions_sql(previous_functions.COLUMNS),
+        ),
+    ]
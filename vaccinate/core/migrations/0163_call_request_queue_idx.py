@@ -0,0 +1,25 @@
+# Generated by Django 3.2.4 on 2021-07-16 14:32
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Building this concurrently avoids locking writes to call_request for
+    # the duration of the index build
+    atomic = False
+
+    dependencies = [
+        ("core", "0162_location_last_called_at"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="callrequest",
+            index=models.Index(
+                condition=models.Q(("completed", False)),
+                fields=["priority_group", "-priority", "-id"],
+                name="call_request_queue_idx",
+            ),
+        ),
+    ]
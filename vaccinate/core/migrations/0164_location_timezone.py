@@ -0,0 +1,25 @@
+# Generated by Django 3.2.4 on 2021-07-16 16:08
+
+import core.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0163_call_request_queue_idx"),
+    ]
+
+    operations = [
+        # Populated by ./manage.py backfill_location_timezones
+        migrations.AddField(
+            model_name="location",
+            name="timezone",
+            field=core.fields.CharTextField(
+                blank=True,
+                help_text="IANA timezone name, calculated from latitude and longitude",
+                max_length=65000,
+                null=True,
+            ),
+        ),
+    ]
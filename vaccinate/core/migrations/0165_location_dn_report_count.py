@@ -0,0 +1,53 @@
+# Generated by Django 3.2.4 on 2021-07-17 09:47
+
+from importlib import import_module
+
+from core.denormalization_triggers import functions_sql
+from django.db import migrations, models
+
+previous_functions = import_module("core.migrations.0162_location_last_called_at")
+
+COLUMNS = previous_functions.COLUMNS + ["dn_report_count"]
+
+BACKFILL_SQL = """
+update location set dn_report_count = counts.report_count
+from (
+    select location_id, count(*) as report_count
+    from report
+    where soft_deleted is not true
+    group by location_id
+) counts
+where counts.location_id = location.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0164_location_timezone"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            # With a database default Postgres doesn't rewrite the table
+            database_operations=[
+                migrations.RunSQL(
+                    sql="alter table location add column dn_report_count integer not null default 0;",
+                    reverse_sql="alter table location drop column dn_report_count;",
+                )
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name="location",
+                    name="dn_report_count",
+                    field=models.IntegerField(default=0),
+                )
+            ],
+        ),
+        migrations.RunSQL(sql=BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(
+            sql=functions_sql(COLUMNS),
+            # Back to the definitions without dn_report_count
+            reverse_sql=functions_sql(previous_functions.COLUMNS),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.4 on 2021-07-20 10:12
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Building this concurrently avoids locking writes to location for the
+    # duration of the index build
+    atomic = False
+
+    dependencies = [
+        ("core", "0165_location_dn_report_count"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="location",
+            index=models.Index(
+                fields=["dn_is_exportable"], name="location_dn_is_exportable_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.4 on 2021-07-20 10:40
+
+import django.db.models.expressions
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Building this concurrently avoids locking writes to location for the
+    # duration of the index build
+    atomic = False
+
+    dependencies = [
+        ("core", "0166_location_dn_is_exportable_idx"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="location",
+            index=models.Index(
+                django.db.models.expressions.OrderBy(
+                    django.db.models.expressions.F("last_called_at"), nulls_first=True
+                ),
+                name="location_last_called_at_idx",
+            ),
+        ),
+    ]
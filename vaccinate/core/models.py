@@ -1,10 +1,12 @@
 from __future__ import annotations
 
+import threading
 import uuid
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from functools import reduce
 from operator import or_
-from typing import Any, List, NamedTuple, Optional
+from typing import Any, Dict, List, NamedTuple, Optional
 
 import beeline
 import pytz
@@ -13,8 +15,9 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models as gis_models
 from django.contrib.gis.geos import Point
-from django.db import IntegrityError, models, transaction
-from django.db.models import Min, Q
+from django.contrib.postgres.fields import ArrayField
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F, Min, Q
 from django.db.models.query import QuerySet
 from django.db.models.signals import m2m_changed
 from django.dispatch import receiver
@@ -22,7 +25,12 @@ from django.utils import dateformat, timezone
 from social_django.models import UserSocialAuth
 
 from .baseconverter import pid
+from .denormalization_triggers import (
+    DENORMALIZED_FIELDS,
+    EXPORT_EXCLUDED_AVAILABILITY_TAGS,
+)
 from .fields import CharTextField
+from .utils import timezone_for_point
 
 
 class LocationType(models.Model):
@@ -215,6 +223,77 @@ class ImportRun(models.Model):
         db_table = "import_run"
 
 
+DERIVE_DETAILS_SOURCE_NAMES = (
+    "vaccinefinder_org",
+    "vaccinespotter_org",
+    "getmyvax_org",
+)
+DERIVE_DETAILS_SOURCE_NAMES_FOR_HOURS = ("vaccinefinder_org",)
+# Location columns written by derive_details(save=True)
+DERIVE_DETAILS_FIELDS = [
+    "vaccines_offered",
+    "vaccines_offered_provenance_report",
+    "vaccines_offered_provenance_source_location",
+    "vaccines_offered_last_updated_at",
+    "accepts_appointments",
+    "accepts_walkins",
+    "appointments_walkins_provenance_report",
+    "appointments_walkins_provenance_source_location",
+    "appointments_walkins_last_updated_at",
+]
+
+
+# Location.valid_for_call() depends on these
+LOCATION_CALL_QUEUE_FIELDS = {
+    "soft_deleted",
+    "do_not_call",
+    "phone_number",
+    "preferred_contact_method",
+}
+
+# Weights for CallRequest.score_queue() - higher scores are called sooner
+CALL_PRIORITY_SCORE_WEIGHTS = {
+    # Per day since the location was last called, never called counting
+    # as the maximum
+    "per_day_since_last_called": 10,
+    "max_days_since_last_called": 30,
+    # Scaled by the county's VTS priority rank, where 1 is the highest
+    "county_priority": 100,
+    "county_priority_ranks": 3200,
+    # Per yes and per skip report, counting up to max_report_count of each
+    "per_yes_report": 20,
+    "per_skip_report": -20,
+    "max_report_count": 5,
+    # The most recent report was a yes
+    "latest_report_is_yes": 50,
+}
+
+_denormalizations = threading.local()
+
+
+@contextmanager
+def coalesce_location_denormalizations():
+    """
+    Saving a report and then adding its availability tags would otherwise
+    update the location's denormalized columns once for each step. Within
+    this block those updates are collected, then run once per location
+    when the block exits - wrap it in the same transaction as the writes.
+    """
+    if getattr(_denormalizations, "pending", None) is not None:
+        # Nested block - the outermost one will run the updates
+        yield
+        return
+    _denormalizations.pending = {}
+    try:
+        yield
+        pending = _denormalizations.pending
+        _denormalizations.pending = None
+        for location in pending.values():
+            location._sync_denormalizations()
+    finally:
+        _denormalizations.pending = None
+
+
 class DerivedResults(NamedTuple):
     vaccines_offered: Optional[list[str]]
     vaccines_offered_provenance_report: Optional[Report]
@@ -236,8 +315,191 @@ class DerivedResults(NamedTuple):
     most_recent_source_location_on_hours_json: Optional[SourceLocation]
 
 
-class Location(gis_models.Model):
+def _derive_details_from_most_recent(
+    most_recent_report_on_vaccines_offered: Optional[Report],
+    most_recent_source_location_on_vaccines_offered: Optional[SourceLocation],
+    most_recent_report_on_availability: Optional[Report],
+    most_recent_source_location_on_availability: Optional[SourceLocation],
+    most_recent_source_location_on_hours_json: Optional[SourceLocation],
+) -> DerivedResults:
+    "Decides which of the most recent records to trust - see Location.derive_details()"
+    vaccines_offered = None
+    vaccines_offered_provenance_report = None
+    vaccines_offered_provenance_source_location = None
+    vaccines_offered_last_updated_at = None
+    accepts_appointments = None
+    accepts_walkins = None
+    appointments_walkins_provenance_report = None
+    appointments_walkins_provenance_source_location = None
+    appointments_walkins_last_updated_at = None
+    hours_json = None
+    hours_json_last_updated_at = None
+
+    report_to_use_for_vaccines_offered = most_recent_report_on_vaccines_offered
+    source_location_to_use_for_vaccines_offered = (
+        most_recent_source_location_on_vaccines_offered
+    )
+
+    if (
+        report_to_use_for_vaccines_offered
+        and source_location_to_use_for_vaccines_offered
+    ):
+        # Should we go with the report or the source location? Depends which is most recent
+        if (
+            source_location_to_use_for_vaccines_offered.last_imported_at
+            and source_location_to_use_for_vaccines_offered.last_imported_at
+            > report_to_use_for_vaccines_offered.created_at
+        ):
+            # Use the source_location, ignore the report
+            report_to_use_for_vaccines_offered = None
+        else:
+            # Use the report, ignore the source location
+            source_location_to_use_for_vaccines_offered = None
+
+    if source_location_to_use_for_vaccines_offered:
+        vaccines_offered = source_location_to_use_for_vaccines_offered.vaccines_offered
+        vaccines_offered_provenance_source_location = (
+            source_location_to_use_for_vaccines_offered
+        )
+        vaccines_offered_last_updated_at = (
+            source_location_to_use_for_vaccines_offered.last_imported_at
+        )
+    elif report_to_use_for_vaccines_offered:
+        vaccines_offered = report_to_use_for_vaccines_offered.vaccines_offered
+        vaccines_offered_provenance_report = report_to_use_for_vaccines_offered
+        vaccines_offered_last_updated_at = report_to_use_for_vaccines_offered.created_at
+
+    report_to_use_for_availability = most_recent_report_on_availability
+    source_location_to_use_for_availability = (
+        most_recent_source_location_on_availability
+    )
+
+    if report_to_use_for_availability and source_location_to_use_for_availability:
+        # Should we go with the report or the source location? Depends which is most recent
+        if source_location_to_use_for_availability.last_imported_at and (
+            source_location_to_use_for_availability.last_imported_at
+            > report_to_use_for_availability.created_at
+        ):
+            # Use the source_location, ignore the report
+            report_to_use_for_availability = None
+        else:
+            # Use the report, ignore the source location
+            source_location_to_use_for_availability = None
+
+    if source_location_to_use_for_availability:
+        availability = source_location_to_use_for_availability.import_json[
+            "availability"
+        ]
+        accepts_appointments = bool(availability.get("appointments"))
+        accepts_walkins = bool(availability.get("drop_in"))
+        appointments_walkins_provenance_source_location = (
+            source_location_to_use_for_availability
+        )
+        appointments_walkins_last_updated_at = (
+            source_location_to_use_for_availability.last_imported_at
+        )
+    elif report_to_use_for_availability:
+        # Use the availability tags
+        tags = {t.slug for t in report_to_use_for_availability.availability_tags.all()}
+        accepts_appointments = any(
+            tag in tags
+            for tag in (
+                "appointment_calendar_currently_full",
+                "appointment_required",
+                "appointments_available",
+                "appointments_or_walkins",
+            )
+        )
+        accepts_walkins = any(
+            tag in tags for tag in ("walk_ins_only", "appointments_or_walkins")
+        )
+        appointments_walkins_provenance_report = report_to_use_for_availability
+        appointments_walkins_last_updated_at = report_to_use_for_availability.created_at
+
+    if most_recent_source_location_on_hours_json:
+        hours_json = most_recent_source_location_on_hours_json.import_json[
+            "opening_hours"
+        ]
+        hours_json_last_updated_at = (
+            most_recent_source_location_on_hours_json.last_imported_at
+        )
+
+    return DerivedResults(
+        vaccines_offered=vaccines_offered,
+        vaccines_offered_provenance_report=vaccines_offered_provenance_report,
+        vaccines_offered_provenance_source_location=vaccines_offered_provenance_source_location,
+        vaccines_offered_last_updated_at=vaccines_offered_last_updated_at,
+        accepts_appointments=accepts_appointments,
+        accepts_walkins=accepts_walkins,
+        appointments_walkins_provenance_report=appointments_walkins_provenance_report,
+        appointments_walkins_provenance_source_location=appointments_walkins_provenance_source_location,
+        appointments_walkins_last_updated_at=appointments_walkins_last_updated_at,
+        most_recent_report_on_vaccines_offered=most_recent_report_on_vaccines_offered,
+        most_recent_source_location_on_vaccines_offered=most_recent_source_location_on_vaccines_offered,
+        most_recent_report_on_availability=most_recent_report_on_availability,
+        most_recent_source_location_on_availability=most_recent_source_location_on_availability,
+        hours_json=hours_json,
+        hours_json_provenance_source_location=most_recent_source_location_on_hours_json,
+        most_recent_source_location_on_hours_json=most_recent_source_location_on_hours_json,
+        hours_json_last_updated_at=hours_json_last_updated_at,
+    )
+
+
+class TrackedFieldsMixin:
+    """
+    Remembers the values of tracked_fields as last loaded from or saved to
+    the database, so save() can skip side effects when none of them changed.
+    """
+
+    tracked_fields: List[str] = []
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)  # type: ignore
+        instance._snapshot_tracked_fields()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)  # type: ignore
+        self._snapshot_tracked_fields(fields)
+
+    def _snapshot_tracked_fields(self, fields=None):
+        if fields is None or not hasattr(self, "_tracked_field_values"):
+            self._tracked_field_values = {}
+            fields = self.tracked_fields
+        # Deferred fields are missing from __dict__ and are left out
+        self._tracked_field_values.update(
+            {
+                field: self.__dict__[field]
+                for field in fields
+                if field in self.tracked_fields and field in self.__dict__
+            }
+        )
+
+    def changed_tracked_fields(self, update_fields=None) -> set[str]:
+        """
+        Tracked fields that differ from the database, limited to update_fields
+        if provided. Instances that were never loaded or saved report all of them.
+        """
+        fields = set(self.tracked_fields)
+        if update_fields is not None:
+            fields &= set(update_fields)
+        snapshot = getattr(self, "_tracked_field_values", None)
+        if snapshot is None:
+            return fields
+        return {
+            field
+            for field in fields
+            if field in self.__dict__
+            and (field not in snapshot or snapshot[field] != self.__dict__[field])
+        }
+
+
+class Location(TrackedFieldsMixin, gis_models.Model):
     "A location is a distinct place where one can receive a COVID vaccine."
+
+    tracked_fields = sorted(LOCATION_CALL_QUEUE_FIELDS) + ["latitude", "longitude"]
+
     name = CharTextField()
     phone_number = CharTextField(null=True, blank=True)
     full_address = models.TextField(
@@ -478,6 +740,22 @@ class Location(gis_models.Model):
     # Denormalized counts for non is_pending_review reports:
     dn_skip_report_count = models.IntegerField(default=0)
     dn_yes_report_count = models.IntegerField(default=0)
+    # Count of reports that have not been soft-deleted, including
+    # is_pending_review ones
+    dn_report_count = models.IntegerField(default=0)
+    # Should this be exported to the public map? False if dn_latest_non_skip_report
+    # has a planned closure in the past or one of EXPORT_EXCLUDED_AVAILABILITY_TAGS
+    dn_is_exportable = models.BooleanField(default=True)
+    timezone = CharTextField(
+        null=True,
+        blank=True,
+        help_text="IANA timezone name, calculated from latitude and longitude",
+    )
+    last_called_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="created_at of dn_latest_report_including_pending - orders the call queue backfill",
+    )
 
     is_pending_review = models.BooleanField(
         default=False, help_text="Locations that are pending review by our QA team"
@@ -521,6 +799,16 @@ class Location(gis_models.Model):
         permissions = [
             ("merge_locations", "Can merge two locations"),
         ]
+        indexes = [
+            # Call queue backfill order - never called first, then least recently
+            models.Index(
+                F("last_called_at").asc(nulls_first=True),
+                name="location_last_called_at_idx",
+            ),
+            models.Index(
+                fields=["dn_is_exportable"], name="location_dn_is_exportable_idx"
+            ),
+        ]
 
     @property
     def pid(self):
@@ -537,6 +825,38 @@ class Location(gis_models.Model):
             )
         )
 
+    @staticmethod
+    def _derive_details_querysets(reports, source_locations) -> Dict[str, QuerySet]:
+        """
+        Unordered querysets of the candidate reports and source_locations for
+        each of the "most recent" records that derive_details() considers
+        """
+        reports = (
+            reports.exclude(soft_deleted=True)
+            .prefetch_related("availability_tags")
+            .exclude(availability_tags__group="skip")
+        )
+        trusted_source_locations = source_locations.filter(
+            source_name__in=DERIVE_DETAILS_SOURCE_NAMES
+        )
+        return {
+            "most_recent_report_on_vaccines_offered": reports.exclude(
+                vaccines_offered__isnull=True
+            ),
+            "most_recent_source_location_on_vaccines_offered": trusted_source_locations.exclude(
+                import_json__inventory=None
+            ),
+            "most_recent_report_on_availability": reports,
+            "most_recent_source_location_on_availability": trusted_source_locations.exclude(
+                import_json__availability=None
+            ),
+            "most_recent_source_location_on_hours_json": source_locations.filter(
+                source_name__in=DERIVE_DETAILS_SOURCE_NAMES_FOR_HOURS
+            )
+            .exclude(import_json__opening_hours=None)
+            .exclude(import_json__opening_hours=[]),
+        }
+
     def derive_details(self, save=False) -> DerivedResults:
         """
         Use recent reports and matched source_locations to derive inventory/availability
@@ -547,224 +867,121 @@ class Location(gis_models.Model):
 
         Returns namedtuple of changes it would make. save=True to save those changes.
         """
-        SOURCE_NAMES_TO_CONSIDER = (
-            "vaccinefinder_org",
-            "vaccinespotter_org",
-            "getmyvax_org",
-        )
-        SOURCE_NAMES_TO_CONSIDER_FOR_HOURS = ("vaccinefinder_org",)
-        vaccines_offered = None
-        vaccines_offered_provenance_report = None
-        vaccines_offered_provenance_source_location = None
-        vaccines_offered_last_updated_at = None
-        accepts_appointments = None
-        accepts_walkins = None
-        appointments_walkins_provenance_report = None
-        appointments_walkins_provenance_source_location = None
-        appointments_walkins_last_updated_at = None
-        most_recent_report_on_vaccines_offered = None
-        most_recent_source_location_on_vaccines_offered = None
-        most_recent_report_on_availability = None
-        most_recent_source_location_on_availability = None
-        hours_json = None
-        hours_json_last_updated_at = None
-        most_recent_source_location_on_hours_json = None
-
-        most_recent_report_on_vaccines_offered = (
-            self.reports.all()
-            .exclude(soft_deleted=True)
-            .prefetch_related("availability_tags")
-            .exclude(availability_tags__group="skip")
-            .exclude(vaccines_offered__isnull=True)
-            .order_by("-created_at")
-            .first()
-        )
-        most_recent_source_location_on_vaccines_offered = (
-            self.matched_source_locations.all()
-            .filter(source_name__in=SOURCE_NAMES_TO_CONSIDER)
-            .exclude(import_json__inventory=None)
-            .order_by("-last_imported_at")
-            .first()
-        )
-
-        report_to_use_for_vaccines_offered = most_recent_report_on_vaccines_offered
-        source_location_to_use_for_vaccines_offered = (
-            most_recent_source_location_on_vaccines_offered
+        querysets = self._derive_details_querysets(
+            self.reports.all(), self.matched_source_locations.all()
         )
+        most_recent = {
+            key: qs.order_by(
+                "-created_at"
+                if key.startswith("most_recent_report")
+                else "-last_imported_at"
+            ).first()
+            for key, qs in querysets.items()
+        }
+        derived = _derive_details_from_most_recent(**most_recent)
+        if save:
+            self._set_derived_details(derived)
+            self.save(update_fields=DERIVE_DETAILS_FIELDS)
+        return derived
 
-        if (
-            report_to_use_for_vaccines_offered
-            and source_location_to_use_for_vaccines_offered
-        ):
-            # Should we go with the report or the source location? Depends which is most recent
-            if (
-                source_location_to_use_for_vaccines_offered.last_imported_at
-                and source_location_to_use_for_vaccines_offered.last_imported_at
-                > report_to_use_for_vaccines_offered.created_at
-            ):
-                # Use the source_location, ignore the report
-                report_to_use_for_vaccines_offered = None
-            else:
-                # Use the report, ignore the source location
-                source_location_to_use_for_vaccines_offered = None
+    @classmethod
+    @beeline.traced("derive_details_bulk")
+    def derive_details_bulk(
+        cls, location_ids, save=True, batch_size=1000
+    ) -> Dict[int, DerivedResults]:
+        """
+        Equivalent to derive_details() for many locations at once.
 
-        if source_location_to_use_for_vaccines_offered:
-            vaccines_offered = (
-                source_location_to_use_for_vaccines_offered.vaccines_offered
-            )
-            vaccines_offered_provenance_source_location = (
-                source_location_to_use_for_vaccines_offered
-            )
-            vaccines_offered_last_updated_at = (
-                source_location_to_use_for_vaccines_offered.last_imported_at
-            )
-        elif report_to_use_for_vaccines_offered:
-            vaccines_offered = report_to_use_for_vaccines_offered.vaccines_offered
-            vaccines_offered_provenance_report = report_to_use_for_vaccines_offered
-            vaccines_offered_last_updated_at = (
-                report_to_use_for_vaccines_offered.created_at
+        Uses one DISTINCT ON query per kind of "most recent" record for each
+        batch of locations, and bulk_update() to save the locations that changed.
+        Returns a dictionary of location ID => DerivedResults.
+        """
+        location_ids = list(location_ids)
+        results = {}
+        for i in range(0, len(location_ids), batch_size):
+            batch_ids = location_ids[i : i + batch_size]
+            querysets = cls._derive_details_querysets(
+                Report.objects.filter(location_id__in=batch_ids),
+                SourceLocation.objects.filter(matched_location_id__in=batch_ids),
             )
+            most_recent: Dict[str, Dict[int, Any]] = {}
+            for key, qs in querysets.items():
+                if key.startswith("most_recent_report"):
+                    most_recent[key] = {
+                        report.location_id: report
+                        for report in qs.order_by(
+                            "location_id", "-created_at"
+                        ).distinct("location_id")
+                    }
+                else:
+                    most_recent[key] = {
+                        source_location.matched_location_id: source_location
+                        for source_location in qs.order_by(
+                            "matched_location_id", "-last_imported_at"
+                        ).distinct("matched_location_id")
+                    }
+            batch_results = {
+                location_id: _derive_details_from_most_recent(
+                    **{
+                        key: records.get(location_id)
+                        for key, records in most_recent.items()
+                    }
+                )
+                for location_id in batch_ids
+            }
+            results.update(batch_results)
+            if save:
+                changed = [
+                    location
+                    for location in cls.objects.filter(pk__in=batch_ids).only(
+                        *DERIVE_DETAILS_FIELDS
+                    )
+                    if location._set_derived_details(batch_results[location.pk])
+                ]
+                cls.objects.bulk_update(changed, DERIVE_DETAILS_FIELDS)
+        return results
 
-        # Now do accepts_appointments and accepts_walkins based on most recent report
-        # or source_location that provides useful data on those
-        most_recent_report_on_availability = (
-            self.reports.all()
-            .exclude(soft_deleted=True)
-            .prefetch_related("availability_tags")
-            .exclude(availability_tags__group="skip")
-            .order_by("-created_at")
-            .first()
-        )
-        most_recent_source_location_on_availability = (
-            self.matched_source_locations.all()
-            .filter(source_name__in=SOURCE_NAMES_TO_CONSIDER)
-            .exclude(import_json__availability=None)
-            .order_by("-last_imported_at")
-            .first()
-        )
-
-        report_to_use_for_availability = most_recent_report_on_availability
-        source_location_to_use_for_availability = (
-            most_recent_source_location_on_availability
-        )
+    def _set_derived_details(self, derived: DerivedResults) -> bool:
+        "Copy derived results onto this location, returns True if anything changed"
+        attnames = [
+            self._meta.get_field(field).attname for field in DERIVE_DETAILS_FIELDS
+        ]
+        before = [getattr(self, attname) for attname in attnames]
+        for field in DERIVE_DETAILS_FIELDS:
+            setattr(self, field, getattr(derived, field))
+        return before != [getattr(self, attname) for attname in attnames]
 
-        if report_to_use_for_availability and source_location_to_use_for_availability:
-            # Should we go with the report or the source location? Depends which is most recent
-            if source_location_to_use_for_availability.last_imported_at and (
-                source_location_to_use_for_availability.last_imported_at
-                > report_to_use_for_availability.created_at
-            ):
-                # Use the source_location, ignore the report
-                report_to_use_for_availability = None
-            else:
-                # Use the report, ignore the source location
-                source_location_to_use_for_availability = None
-
-        if source_location_to_use_for_availability:
-            availability = source_location_to_use_for_availability.import_json[
-                "availability"
-            ]
-            accepts_appointments = bool(availability.get("appointments"))
-            accepts_walkins = bool(availability.get("drop_in"))
-            appointments_walkins_provenance_source_location = (
-                source_location_to_use_for_availability
-            )
-            appointments_walkins_last_updated_at = (
-                source_location_to_use_for_availability.last_imported_at
-            )
-        elif report_to_use_for_availability:
-            # Use the availability tags
-            tags = {
-                t.slug for t in report_to_use_for_availability.availability_tags.all()
-            }
-            accepts_appointments = any(
-                tag in tags
-                for tag in (
-                    "appointment_calendar_currently_full",
-                    "appointment_required",
-                    "appointments_available",
-                    "appointments_or_walkins",
-                )
-            )
-            accepts_walkins = any(
-                tag in tags for tag in ("walk_ins_only", "appointments_or_walkins")
-            )
-            appointments_walkins_provenance_report = report_to_use_for_availability
-            appointments_walkins_last_updated_at = (
-                report_to_use_for_availability.created_at
-            )
+    @classmethod
+    def expire_planned_closures(cls) -> int:
+        """
+        Planned closure dates pass without a write that would run
+        update_denormalizations() - run this daily to clear dn_is_exportable
+        for them. Returns the number of locations updated.
+        """
+        return cls.objects.filter(
+            dn_is_exportable=True,
+            dn_latest_non_skip_report__planned_closure__lt=date.today(),
+        ).update(dn_is_exportable=False)
 
-        most_recent_source_location_on_hours_json = (
-            self.matched_source_locations.all()
-            .filter(source_name__in=SOURCE_NAMES_TO_CONSIDER_FOR_HOURS)
-            .exclude(import_json__opening_hours=None)
-            .exclude(import_json__opening_hours=[])
-            .order_by("-last_imported_at")
-            .first()
-        )
-        if most_recent_source_location_on_hours_json:
-            hours_json = most_recent_source_location_on_hours_json.import_json[
-                "opening_hours"
-            ]
-            hours_json_last_updated_at = (
-                most_recent_source_location_on_hours_json.last_imported_at
-            )
+    def queue_update_denormalizations(self):
+        """
+        Run update_denormalizations() now, or - inside a
+        coalesce_location_denormalizations() block - once for this
+        location when that block exits.
+        """
+        pending = getattr(_denormalizations, "pending", None)
+        if pending is None:
+            self._sync_denormalizations()
+        else:
+            pending[self.pk] = self
 
-        derived = DerivedResults(
-            vaccines_offered=vaccines_offered,
-            vaccines_offered_provenance_report=vaccines_offered_provenance_report,
-            vaccines_offered_provenance_source_location=vaccines_offered_provenance_source_location,
-            vaccines_offered_last_updated_at=vaccines_offered_last_updated_at,
-            accepts_appointments=accepts_appointments,
-            accepts_walkins=accepts_walkins,
-            appointments_walkins_provenance_report=appointments_walkins_provenance_report,
-            appointments_walkins_provenance_source_location=appointments_walkins_provenance_source_location,
-            appointments_walkins_last_updated_at=appointments_walkins_last_updated_at,
-            most_recent_report_on_vaccines_offered=most_recent_report_on_vaccines_offered,
-            most_recent_source_location_on_vaccines_offered=most_recent_source_location_on_vaccines_offered,
-            most_recent_report_on_availability=most_recent_report_on_availability,
-            most_recent_source_location_on_availability=most_recent_source_location_on_availability,
-            hours_json=hours_json,
-            hours_json_provenance_source_location=most_recent_source_location_on_hours_json,
-            most_recent_source_location_on_hours_json=most_recent_source_location_on_hours_json,
-            hours_json_last_updated_at=hours_json_last_updated_at,
-        )
-        if save:
-            self.vaccines_offered = derived.vaccines_offered
-            self.vaccines_offered_provenance_report = (
-                derived.vaccines_offered_provenance_report
-            )
-            self.vaccines_offered_provenance_source_location = (
-                derived.vaccines_offered_provenance_source_location
-            )
-            self.vaccines_offered_last_updated_at = (
-                derived.vaccines_offered_last_updated_at
-            )
-            self.accepts_appointments = derived.accepts_appointments
-            self.accepts_walkins = derived.accepts_walkins
-            self.appointments_walkins_provenance_report = (
-                derived.appointments_walkins_provenance_report
-            )
-            self.appointments_walkins_provenance_source_location = (
-                derived.appointments_walkins_provenance_source_location
-            )
-            self.appointments_walkins_last_updated_at = (
-                derived.appointments_walkins_last_updated_at
-            )
-            self.save(
-                update_fields=[
-                    "vaccines_offered",
-                    "vaccines_offered_provenance_report",
-                    "vaccines_offered_provenance_source_location",
-                    "vaccines_offered_last_updated_at",
-                    "accepts_appointments",
-                    "accepts_walkins",
-                    "appointments_walkins_provenance_report",
-                    "appointments_walkins_provenance_source_location",
-                    "appointments_walkins_last_updated_at",
-                ]
-            )
-        return derived
+    def _sync_denormalizations(self):
+        if settings.LOCATION_DENORMALIZATION_TRIGGERS:
+            # The database triggers have already updated the row - refresh
+            # so a later save() of this instance does not overwrite them
+            self.refresh_from_db(fields=DENORMALIZED_FIELDS)
+        else:
+            self.update_denormalizations()
 
     @beeline.traced("update_denormalizations")
     def update_denormalizations(self):
@@ -789,6 +1006,7 @@ class Location(gis_models.Model):
             and any(t for t in r.availability_tags.all() if t.group == "yes")
         ]
         dn_yes_report_count = len(dn_latest_yes_reports)
+        dn_report_count = len(reports)
         if dn_latest_yes_reports:
             dn_latest_yes_report = dn_latest_yes_reports[0]
         else:
@@ -815,6 +1033,23 @@ class Location(gis_models.Model):
         else:
             dn_latest_non_skip_report = None
 
+        dn_is_exportable = dn_latest_non_skip_report is None or not (
+            (
+                dn_latest_non_skip_report.planned_closure
+                and dn_latest_non_skip_report.planned_closure < date.today()
+            )
+            or any(
+                t.slug in EXPORT_EXCLUDED_AVAILABILITY_TAGS
+                for t in dn_latest_non_skip_report.availability_tags.all()
+            )
+        )
+
+        last_called_at = (
+            dn_latest_report_including_pending.created_at
+            if dn_latest_report_including_pending
+            else None
+        )
+
         # Has anything changed?
         def pk_or_none(record):
             if record is None:
@@ -831,6 +1066,9 @@ class Location(gis_models.Model):
             != pk_or_none(dn_latest_non_skip_report)
             or self.dn_skip_report_count != dn_skip_report_count
             or self.dn_yes_report_count != dn_yes_report_count
+            or self.dn_report_count != dn_report_count
+            or self.dn_is_exportable != dn_is_exportable
+            or self.last_called_at != last_called_at
         ):
             beeline.add_context({"updates": True})
             self.dn_latest_report = dn_latest_report
@@ -840,26 +1078,31 @@ class Location(gis_models.Model):
             self.dn_latest_non_skip_report = dn_latest_non_skip_report
             self.dn_skip_report_count = dn_skip_report_count
             self.dn_yes_report_count = dn_yes_report_count
-            self.save(
-                update_fields=(
-                    "dn_latest_report",
-                    "dn_latest_report_including_pending",
-                    "dn_latest_yes_report",
-                    "dn_latest_skip_report",
-                    "dn_latest_non_skip_report",
-                    "dn_skip_report_count",
-                    "dn_yes_report_count",
-                )
-            )
+            self.dn_report_count = dn_report_count
+            self.dn_is_exportable = dn_is_exportable
+            self.last_called_at = last_called_at
+            self.save(update_fields=DENORMALIZED_FIELDS)
         else:
             beeline.add_context({"updates": False})
 
     def save(self, *args, **kwargs):
-        # Point is derived from latitude/longitude
-        if self.longitude and self.latitude:
-            self.point = Point(float(self.longitude), float(self.latitude), srid=4326)
-        else:
-            self.point = None
+        adding = self._state.adding
+        changed = self.changed_tracked_fields(kwargs.get("update_fields"))
+        # Point and timezone are derived from latitude/longitude
+        if adding or changed & {"latitude", "longitude"}:
+            if self.longitude and self.latitude:
+                self.point = Point(
+                    float(self.longitude), float(self.latitude), srid=4326
+                )
+                self.timezone = timezone_for_point(self.latitude, self.longitude)
+            else:
+                self.point = None
+                self.timezone = None
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = set(kwargs["update_fields"]) | {
+                    "point",
+                    "timezone",
+                }
         set_public_id_later = False
         if (not self.public_id) and self.airtable_id:
             self.public_id = self.airtable_id
@@ -870,10 +1113,16 @@ class Location(gis_models.Model):
         if set_public_id_later:
             self.public_id = self.pid
             Location.objects.filter(pk=self.pk).update(public_id=self.pid)
+        # Fields left out of update_fields still differ from the database
+        self._snapshot_tracked_fields(kwargs.get("update_fields"))
 
         # If we don't belong in the callable locations anymore, remove
-        # from the call request queue
-        if Location.valid_for_call().filter(pk=self.pk).count() == 0:
+        # from the call request queue - new locations cannot be queued yet
+        if (
+            not adding
+            and changed & LOCATION_CALL_QUEUE_FIELDS
+            and Location.valid_for_call().filter(pk=self.pk).count() == 0
+        ):
             CallRequest.objects.filter(location_id=self.id, completed=False).delete()
 
 
@@ -1194,6 +1443,12 @@ class Report(models.Model):
 
     class Meta:
         db_table = "report"
+        indexes = [
+            # For "most recent report for each location" queries
+            models.Index(
+                fields=["location", "created_at"], name="report_location_created_idx"
+            )
+        ]
 
     def __str__(self):
         return "Call to {} by {} at {}".format(
@@ -1216,14 +1471,14 @@ class Report(models.Model):
             self.public_id = self.pid
             Report.objects.filter(pk=self.pk).update(public_id=self.pid)
         location = self.location
-        location.update_denormalizations()
+        location.queue_update_denormalizations()
         # location.derive_details(save=True)
         # will not work here because the availability tags have not yet been saved
 
     def delete(self, *args, **kwargs):
         location = self.location
         super().delete(*args, **kwargs)
-        location.update_denormalizations()
+        location.queue_update_denormalizations()
         location.derive_details(save=True)
 
 
@@ -1387,6 +1642,14 @@ class CallRequest(models.Model):
         # Within those groups, lower priority scores come before higher
         # Finally we tie-break on ID optimizing for mostl recently created first
         ordering = ("priority_group", "-priority", "-id")
+        indexes = [
+            # The head of the queue, in the order above, for claiming
+            models.Index(
+                fields=["priority_group", "-priority", "-id"],
+                name="call_request_queue_idx",
+                condition=Q(completed=False),
+            )
+        ]
         constraints = [
             models.UniqueConstraint(
                 name="unique_locations_in_queue",
@@ -1416,9 +1679,26 @@ class CallRequest(models.Model):
         reason: str,
         limit: Optional[int] = 0,
         **kwargs: Any,
-    ) -> List[CallRequest]:
-        now = timezone.now()
+    ) -> int:
+        """Queue a call request for each of these locations that is
+        valid for calling and not already queued, entirely in SQL
+        with a single INSERT ... SELECT.
+
+        Returns the number of call requests added."""
         reason_obj = CallRequestReason.objects.get_or_create(short_reason=reason)[0]
+        # Every column other than the id and location_id is the same
+        # for all of the rows, so take them from an unsaved instance
+        args = {
+            "vesting_at": timezone.now(),
+            "call_request_reason": reason_obj,
+        }
+        args.update(kwargs)
+        template = cls(**args)
+        fields = [
+            field
+            for field in cls._meta.concrete_fields
+            if not field.primary_key and field.name != "location"
+        ]
         with transaction.atomic():
             # Lock the locations we want to insert, so they don't
             # change if they're valid to be in the queue, while we
@@ -1426,38 +1706,45 @@ class CallRequest(models.Model):
             locations = (locations & Location.valid_for_call()).select_for_update(
                 of=["self"]
             )
-            # Now that we have a lock on them, we know any other
-            # inserts of them (though not others) will block behind
-            # that.  Estimate out how many duplicates we possibly
-            # have.  We lock them so our estimate is more accurate.
-            existing_call_requests = CallRequest.objects.filter(
-                location__in=locations, completed=False
-            ).select_for_update()
-            # Filter duplicates them out of the insert.  Note that
-            # this is mostly advisory, so we get the right-ish objects
-            # from the bulk_create -- the `ignore_conflicts` on it
-            # will enfoce the uniqueness.
+            # Leave out locations that are already queued, so that
+            # `limit` only counts new call requests.  ON CONFLICT DO
+            # NOTHING enforces the uniqueness if we race with another
+            # insert.
             locations = locations.exclude(
-                id__in=existing_call_requests.values("location_id")
+                id__in=cls.objects.filter(completed=False).values("location_id")
             )
             if limit:
                 locations = locations[0:limit]
-
-            args = {
-                "vesting_at": now,
-                "call_request_reason": reason_obj,
-            }
-            args.update(**kwargs)
-
-            # Do the insert, ignoring duplicates.  bulk_create returns
-            # all rows, even ones whose insert failed because of
-            # conflicts; this _may_, on races, contain too many rows
-            # in the return value, so the returned list of "new"
-            # values is advisory.
-            return cls.objects.bulk_create(
-                [cls(location=location, **args) for location in locations],
-                ignore_conflicts=True,
+            select_sql, select_params = locations.values_list(
+                "id", flat=True
+            ).query.sql_with_params()
+            sql = """
+                insert into {table} ({location_column}, {columns})
+                select candidate.id, {placeholders} from ({select_sql}) candidate
+                on conflict do nothing
+            """.format(
+                table=connection.ops.quote_name(cls._meta.db_table),
+                location_column=connection.ops.quote_name(
+                    cls._meta.get_field("location").column
+                ),
+                columns=", ".join(
+                    connection.ops.quote_name(field.column) for field in fields
+                ),
+                # Cast, as untyped literals in a SELECT would be text
+                placeholders=", ".join(
+                    "%s::{}".format(field.cast_db_type(connection)) for field in fields
+                ),
+                select_sql=select_sql,
             )
+            params = [
+                field.get_db_prep_save(getattr(template, field.attname), connection)
+                for field in fields
+            ] + list(select_params)
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                num_inserted = cursor.rowcount
+        beeline.add_context({"count": num_inserted})
+        return num_inserted
 
     @classmethod
     @beeline.traced("get_call_request")
@@ -1466,32 +1753,54 @@ class CallRequest(models.Model):
         claim_for: Optional[Reporter] = None,
         state: Optional[str] = None,
     ) -> Optional[CallRequest]:
-        # First, drop some items there are some items in the queue, in case
-        # it has run dry.  We backfill according to the state we're
-        # looking for, which may affect which locations are in the
-        # queue for people who are _not_ asking for a specific state.
-        cls.backfill_queue(state=state)
+        call_requests = cls.get_call_requests(claim_for=claim_for, state=state, count=1)
+        return call_requests[0] if call_requests else None
+
+    @classmethod
+    @beeline.traced("get_call_requests")
+    def get_call_requests(
+        cls,
+        claim_for: Optional[Reporter] = None,
+        state: Optional[str] = None,
+        count: int = 1,
+        qs: Optional[QuerySet[CallRequest]] = None,
+    ) -> List[CallRequest]:
+        """Claim up to `count` call requests from the head of the queue
+        in a single transaction, so a caller can prefetch their next few
+        calls.  Any they don't get to are released when claimed_until
+        passes, like any other claim.
+
+        Pass `qs` to select_related() or prefetch_related() whatever will
+        be used from the claimed requests."""
+        # This only claims - keeping the queue topped up is the job of
+        # refill_queue(), run in the background by refill_call_queue
         now = timezone.now()
-        available_requests = cls.available_requests()
+        available_requests = cls.available_requests(qs)
         if state is not None:
             available_requests = available_requests.filter(
                 location__state__abbreviation=state
             )
-        # We need to lock the record we select so we can update
-        # it marking that we have claimed it
+        beeline.add_context({"count": count})
+        # We need to lock the records we select so we can update
+        # them marking that we have claimed them.  Requests that
+        # another caller has locked are skipped rather than waited on,
+        # so concurrent callers each take the next unlocked requests
+        # instead of queueing up behind the same ones.
         with transaction.atomic():
-            call_requests = available_requests.select_for_update()[:1]
-            try:
-                call_request: Optional[CallRequest] = call_requests[0]
-            except IndexError:
-                call_request = None
-            if call_request is not None and claim_for:
-                call_request.claimed_by = claim_for
-                call_request.claimed_until = now + timedelta(
-                    minutes=settings.CLAIM_LOCK_MINUTES
-                )
-                call_request.save()
-            return call_request
+            call_requests = list(
+                available_requests.select_for_update(skip_locked=True, of=("self",))[
+                    :count
+                ]
+            )
+            if call_requests and claim_for:
+                claimed_until = now + timedelta(minutes=settings.CLAIM_LOCK_MINUTES)
+                cls.objects.filter(
+                    pk__in=[call_request.pk for call_request in call_requests]
+                ).update(claimed_by=claim_for, claimed_until=claimed_until)
+                for call_request in call_requests:
+                    call_request.claimed_by = claim_for
+                    call_request.claimed_until = claimed_until
+            return call_requests
 
     @classmethod
     @beeline.traced("mark_completed_by")
@@ -1556,60 +1865,137 @@ class CallRequest(models.Model):
     @beeline.traced("backfill_queue")
     def backfill_queue(
         cls, minimum: Optional[int] = None, state: Optional[str] = None
-    ) -> None:
-        """This is a last-resort refill of the queue.
+    ) -> int:
+        """Top up the queue to `minimum` available requests, optionally
+        counting and adding only locations in one state.
 
-        It should only happen when we have exhausted all things
-        explicitly placed in the queue.
+        This is a last-resort refill of the queue, run in the
+        background by refill_queue(); it only matters once we have
+        exhausted all things explicitly placed in the queue.
 
+        Returns the number of call requests added.
         """
         if minimum is None:
             minimum = settings.MIN_CALL_REQUEST_QUEUE_ITEMS
-        num_to_create = max(0, minimum - cls.available_requests().count())
+        available_requests = cls.available_requests()
+        if state is not None:
+            available_requests = available_requests.filter(
+                location__state__abbreviation=state
+            )
+        num_to_create = max(0, minimum - available_requests.count())
         beeline.add_context({"count": num_to_create})
         if num_to_create == 0:
-            return
+            return 0
 
         # num_to_create may be stale by now, but worst case if we race
         # we'll insert more locations than necessary.
         try:
-            with transaction.atomic():
-                # Only consider existing locations that are valid for
-                # calling that are not currently queued in _any_ form
-                # (even if that's claimed or not-yet-vested)
-                location_options = Location.valid_for_call().exclude(
-                    id__in=cls.objects.filter(completed=False).values("location_id")
-                )
-                if state is not None:
-                    location_options = location_options.filter(
-                        state__abbreviation=state
-                    )
-
-                # Add any locations that have never been called
-                created_call_requests = cls.insert(
-                    location_options.filter(
-                        dn_latest_report_including_pending__isnull=True
-                    ),
-                    reason="Automatic backfill",
-                    limit=num_to_create,
-                )
-                num_to_create -= len(created_call_requests)
-                if num_to_create <= 0:
-                    return
-
-                # Then add locations by longest-ago
-                cls.insert(
-                    location_options.order_by(
-                        "dn_latest_report_including_pending__created_at"
-                    ),
-                    reason="Automatic backfill",
-                    limit=num_to_create,
-                )
+            # Only consider existing locations that are valid for
+            # calling that are not currently queued in _any_ form
+            # (even if that's claimed or not-yet-vested)
+            location_options = Location.valid_for_call().exclude(
+                id__in=cls.objects.filter(completed=False).values("location_id")
+            )
+            if state is not None:
+                location_options = location_options.filter(state__abbreviation=state)
+
+            # Locations that have never been called come first, then
+            # by longest-ago - this is location_last_called_at_idx
+            return cls.insert(
+                location_options.order_by(F("last_called_at").asc(nulls_first=True)),
+                reason="Automatic backfill",
+                limit=num_to_create,
+            )
         except IntegrityError:
             # We tried to add a location that was already in the
             # queue, probably via a race condition!  Just log, and
             # carry on.
             sentry_sdk.capture_exception()
+            return 0
+
+    @classmethod
+    @beeline.traced("refill_queue")
+    def refill_queue(cls) -> Dict[Optional[str], int]:
+        """Top up each of the per-state low-watermarks in
+        MIN_CALL_REQUEST_QUEUE_ITEMS_BY_STATE, then the queue as a
+        whole to MIN_CALL_REQUEST_QUEUE_ITEMS.
+
+        Returns {state abbreviation, or None for all states: number of
+        call requests added}
+        """
+        added: Dict[Optional[str], int] = {}
+        for state, minimum in settings.MIN_CALL_REQUEST_QUEUE_ITEMS_BY_STATE.items():
+            added[state] = cls.backfill_queue(minimum=minimum, state=state)
+        added[None] = cls.backfill_queue()
+        return added
+
+    @classmethod
+    @beeline.traced("score_queue")
+    def score_queue(cls) -> int:
+        """Set the priority of every queued call request in the
+        NOT_PRIORITIZED_99 group from a score for its location - see
+        CALL_PRIORITY_SCORE_WEIGHTS.
+
+        Requests that were prioritized by hand, or rescheduled after a
+        skip, are left alone.  The scores are calculated and written
+        by a single UPDATE.  Returns the number of call requests whose
+        priority changed.
+        """
+        valid_sql, valid_params = (
+            Location.valid_for_call().values("id").query.sql_with_params()
+        )
+        sql = """
+            update call_request set priority = scored.score
+            from (
+                select
+                    location.id as location_id,
+                    round(
+                        {per_day_since_last_called} * least(
+                            coalesce(
+                                greatest(
+                                    extract(epoch from now() - location.last_called_at),
+                                    0
+                                ) / 86400,
+                                {max_days_since_last_called}
+                            ),
+                            {max_days_since_last_called}
+                        )
+                        + case when county.vts_priorty is null then 0
+                            else {county_priority} * greatest(
+                                0,
+                                1 - county.vts_priorty::float / {county_priority_ranks}
+                            )
+                        end
+                        + {per_yes_report}
+                            * least(location.dn_yes_report_count, {max_report_count})
+                        + {per_skip_report}
+                            * least(location.dn_skip_report_count, {max_report_count})
+                        + case
+                            when location.dn_latest_report_id
+                                = location.dn_latest_yes_report_id
+                            then {latest_report_is_yes} else 0
+                        end
+                    )::integer as score
+                from location
+                left join county on county.id = location.county_id
+                where location.id in ({valid_sql})
+            ) scored
+            where call_request.location_id = scored.location_id
+                and call_request.completed = false
+                and call_request.priority_group = %s
+                and call_request.tip_report_id is null
+                and call_request.priority is distinct from scored.score
+        """.format(
+            valid_sql=valid_sql, **CALL_PRIORITY_SCORE_WEIGHTS
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql,
+                list(valid_params) + [cls.PriorityGroup.NOT_PRIORITIZED_99],
+            )
+            num_updated = cursor.rowcount
+        beeline.add_context({"count": num_updated})
+        return num_updated
 
 
 class PublishedReport(models.Model):
@@ -1772,7 +2158,14 @@ class SourceLocation(gis_models.Model):
 
     class Meta:
         db_table = "source_location"
-        indexes = [models.Index(fields=["matched_location"])]
+        indexes = [
+            models.Index(fields=["matched_location"]),
+            # For "most recent source location for each location" queries
+            models.Index(
+                fields=["matched_location", "source_name", "last_imported_at"],
+                name="source_location_recent_idx",
+            ),
+        ]
 
 
 class SourceLocationMatchHistory(models.Model):
@@ -1984,11 +2377,97 @@ class CompletedLocationMerge(models.Model):
         db_table = "completed_location_merge"
 
 
+class LocationExportQuerySet(models.QuerySet):
+    def exportable(self):
+        "Rows that should be exported to the public map on www.vaccinatethestates.com"
+        # is_exportable only catches up with past planned closures when
+        # expire_planned_closures runs, so check the date here too
+        return self.filter(is_exportable=True).exclude(
+            report_planned_closure__lt=date.today()
+        )
+
+
+class LocationExport(models.Model):
+    """
+    One pre-joined row per non-deleted location, with its latest non-skip report.
+
+    Backed by the location_export materialized view, which is refreshed by the
+    refresh_location_export management command and /api/refreshLocationExport
+    so rows can lag behind the underlying tables until the next refresh.
+    """
+
+    location = models.OneToOneField(
+        Location,
+        primary_key=True,
+        related_name="export",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    public_id = models.SlugField()
+    name = CharTextField()
+    website = CharTextField(null=True)
+    full_address = models.TextField(null=True)
+    phone_number = CharTextField(null=True)
+    google_places_id = CharTextField(null=True)
+    vaccinefinder_location_id = CharTextField(null=True)
+    vaccinespotter_location_id = CharTextField(null=True)
+    hours = models.TextField(null=True)
+    latitude = models.DecimalField(max_digits=9, decimal_places=5)
+    longitude = models.DecimalField(max_digits=9, decimal_places=5)
+    state_abbreviation = models.CharField(max_length=2)
+    location_type_name = CharTextField()
+    county_name = CharTextField(null=True)
+    county_vaccine_reservations_url = models.TextField(null=True)
+    provider_name = CharTextField(null=True)
+    provider_appointments_url = models.TextField(null=True)
+    report_id = models.IntegerField(null=True)
+    report_created_at = models.DateTimeField(null=True)
+    report_public_notes = models.TextField(null=True)
+    report_appointment_details = models.TextField(null=True)
+    report_planned_closure = models.DateField(null=True)
+    report_restriction_notes = models.TextField(null=True)
+    report_vaccines_offered = models.JSONField(null=True)
+    appointment_tag_slug = models.SlugField(null=True)
+    appointment_tag_name = models.CharField(max_length=30, null=True)
+    availability_tag_slugs = ArrayField(models.SlugField())
+    is_exportable = models.BooleanField()
+
+    objects = LocationExportQuerySet.as_manager()
+
+    @classmethod
+    def refresh(cls, concurrently=True):
+        # CONCURRENTLY lets exports keep reading the old rows while it runs
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "refresh materialized view {}location_export".format(
+                    "concurrently " if concurrently else ""
+                )
+            )
+
+    def full_appointment_details(self):
+        "Equivalent to Report.full_appointment_details() for the latest report"
+        if self.report_appointment_details:
+            return self.report_appointment_details
+        elif self.county_name and self.appointment_tag_slug == "county_website":
+            return self.county_vaccine_reservations_url
+        elif self.appointment_tag_slug == "myturn_ca_gov":
+            return "https://myturn.ca.gov/"
+        elif self.website:
+            return self.website
+        elif self.provider_appointments_url:
+            return self.provider_appointments_url
+        return None
+
+    class Meta:
+        managed = False
+        db_table = "location_export"
+
+
 # Signals
 @receiver(m2m_changed, sender=Report.availability_tags.through)
 def denormalize_location(sender, instance, action, **kwargs):
     if action in ("post_add", "post_remove", "post_clear"):
-        instance.location.update_denormalizations()
+        instance.location.queue_update_denormalizations()
 
 
 @receiver(m2m_changed, sender=ReportReviewNote.tags.through)
@@ -1,9 +1,22 @@
+import threading
+import time
 from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Tuple, Union
+from io import StringIO
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import pytest
-from core.models import AppointmentTag, CallRequest, Location, Reporter, State
+from core.models import (
+    AppointmentTag,
+    AvailabilityTag,
+    CallRequest,
+    County,
+    Location,
+    Reporter,
+    State,
+)
+from django.core.management import call_command
+from django.db import connection
 from django.db.models.query import QuerySet
 from django.utils import timezone
 from time_machine import Coordinates
@@ -94,14 +107,64 @@ def test_backfill_state(ten_locations: List[Location]) -> None:
         loc.save()
 
     # We should only get 5 locations
-    CallRequest.backfill_queue(10, state="CA")
+    assert CallRequest.backfill_queue(10, state="CA") == 5
     assert CallRequest.objects.count() == 5
     assert CallRequest.objects.filter(location__state__abbreviation="CA").count() == 5
 
+    # The minimum only counts requests for that state
+    assert CallRequest.backfill_queue(3, state="OR") == 3
+    assert CallRequest.objects.filter(location__state__abbreviation="OR").count() == 3
+    assert CallRequest.backfill_queue(3, state="OR") == 0
+
+
+@pytest.mark.django_db()
+def test_refill_queue(ten_locations: List[Location], settings: Any) -> None:
+    for loc in ten_locations[0:10:2]:
+        loc.state = State.objects.filter(abbreviation="CA").get()
+        loc.save()
+    settings.MIN_CALL_REQUEST_QUEUE_ITEMS = 5
+    settings.MIN_CALL_REQUEST_QUEUE_ITEMS_BY_STATE = {"CA": 4, "OR": 1}
+
+    # Each state is topped up first, then the queue as a whole
+    assert CallRequest.refill_queue() == {"CA": 4, "OR": 1, None: 0}
+    assert CallRequest.available_requests().count() == 5
+    assert CallRequest.refill_queue() == {"CA": 0, "OR": 0, None: 0}
+
+    # Claiming never backfills; the next refill replaces what was claimed
+    reporter = Reporter.objects.get_or_create(external_id="test:1")[0]
+    for _ in range(5):
+        assert CallRequest.get_call_request(claim_for=reporter)
+    assert CallRequest.get_call_request(claim_for=reporter) is None
+    # Claimed locations are still queued, so only one CA location is left
+    assert CallRequest.refill_queue() == {"CA": 1, "OR": 1, None: 3}
+
+
+@pytest.mark.django_db()
+def test_backfill_orders_by_last_called_at(ten_locations: List[Location]) -> None:
+    reporter = Reporter.objects.get_or_create(external_id="test:1")[0]
+    web = AppointmentTag.objects.get(slug="web")
+    for i, location in enumerate(ten_locations):
+        location.reports.create(
+            created_at=timezone.now() - timedelta(days=i),
+            reported_by=reporter,
+            report_source="ca",
+            appointment_tag=web,
+        )
+        location.refresh_from_db()
+        assert (
+            location.last_called_at
+            == location.dn_latest_report_including_pending.created_at
+        )
+
+    CallRequest.backfill_queue(3)
+    assert set(CallRequest.objects.values_list("location_id", flat=True)) == {
+        location.id for location in ten_locations[7:]
+    }
+
 
 def enqueue(
     what: Union[Location, List[Location], QuerySet[Location]], **kwargs: Any
-) -> List[CallRequest]:
+) -> int:
     if isinstance(what, QuerySet):
         qs = what
     elif isinstance(what, List):
@@ -115,14 +178,12 @@ def enqueue(
 def test_enqueue(ten_locations: List[Location]) -> None:
     # Simple enqueue
     assert CallRequest.available_requests().count() == 0
-    inserted = enqueue(ten_locations[0])
-    assert len(inserted) == 1
+    assert enqueue(ten_locations[0]) == 1
     assert CallRequest.objects.count() == 1
     assert CallRequest.available_requests().count() == 1
 
     # Re-enqueing doesn't work
-    inserted = enqueue(ten_locations[0])
-    assert len(inserted) == 0
+    assert enqueue(ten_locations[0]) == 0
     assert CallRequest.objects.count() == 1
     assert CallRequest.available_requests().count() == 1
 
@@ -130,25 +191,119 @@ def test_enqueue(ten_locations: List[Location]) -> None:
     CallRequest.objects.all().update(completed=True)
     assert CallRequest.objects.count() == 1
     assert CallRequest.available_requests().count() == 0
-    inserted = enqueue(ten_locations[0])
-    assert len(inserted) == 1
+    assert enqueue(ten_locations[0]) == 1
     assert CallRequest.objects.count() == 2
     assert CallRequest.available_requests().count() == 1
 
     # Enqueueing multiple locations works
-    inserted = enqueue(ten_locations[1:4])
-    assert len(inserted) == 3
+    assert enqueue(ten_locations[1:4]) == 3
     assert CallRequest.objects.count() == 5
     assert CallRequest.available_requests().count() == 4
 
     # Enqueueing some locations which overlap with existing locations
     # enqueues just the new ones
-    inserted = enqueue(ten_locations[0:8])
-    assert len(inserted) == 4
+    assert enqueue(ten_locations[0:8]) == 4
     assert CallRequest.objects.count() == 9
     assert CallRequest.available_requests().count() == 8
 
 
+@pytest.mark.django_db()
+def test_enqueue_columns(ten_locations: List[Location]) -> None:
+    reporter = Reporter.objects.get_or_create(external_id="test:1")[0]
+    report = ten_locations[0].reports.create(
+        reported_by=reporter,
+        report_source="ca",
+        appointment_tag=AppointmentTag.objects.get(slug="web"),
+    )
+    vesting_at = timezone.now() + timedelta(days=1)
+    assert (
+        enqueue(
+            ten_locations,
+            limit=3,
+            vesting_at=vesting_at,
+            priority_group=2,
+            priority=5,
+            tip_type=CallRequest.TipType.SCOOBY,
+            tip_report=report,
+        )
+        == 3
+    )
+    for call_request in CallRequest.objects.all():
+        assert call_request.call_request_reason.short_reason == "New location"
+        assert call_request.created_at is not None
+        assert call_request.vesting_at == vesting_at
+        assert call_request.priority_group == 2
+        assert call_request.priority == 5
+        assert call_request.tip_type == "scooby_report"
+        assert call_request.tip_report == report
+        assert not call_request.completed
+        assert call_request.claimed_by is None
+
+
+@pytest.mark.django_db()
+def test_insert_with_vesting_at(ten_locations: List[Location]) -> None:
+    # vesting_at overrides the default of now, as mark_completed_by does
+    vesting_at = timezone.now() + timedelta(days=3)
+    assert (
+        CallRequest.insert(
+            Location.objects.filter(pk=ten_locations[0].pk),
+            reason="Previously skipped",
+            vesting_at=vesting_at,
+        )
+        == 1
+    )
+    assert CallRequest.objects.get().vesting_at == vesting_at
+
+
+@pytest.mark.django_db()
+def test_score_queue(ten_locations: List[Location]) -> None:
+    reporter = Reporter.objects.get_or_create(external_id="test:1")[0]
+    web = AppointmentTag.objects.get(slug="web")
+
+    def report(location, tag_slug=None, **kwargs):
+        report = location.reports.create(
+            reported_by=reporter, report_source="ca", appointment_tag=web, **kwargs
+        )
+        if tag_slug:
+            report.availability_tags.add(AvailabilityTag.objects.get(slug=tag_slug))
+        return report
+
+    # 0: never called
+    # 1: a yes report, just now
+    report(ten_locations[1], "vaccinating_65_plus")
+    # 2: a skip report, just now
+    report(ten_locations[2], "skip_call_back_later")
+    # 3: never called, in the county with the highest VTS priority
+    County.objects.filter(vts_priorty=1).update(vts_priorty=None)
+    ten_locations[3].county = County.objects.create(
+        name="Top",
+        fips_code="99999",
+        state=State.objects.get(abbreviation="OR"),
+        vts_priorty=1,
+    )
+    ten_locations[3].save()
+    # 4: called two days ago
+    report(ten_locations[4], created_at=timezone.now() - timedelta(days=2))
+    enqueue(ten_locations[0:5])
+    # Prioritized by hand, or rescheduled after a report - left alone
+    enqueue(ten_locations[5], priority_group=1)
+    enqueue(ten_locations[6], tip_report=report(ten_locations[6]))
+
+    assert CallRequest.score_queue() == 5
+    priorities = dict(CallRequest.objects.values_list("location_id", "priority"))
+    assert [priorities[location.id] for location in ten_locations[0:7]] == [
+        300,
+        70,
+        -20,
+        400,
+        20,
+        0,
+        0,
+    ]
+    # Nothing changed, nothing to write
+    assert CallRequest.score_queue() == 0
+
+
 @pytest.mark.django_db()
 def test_call_enqueue_request_validity() -> None:
     def insert_fails(**kwargs: Any) -> bool:
@@ -161,7 +316,7 @@ def test_call_enqueue_request_validity() -> None:
             "longitude": 40,
         }
         args.update(kwargs)
-        return enqueue(Location.objects.create(**args)) == []
+        return enqueue(Location.objects.create(**args)) == 0
 
     # Various things that exempt a location from being called
     assert insert_fails(do_not_call=True)
@@ -213,12 +368,88 @@ def test_call_remove_invalid_location(ten_locations: List[Location]) -> None:
     assert CallRequest.available_requests().count() == 0
 
 
+@pytest.mark.django_db()
+def test_location_save_only_checks_call_queue_when_needed(
+    ten_locations: List[Location], django_assert_num_queries: Any
+) -> None:
+    enqueue(ten_locations)
+    location = Location.objects.get(pk=ten_locations[0].pk)
+    # Saves that touch none of the valid_for_call() fields are a single UPDATE
+    location.name = "Renamed"
+    with django_assert_num_queries(1):
+        location.save()
+    location.dn_yes_report_count = 1
+    with django_assert_num_queries(1):
+        location.save(update_fields=["dn_yes_report_count"])
+    # A save that leaves the location callable checks, but keeps the request
+    location.phone_number = "(555) 555-1234"
+    with django_assert_num_queries(2):
+        location.save()
+    assert CallRequest.objects.filter(location=location).count() == 1
+    # ... and one that doesn't removes it
+    location.do_not_call = True
+    location.save()
+    assert CallRequest.objects.filter(location=location).count() == 0
+    # Changes made behind the instance's back are picked up on refresh
+    Location.objects.filter(pk=location.pk).update(do_not_call=False)
+    location.refresh_from_db()
+    enqueue(location)
+    location.name = "Renamed again"
+    with django_assert_num_queries(1):
+        location.save()
+    assert CallRequest.objects.filter(location=location).count() == 1
+    # A change left out of update_fields is still noticed by a later save
+    location.do_not_call = True
+    location.save(update_fields=["name"])
+    assert CallRequest.objects.filter(location=location).count() == 1
+    location.save()
+    assert CallRequest.objects.filter(location=location).count() == 0
+
+
+@pytest.mark.django_db()
+def test_location_save_only_recalculates_point_when_moved(
+    ten_locations: List[Location],
+) -> None:
+    location = Location.objects.get(pk=ten_locations[0].pk)
+    assert (location.point.x, location.point.y) == (40, 30)
+    # Point is not recalculated unless latitude or longitude change
+    location.point = None
+    location.save(update_fields=["name"])
+    assert location.point is None
+    location.latitude = 31
+    location.save()
+    location.refresh_from_db()
+    assert (location.point.x, location.point.y) == (40, 31)
+
+
+@pytest.mark.django_db()
+def test_location_timezone(ten_locations: List[Location]) -> None:
+    location = Location.objects.get(pk=ten_locations[0].pk)
+    location.latitude = 45.5760998
+    location.longitude = -122.5134775
+    location.save()
+    location.refresh_from_db()
+    assert location.timezone == "America/Los_Angeles"
+    # Saved along with the coordinates, even with update_fields
+    location.latitude = 40.7128
+    location.longitude = -74.006
+    location.save(update_fields=["latitude", "longitude"])
+    location.refresh_from_db()
+    assert location.timezone == "America/New_York"
+
+    Location.objects.update(timezone=None)
+    call_command("backfill_location_timezones", stdout=StringIO())
+    location.refresh_from_db()
+    assert location.timezone == "America/New_York"
+    assert not Location.objects.filter(timezone=None).exists()
+
+
 @pytest.mark.django_db()
 def test_get_call_request(
     ten_locations: List[Location], time_machine: Coordinates
 ) -> None:
-    # Can't get anything from an empty queue; Note that in these
-    # tests, MIN_CALL_REQUEST_QUEUE_ITEMS=0, which disables backfill.
+    # Can't get anything from an empty queue; get_call_request never
+    # backfills, that is left to refill_queue()
 
     reporter = Reporter.objects.get_or_create(external_id="test:1")[0]
     assert CallRequest.get_call_request(claim_for=reporter) is None
@@ -275,6 +506,47 @@ def test_get_call_request(
     assert CallRequest.get_call_request(claim_for=reporter) is not None
 
 
+# Threads use their own database connections, so they have to see
+# committed data - serialized_rollback restores the rows seeded by data
+# migrations, which the flush at the end of the test would otherwise delete
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_get_call_request_concurrently(ten_locations: List[Location]) -> None:
+    enqueue(ten_locations)
+    reporters = [
+        Reporter.objects.create(external_id="test:{}".format(i)) for i in range(20)
+    ]
+    # Start everyone at once so they contend for the head of the queue
+    barrier = threading.Barrier(len(reporters))
+    claimed: Dict[int, Optional[int]] = {}
+    latencies: List[float] = []
+
+    def claim(reporter: Reporter) -> None:
+        try:
+            barrier.wait()
+            start = time.perf_counter()
+            call_request = CallRequest.get_call_request(claim_for=reporter)
+            latencies.append(time.perf_counter() - start)
+            claimed[reporter.pk] = call_request.pk if call_request else None
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=claim, args=(r,)) for r in reporters]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Every call request was handed to exactly one reporter
+    claimed_ids = [pk for pk in claimed.values() if pk is not None]
+    assert len(claimed) == 20
+    assert len(claimed_ids) == 10
+    assert set(claimed_ids) == set(CallRequest.objects.values_list("pk", flat=True))
+    for call_request in CallRequest.objects.all():
+        assert claimed[call_request.claimed_by_id] == call_request.pk
+    # Nobody waited on anyone else's lock
+    assert max(latencies) < 5
+
+
 @pytest.mark.django_db()
 def test_get_call_request_priorities(ten_locations: List[Location]) -> None:
     reporter = Reporter.objects.get_or_create(external_id="test:1")[0]
@@ -13,6 +13,10 @@ def reporter(db):
 
 def assert_derived_results_match(location, expected):
     assert location.derive_details() == expected
+    # The set-based version should agree
+    assert Location.derive_details_bulk([location.pk], save=False) == {
+        location.pk: expected
+    }
     # Now try it with save=
     location.derive_details(save=True)
     location2 = Location.objects.get(pk=location.pk)
@@ -517,3 +521,76 @@ def test_hours_json_from_source_location(
     else:
         assert derived.hours_json_provenance_source_location is None
         assert not derived.hours_json
+
+
+def test_derive_details_bulk_matches_derive_details(ten_locations, reporter):
+    web = AppointmentTag.objects.get(slug="web")
+    walk_ins_only = AvailabilityTag.objects.get(slug="walk_ins_only")
+    skip_tag = AvailabilityTag.objects.get(slug="skip_call_back_later")
+    now = timezone.now()
+    for i, location in enumerate(ten_locations):
+        # A different mix of reports and source locations for each location
+        for j in range(i % 4):
+            report = location.reports.create(
+                reported_by=reporter,
+                report_source="ca",
+                appointment_tag=web,
+                vaccines_offered=["Pfizer"] if j % 2 else ["Moderna"],
+                created_at=now - datetime.timedelta(hours=i + j),
+            )
+            report.availability_tags.add(walk_ins_only if j != 2 else skip_tag)
+        if i % 3:
+            location.matched_source_locations.create(
+                source_uid="vaccinefinder_org:{}".format(i),
+                source_name="vaccinefinder_org",
+                name="Blah",
+                import_json={
+                    "availability": {"appointments": True, "drop_in": i % 2 == 0},
+                    "inventory": [{"vaccine": "moderna", "supply_level": "in_stock"}],
+                    "opening_hours": [
+                        {"day": "monday", "opens": "09:00", "closes": "17:00"}
+                    ],
+                },
+                last_imported_at=now - datetime.timedelta(hours=i - 2),
+            )
+    expected = {location.pk: location.derive_details() for location in ten_locations}
+    assert (
+        Location.derive_details_bulk(
+            [location.pk for location in ten_locations], save=False, batch_size=3
+        )
+        == expected
+    )
+
+    # Saving should write the same values as derive_details(save=True)
+    Location.derive_details_bulk([location.pk for location in ten_locations])
+    for location in ten_locations:
+        saved = Location.objects.get(pk=location.pk)
+        for field in (
+            "vaccines_offered",
+            "vaccines_offered_provenance_report",
+            "vaccines_offered_provenance_source_location",
+            "vaccines_offered_last_updated_at",
+            "accepts_appointments",
+            "accepts_walkins",
+            "appointments_walkins_provenance_report",
+            "appointments_walkins_provenance_source_location",
+            "appointments_walkins_last_updated_at",
+        ):
+            assert getattr(saved, field) == getattr(expected[location.pk], field)
+
+
+def test_derive_details_bulk_query_count(
+    ten_locations, reporter, django_assert_num_queries
+):
+    web = AppointmentTag.objects.get(slug="web")
+    for location in ten_locations:
+        location.reports.create(
+            reported_by=reporter,
+            report_source="ca",
+            appointment_tag=web,
+            vaccines_offered=["Pfizer"],
+        )
+    # Five "most recent" queries, two availability_tags prefetches, one
+    # to load the locations and one bulk update
+    with django_assert_num_queries(9):
+        Location.derive_details_bulk([location.pk for location in ten_locations])
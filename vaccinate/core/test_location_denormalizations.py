@@ -1,16 +1,21 @@
 import datetime
+from io import StringIO
 
 import pytest
+from django.core.management import call_command
 from django.utils import timezone
 
+from . import denormalization_triggers
 from .models import (
     AppointmentTag,
     AvailabilityTag,
     County,
     Location,
     LocationType,
+    Report,
     Reporter,
     State,
+    coalesce_location_denormalizations,
 )
 
 
@@ -53,6 +58,7 @@ def test_denormalized_location_report_columns():
     assert location.dn_latest_non_skip_report is None
     assert location.dn_skip_report_count == 0
     assert location.dn_yes_report_count == 0
+    assert location.dn_report_count == 1
     # Make it not pending any more
     report.is_pending_review = False
     report.save()
@@ -84,6 +90,7 @@ def test_denormalized_location_report_columns():
     assert location.dn_latest_non_skip_report is None
     assert location.dn_skip_report_count == 0
     assert location.dn_yes_report_count == 0
+    assert location.dn_report_count == 0
     # Add a single skip report
     report2 = location.reports.create(
         reported_by=reporter,
@@ -122,6 +129,7 @@ def test_denormalized_location_report_columns():
     assert location.dn_latest_yes_report == later_yes
     assert location.dn_skip_report_count == 0
     assert location.dn_yes_report_count == 2
+    assert location.dn_report_count == 2
     # Soft delete the later yes report
     later_yes.soft_deleted = True
     later_yes.save()
@@ -131,3 +139,222 @@ def test_denormalized_location_report_columns():
     assert location.dn_latest_yes_report == early_yes
     assert location.dn_skip_report_count == 0
     assert location.dn_yes_report_count == 1
+    assert location.dn_report_count == 1
+
+
+def test_coalesce_location_denormalizations(location, monkeypatch):
+    calls = []
+    original = Location.update_denormalizations
+
+    def record_calls(self):
+        calls.append(self.pk)
+        return original(self)
+
+    monkeypatch.setattr(Location, "update_denormalizations", record_calls)
+    reporter = Reporter.objects.get_or_create(external_id="auth0:reporter")[0]
+    web = AppointmentTag.objects.get(slug="web")
+    yes_tags = AvailabilityTag.objects.filter(group="yes")[:2]
+
+    def create_report():
+        report = location.reports.create(
+            reported_by=reporter, report_source="ca", appointment_tag=web
+        )
+        report.availability_tags.add(*yes_tags)
+        return report
+
+    # Without coalescing: once for the report, once for the tags
+    create_report()
+    assert calls == [location.pk, location.pk]
+
+    calls.clear()
+    with coalesce_location_denormalizations():
+        report = create_report()
+        # Not updated until the block exits
+        assert calls == []
+    assert calls == [location.pk]
+    location.refresh_from_db()
+    assert location.dn_latest_yes_report == report
+    assert location.dn_yes_report_count == 2
+
+
+def test_coalesce_location_denormalizations_discarded_on_error(location):
+    reporter = Reporter.objects.get_or_create(external_id="auth0:reporter")[0]
+    web = AppointmentTag.objects.get(slug="web")
+    with pytest.raises(ValueError):
+        with coalesce_location_denormalizations():
+            location.reports.create(
+                reported_by=reporter, report_source="ca", appointment_tag=web
+            )
+            raise ValueError
+    # Later writes outside a block are applied immediately again
+    report = location.reports.create(
+        reported_by=reporter, report_source="ca", appointment_tag=web
+    )
+    location.refresh_from_db()
+    assert location.dn_latest_report == report
+
+
+@pytest.fixture
+def denormalization_triggers_installed(settings):
+    # DDL is transactional in Postgres, so this is rolled back with the test
+    denormalization_triggers.install_triggers()
+    settings.LOCATION_DENORMALIZATION_TRIGGERS = True
+
+
+def test_denormalization_triggers(
+    denormalization_triggers_installed, location, ten_locations, monkeypatch
+):
+    def fail(self):
+        assert False, "Python update_denormalizations() should not run"
+
+    monkeypatch.setattr(Location, "update_denormalizations", fail)
+    reporter = Reporter.objects.get_or_create(external_id="auth0:reporter")[0]
+    web = AppointmentTag.objects.get(slug="web")
+    plus_65 = AvailabilityTag.objects.get(slug="vaccinating_65_plus")
+    skip_call_back_later = AvailabilityTag.objects.get(slug="skip_call_back_later")
+
+    yes_report = location.reports.create(
+        reported_by=reporter,
+        report_source="ca",
+        appointment_tag=web,
+        created_at=timezone.now() - datetime.timedelta(days=1),
+    )
+    yes_report.availability_tags.add(plus_65)
+    # The instance is refreshed from the row the triggers updated
+    assert location.dn_latest_yes_report == yes_report
+    skip_report = location.reports.create(
+        reported_by=reporter, report_source="ca", appointment_tag=web
+    )
+    skip_report.availability_tags.add(skip_call_back_later)
+    location.refresh_from_db()
+    assert location.dn_latest_report == skip_report
+    assert location.dn_latest_yes_report == yes_report
+    assert location.dn_latest_skip_report == skip_report
+    assert location.dn_latest_non_skip_report == yes_report
+    assert location.dn_skip_report_count == 1
+    assert location.dn_yes_report_count == 1
+
+    # Bulk updates that bypass Report.save() are covered too
+    other_location = ten_locations[0]
+    location.reports.filter(pk=skip_report.pk).update(location=other_location)
+    location.refresh_from_db()
+    other_location.refresh_from_db()
+    assert location.dn_latest_report == yes_report
+    assert location.dn_latest_skip_report is None
+    assert location.dn_skip_report_count == 0
+    assert other_location.dn_latest_skip_report == skip_report
+    assert other_location.dn_skip_report_count == 1
+
+    yes_report.availability_tags.clear()
+    location.refresh_from_db()
+    assert location.dn_latest_yes_report is None
+    assert location.dn_yes_report_count == 0
+
+    Report.objects.filter(pk__in=(yes_report.pk, skip_report.pk)).delete()
+    location.refresh_from_db()
+    other_location.refresh_from_db()
+    assert location.dn_latest_report is None
+    assert other_location.dn_latest_report is None
+    assert other_location.dn_skip_report_count == 0
+    assert (
+        denormalization_triggers.find_inconsistent_locations(
+            [location.pk, other_location.pk]
+        )
+        == {}
+    )
+
+
+def test_check_location_denormalizations(location):
+    reporter = Reporter.objects.get_or_create(external_id="auth0:reporter")[0]
+    web = AppointmentTag.objects.get(slug="web")
+    report = location.reports.create(
+        reported_by=reporter, report_source="ca", appointment_tag=web
+    )
+    # Break the denormalized columns behind Python's back
+    Location.objects.filter(pk=location.pk).update(
+        dn_latest_report=None, dn_yes_report_count=3
+    )
+    out = StringIO()
+    call_command("check_location_denormalizations", stdout=out)
+    assert (
+        "Location {}: dn_latest_report_id is None, expected {}, "
+        "dn_yes_report_count is 3, expected 0".format(location.pk, report.pk)
+    ) in out.getvalue()
+    assert "Checked 1 locations, 1 inconsistent" in out.getvalue()
+
+    out = StringIO()
+    call_command("check_location_denormalizations", "--fix", stdout=out)
+    assert "1 inconsistent (fixed)" in out.getvalue()
+    location.refresh_from_db()
+    assert location.dn_latest_report == report
+    assert location.dn_yes_report_count == 0
+    assert denormalization_triggers.find_inconsistent_locations([location.pk]) == {}
+
+
+def test_rebuild_location_denormalizations(location, ten_locations):
+    reporter = Reporter.objects.get_or_create(external_id="auth0:reporter")[0]
+    web = AppointmentTag.objects.get(slug="web")
+    report = location.reports.create(
+        reported_by=reporter, report_source="ca", appointment_tag=web
+    )
+    Location.objects.filter(pk=location.pk).update(
+        dn_latest_report=None, vaccines_offered=["Moderna"]
+    )
+
+    out = StringIO()
+    call_command(
+        "rebuild_location_denormalizations", "--dry-run", "--workers=1", stdout=out
+    )
+    output = out.getvalue()
+    assert (
+        "Location {}: dn_latest_report_id is None, expected {}, "
+        "vaccines_offered is ['Moderna'], expected None".format(location.pk, report.pk)
+    ) in output
+    assert "11/11 locations checked (100%), 1 differ" in output
+    assert "Found differences in 1 of 11 locations" in output
+    location.refresh_from_db()
+    assert location.dn_latest_report is None
+
+    out = StringIO()
+    call_command(
+        "rebuild_location_denormalizations",
+        "--workers=1",
+        "--chunk-size=3",
+        stdout=out,
+    )
+    assert "Updated 1 of 11 locations" in out.getvalue()
+    location.refresh_from_db()
+    assert location.dn_latest_report == report
+    assert location.vaccines_offered is None
+
+
+def test_dn_is_exportable(location):
+    reporter = Reporter.objects.get_or_create(external_id="auth0:reporter")[0]
+    web = AppointmentTag.objects.get(slug="web")
+    assert location.dn_is_exportable
+    report = location.reports.create(
+        reported_by=reporter,
+        report_source="ca",
+        appointment_tag=web,
+        planned_closure=datetime.date.today() + datetime.timedelta(days=1),
+    )
+    location.refresh_from_db()
+    assert location.dn_is_exportable
+    report.availability_tags.add(AvailabilityTag.objects.get(slug="only_staff"))
+    location.refresh_from_db()
+    assert not location.dn_is_exportable
+    report.availability_tags.clear()
+    location.refresh_from_db()
+    assert location.dn_is_exportable
+    # The planned closure date passing does not write anything
+    Report.objects.filter(pk=report.pk).update(
+        planned_closure=datetime.date.today() - datetime.timedelta(days=1)
+    )
+    location.refresh_from_db()
+    assert location.dn_is_exportable
+    assert Location.expire_planned_closures() == 1
+    location.refresh_from_db()
+    assert not location.dn_is_exportable
+    assert Location.expire_planned_closures() == 0
+    # The SQL version of update_denormalizations() agrees
+    assert denormalization_triggers.find_inconsistent_locations([location.pk]) == {}
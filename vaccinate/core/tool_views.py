@@ -37,14 +37,14 @@ def import_call_requests(request):
                     location__public_id__in=location_ids,
                     completed=False,
                 ).delete()[0]
-                CallRequest.insert(
+                num_inserted = CallRequest.insert(
                     locations=locations,
                     reason="Imported",
                     priority_group=group_id,
                 )
                 messages.append(
                     "Added {} locations to priority {} (deleted {} existing call requests)".format(
-                        len(locations), group_name, num_deleted
+                        num_inserted, group_name, num_deleted
                     )
                 )
     return render(
@@ -108,7 +108,7 @@ def bulk_delete_reports(request):
                 locations_qs = Location.objects.filter(pk__in=location_ids)
                 for location in locations_qs:
                     location.update_denormalizations()
-                    location.derive_details(save=True)
+                Location.derive_details_bulk(location_ids)
                 message = (
                     "Delete complete - {} affected locations have been updated".format(
                         locations_qs.count()
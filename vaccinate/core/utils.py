@@ -1,3 +1,12 @@
+import threading
+from typing import Optional
+
+from timezonefinder import TimezoneFinder
+
+_timezone_finder: Optional[TimezoneFinder] = None
+_timezone_finder_lock = threading.Lock()
+
+
 def keyset_pagination_iterator(input_queryset, batch_size=500, stop_after=None):
     all_queryset = input_queryset.order_by("pk")
     last_pk = None
@@ -15,3 +24,14 @@ def keyset_pagination_iterator(input_queryset, batch_size=500, stop_after=None):
                 return
         if not queryset:
             break
+
+
+def timezone_for_point(latitude, longitude) -> Optional[str]:
+    "IANA timezone name for a point, e.g. America/Los_Angeles"
+    # TimezoneFinder() loads large data files, so share one per process
+    global _timezone_finder
+    if _timezone_finder is None:
+        with _timezone_finder_lock:
+            if _timezone_finder is None:
+                _timezone_finder = TimezoneFinder()
+    return _timezone_finder.timezone_at(lng=float(longitude), lat=float(latitude))